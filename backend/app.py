@@ -1,25 +1,82 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
 import os
+import atexit
 from datetime import datetime
+from urllib.parse import quote
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from services.email_service import EmailService
-from services.llm_service import LLMService
+from services.llm_service import LLMService, PROMPT_WRAPPERS
+from services.rate_limiter import RateLimiter
+from services.prompt_templates import TemplateError
 from services.prompt_service import PromptService
+from services.intent_router import QueryPlanner
+from services.chat_context import ChatContext
+from services.vector_index import VectorIndex
+from services.conversation_service import ConversationService
+from services.precompute_service import PrecomputeService
+from services.email_preprocessor import llm_body
+from services.evaluation_service import EvaluationService
+from services.job_service import JobService
+from services.thread_service import ThreadService
+from services.mail_importer import MailImporter
+from services.imap_sync import ImapSync, SyncInProgressError
+from services.blob_store import BlobStore
+from services.write_queue import WriteQueue
+from services.record_cache import RecordCache
+from services.tracing_service import TracingService, trace_span
+from services import response_encoding
 from models.database import Database
 
+
+class TracedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with trace_span('json'):
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        with trace_span('json'):
+            return super().loads(s, **kwargs)
+
+
 app = Flask(__name__)
+app.json = TracedJSONProvider(app)
 CORS(app)
+tracing_service = TracingService(app)
+
+@app.after_request
+def compress_response(response):
+    return response_encoding.compress_response(response, request.accept_encodings)
 
 # Initialize services
-db = Database()
-email_service = EmailService(db)
-llm_service = LLMService()
+db = Database(span=trace_span)
+# One writer thread group-commits processing results, drafts and job counters
+write_queue = WriteQueue(db)
+atexit.register(write_queue.close)
+vector_index = VectorIndex()
+blob_store = BlobStore()
+record_cache = RecordCache(db)
+thread_service = ThreadService(db, cache=record_cache)
+email_service = EmailService(db, vector_index, thread_service, blob_store, write_queue, record_cache)
+# LLM_RATE_LIMIT_SHARED=1 shares the RPM/TPM buckets with worker.py processes
+llm_service = LLMService(rate_limiter=RateLimiter.from_env(db))
 prompt_service = PromptService(db)
+query_planner = QueryPlanner(email_service)
+conversation_service = ConversationService(db, llm_service)
+precompute_service = PrecomputeService(db, llm_service, prompt_service, write_queue)
+# Set JOB_INLINE_WORKER=0 to leave job processing to separate worker.py processes
+job_service = JobService(db, llm_service, email_service, prompt_service, precompute_service,
+                         inline=os.getenv('JOB_INLINE_WORKER', '1') != '0', thread_service=thread_service,
+                         write_queue=write_queue)
+# Configured with IMAP_HOST etc.; None when no IMAP account is set up
+imap_sync = ImapSync.from_env(db, MailImporter(db, thread_service, vector_index, blob_store=blob_store))
+# Prompt evaluation always uses the offline stub, never the live API
+evaluation_service = EvaluationService(LLMService(offline=True))
 
 # Health check
 @app.route('/health', methods=['GET'])
@@ -30,8 +87,7 @@ def health_check():
 @app.route('/api/emails', methods=['GET'])
 def get_emails():
     try:
-        emails = email_service.get_all_emails()
-        return jsonify({"emails": emails}), 200
+        return versioned_json(table_etag('emails'), lambda: {"emails": email_service.get_all_emails()})
     except Exception as e:
         print(f"Error in get_emails: {e}")
         return jsonify({"error": str(e)}), 500
@@ -47,6 +103,94 @@ def get_email(email_id):
         print(f"Error in get_email: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/emails/<int:email_id>/attachments', methods=['GET'])
+def get_email_attachments(email_id):
+    try:
+        if not email_service.get_email_by_id(email_id):
+            return jsonify({"error": "Email not found"}), 404
+        return jsonify({"attachments": email_service.get_attachments(email_id)}), 200
+    except Exception as e:
+        print(f"Error in get_email_attachments: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/emails/<int:email_id>/raw', methods=['GET'])
+def get_email_raw(email_id):
+    try:
+        email = email_service.get_email_by_id(email_id)
+        if not email:
+            return jsonify({"error": "Email not found"}), 404
+        if not email.get('raw_blob'):
+            return jsonify({"error": "Raw message not stored for this email"}), 404
+        return blob_response(email['raw_blob'], 'message/rfc822', f"email-{email_id}.eml")
+    except Exception as e:
+        print(f"Error in get_email_raw: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/attachments/<int:attachment_id>', methods=['GET'])
+def get_attachment(attachment_id):
+    try:
+        attachment = email_service.get_attachment(attachment_id)
+        if not attachment:
+            return jsonify({"error": "Attachment not found"}), 404
+        return blob_response(attachment['blob_hash'], attachment['content_type'],
+                             attachment['filename'] or f"attachment-{attachment_id}")
+    except Exception as e:
+        print(f"Error in get_attachment: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def blob_response(blob_hash, mimetype, filename):
+    """Stream a blob from memory-mapped pages, honouring single byte ranges and If-None-Match.
+    
+    Blobs never change, so their hash is a strong ETag.
+    """
+    if not blob_store.exists(blob_hash):
+        return jsonify({"error": "Blob missing from the blob store"}), 404
+    size = blob_store.size(blob_hash)
+    headers = {
+        'ETag': f'"{blob_hash}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=86400',
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+    }
+    if request.if_none_match.contains(blob_hash):
+        return Response(status=304, headers=headers)
+    
+    start, end, status = 0, size, 200
+    if request.range is not None:
+        # Multi-range requests get None here and the whole blob, which RFC 9110 allows
+        byte_range = request.range.range_for_length(size) if len(request.range.ranges) == 1 else None
+        if byte_range is None and len(request.range.ranges) == 1:
+            return Response(status=416, headers=dict(headers, **{'Content-Range': f'bytes */{size}'}))
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    headers['Content-Length'] = str(end - start)
+    return Response(blob_store.iter_range(blob_hash, start, end), status=status, headers=headers,
+                    mimetype=mimetype, direct_passthrough=True)
+
+def versioned_json(tag, build):
+    """JSON from ``build()`` with a weak ETag, or 304 if the client already holds ``tag``.
+    
+    ``tag`` is built from ``table_versions`` counters, so revalidating costs one
+    small query and no serialisation. The body skips jsonify's debug-mode
+    indentation and key sorting and uses orjson when it is installed.
+    """
+    headers = {'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304, headers=headers)
+    else:
+        data = build()
+        with trace_span('json'):
+            body = response_encoding.dumps(data)
+        response = Response(body, headers=headers, mimetype='application/json')
+    response.set_etag(tag, weak=True)
+    return response
+
+def table_etag(table):
+    versions = db.get_table_versions()
+    return f"{versions['database']}-{table}.{versions[table]}"
+
 @app.route('/api/emails/load', methods=['POST'])
 def load_inbox():
     try:
@@ -69,65 +213,131 @@ def process_emails():
         data = request.get_json() if request.is_json else {}
         email_ids = data.get('email_ids', None)
         
-        if email_ids:
-            emails = [email_service.get_email_by_id(eid) for eid in email_ids]
-            emails = [e for e in emails if e is not None]
-        else:
-            emails = email_service.get_all_emails()
-        
-        # Get prompts
-        prompts = prompt_service.get_all_prompts()
-        
-        results = []
-        for email in emails:
-            if not email:
-                continue
-            
-            try:
-                # Categorize email
-                category = llm_service.categorize_email(
-                    email['subject'] + " " + email['body'],
-                    prompts['categorization']
-                )
-                
-                # Extract action items
-                action_items = llm_service.extract_action_items(
-                    email['body'],
-                    prompts['action_item']
-                )
-                
-                # Update email in database
-                email_service.update_email(
-                    email['id'],
-                    category=category,
-                    action_items=action_items
-                )
-                
-                results.append({
-                    "email_id": email['id'],
-                    "category": category,
-                    "action_items": action_items
-                })
-            except Exception as e:
-                print(f"Error processing email {email['id']}: {e}")
-                continue
-        
+        # Runs in the background; poll GET /api/jobs/<id> for progress.
+        # A job that reaches its token/cost budget pauses until resumed.
+        job = job_service.submit(
+            email_ids,
+            token_budget=data.get('token_budget'),
+            cost_budget=data.get('cost_budget_usd')
+        )
         return jsonify({
-            "message": "Emails processed successfully",
-            "results": results
-        }), 200
+            "message": f"Processing {job['total']} email(s)",
+            "job_id": job['id'],
+            "job": job
+        }), 202
     except Exception as e:
         print(f"Error in process_emails: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/emails/sync', methods=['POST'])
+def sync_inbox():
+    try:
+        if imap_sync is None:
+            return jsonify({"error": "No IMAP account configured; set IMAP_HOST, IMAP_USER and IMAP_PASSWORD"}), 400
+        try:
+            folders = imap_sync.sync()
+        except SyncInProgressError as e:
+            return jsonify({"error": str(e)}), 409
+        imported = sum(result['imported'] for result in folders.values())
+        # Pick up anything the import CLIs stored since the last sync, which they leave unindexed
+        email_service.index_missing()
+        return jsonify({
+            "message": f"Imported {imported} new email(s)",
+            "count": imported,
+            "folders": folders
+        }), 200
+    except Exception as e:
+        print(f"Error in sync_inbox: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/threads/<int:thread_id>', methods=['GET'])
+def get_thread(thread_id):
+    try:
+        thread = thread_service.get_thread(thread_id)
+        if thread:
+            thread['emails'] = email_service.get_emails_in_thread(thread_id)
+            return jsonify(thread), 200
+        return jsonify({"error": "Thread not found"}), 404
+    except Exception as e:
+        print(f"Error in get_thread: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Job endpoints
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    try:
+        return jsonify({"jobs": job_service.get_jobs(limit=request.args.get('limit', 20, type=int))}), 200
+    except Exception as e:
+        print(f"Error in get_jobs: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = job_service.get_job(job_id)
+        if job:
+            return jsonify(job), 200
+        return jsonify({"error": "Job not found"}), 404
+    except Exception as e:
+        print(f"Error in get_job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        job = job_service.cancel(job_id)
+        if job:
+            return jsonify(job), 200
+        return jsonify({"error": "Job not found"}), 404
+    except Exception as e:
+        print(f"Error in cancel_job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<int:job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    try:
+        if not job_service.get_job(job_id):
+            return jsonify({"error": "Job not found"}), 404
+        data = request.get_json() if request.is_json else {}
+        job = job_service.resume(
+            job_id,
+            token_budget=data.get('token_budget'),
+            cost_budget=data.get('cost_budget_usd')
+        )
+        return jsonify(job), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in resume_job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/llm/scheduler', methods=['GET'])
+def get_llm_scheduler():
+    try:
+        stats = llm_service.scheduler.stats()
+        stats['rate_limits'] = llm_service.rate_limiter.stats()
+        return jsonify(stats), 200
+    except Exception as e:
+        print(f"Error in get_llm_scheduler: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    try:
+        return jsonify({"write_queue": write_queue.stats(), "cache": record_cache.stats()}), 200
+    except Exception as e:
+        print(f"Error in get_db_stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # Prompt endpoints
 @app.route('/api/prompts', methods=['GET'])
 def get_prompts():
     try:
-        prompts = prompt_service.get_all_prompts()
-        return jsonify(prompts), 200
+        prompts, version = prompt_service.get_prompts_with_version()
+        database_id = db.get_table_versions()['database']
+        return versioned_json(f"{database_id}-prompts.{version}", lambda: prompts)
     except Exception as e:
         print(f"Error in get_prompts: {e}")
         return jsonify({"error": str(e)}), 500
@@ -139,12 +349,80 @@ def update_prompts():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
-        prompt_service.update_prompts(data)
-        return jsonify({"message": "Prompts updated successfully"}), 200
+        # Reject unknown variables and prompts that leave no room for the email
+        for prompt_type, prompt_text in data.items():
+            try:
+                llm_service.templates.validate(prompt_text, PROMPT_WRAPPERS.get(prompt_type))
+            except TemplateError as e:
+                return jsonify({"error": f"Invalid {prompt_type} prompt: {e}"}), 400
+        
+        version = prompt_service.update_prompts(data)
+        return jsonify({"message": "Prompts updated successfully", "version": version}), 200
     except Exception as e:
         print(f"Error in update_prompts: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/prompts/versions', methods=['GET'])
+def get_prompt_versions():
+    try:
+        return jsonify({
+            "current_version": prompt_service.get_current_version(),
+            "versions": prompt_service.get_versions()
+        }), 200
+    except Exception as e:
+        print(f"Error in get_prompt_versions: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/prompts/versions/<int:version>', methods=['GET'])
+def get_prompt_version(version):
+    try:
+        snapshot = prompt_service.get_version(version)
+        if snapshot:
+            return jsonify(snapshot), 200
+        return jsonify({"error": "Prompt version not found"}), 404
+    except Exception as e:
+        print(f"Error in get_prompt_version: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/prompts/rollback', methods=['POST'])
+def rollback_prompts():
+    try:
+        data = request.get_json()
+        if not data or 'version' not in data:
+            return jsonify({"error": "No version provided"}), 400
+        
+        version = prompt_service.rollback(data['version'])
+        return jsonify({"message": f"Prompts rolled back to version {data['version']}", "version": version}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"Error in rollback_prompts: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/prompts/evaluate', methods=['POST'])
+def evaluate_prompts():
+    try:
+        candidate = dict(prompt_service.get_all_prompts())
+        candidate.update(request.get_json(silent=True) or {})
+        
+        for prompt_type in ('categorization', 'action_item'):
+            try:
+                llm_service.templates.validate(candidate[prompt_type], PROMPT_WRAPPERS[prompt_type])
+            except TemplateError as e:
+                return jsonify({"error": f"Invalid {prompt_type} prompt: {e}"}), 400
+        
+        # Scored offline against the golden set, relative to the current prompts
+        baseline = evaluation_service.run(prompt_service.get_all_prompts())
+        report = evaluation_service.run(candidate)
+        return jsonify({
+            "report": report,
+            "baseline": {k: v for k, v in baseline.items() if k != 'results'},
+            "regressions": evaluation_service.compare(report, baseline)
+        }), 200
+    except Exception as e:
+        print(f"Error in evaluate_prompts: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/prompts/<prompt_type>', methods=['GET'])
 def get_prompt(prompt_type):
     try:
@@ -164,24 +442,34 @@ def agent_chat():
         
         query = data.get('query', '')
         email_id = data.get('email_id', None)
+        session_id = data.get('session_id', None)
         
-        # Get context
-        context = {}
-        if email_id:
-            email = email_service.get_email_by_id(email_id)
-            context['email'] = email
+        # Follow-up questions reuse the server-side session; start one if needed
+        if not session_id or not conversation_service.session_exists(session_id):
+            session_id = conversation_service.create_session()
         
-        # Get all emails for general queries
-        context['all_emails'] = email_service.get_all_emails()
+        intent = llm_service.intent_router.route(query, has_email=bool(email_id))
         
-        # Get prompts
-        prompts = prompt_service.get_all_prompts()
+        # Structured questions are answered with indexed SQL, no LLM call
+        if intent.is_structured:
+            response = query_planner.answer(intent)
+        else:
+            # Context is loaded on demand, scoped to what the intent needs
+            context = ChatContext(email_service, prompt_service, email_id=email_id, intent=intent,
+                                  query=query, vector_index=vector_index,
+                                  conversation_service=conversation_service, session_id=session_id,
+                                  precompute_service=precompute_service)
+            response = llm_service.process_chat_query(query, context, intent=intent)
         
-        # Process query with LLM
-        response = llm_service.process_chat_query(query, context, prompts)
+        conversation_service.add_messages(session_id, [
+            {'role': 'user', 'content': query},
+            {'role': 'assistant', 'content': response}
+        ])
         
         return jsonify({
             "response": response,
+            "session_id": session_id,
+            "intent": intent.to_dict(),
             "timestamp": datetime.now().isoformat()
         }), 200
     except Exception as e:
@@ -190,12 +478,31 @@ def agent_chat():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/agent/sessions/<int:session_id>', methods=['GET'])
+def get_chat_session(session_id):
+    try:
+        session = conversation_service.get_session(session_id)
+        if session:
+            return jsonify(session), 200
+        return jsonify({"error": "Session not found"}), 404
+    except Exception as e:
+        print(f"Error in get_chat_session: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/agent/sessions/<int:session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    try:
+        conversation_service.delete_session(session_id)
+        return jsonify({"message": "Session deleted successfully"}), 200
+    except Exception as e:
+        print(f"Error in delete_chat_session: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # Draft endpoints
 @app.route('/api/drafts', methods=['GET'])
 def get_drafts():
     try:
-        drafts = email_service.get_all_drafts()
-        return jsonify({"drafts": drafts}), 200
+        return versioned_json(table_etag('drafts'), lambda: {"drafts": email_service.get_all_drafts()})
     except Exception as e:
         print(f"Error in get_drafts: {e}")
         return jsonify({"error": str(e)}), 500
@@ -264,21 +571,29 @@ def generate_draft():
             return jsonify({"error": "Email not found"}), 404
         
         # Get auto-reply prompt
-        prompts = prompt_service.get_all_prompts()
+        prompts, prompt_version = prompt_service.get_prompts_with_version()
+        
+        # Use the background-precomputed draft when there are no custom instructions
+        draft_body = None
+        if not custom_instructions:
+            draft_body = precompute_service.get_draft(email, prompts['auto_reply'])
+        precomputed = draft_body is not None
         
         # Generate draft
-        draft_body = llm_service.generate_reply(
-            email['body'],
-            prompts['auto_reply'],
-            custom_instructions
-        )
+        if not precomputed:
+            draft_body = llm_service.generate_reply(
+                llm_body(email),
+                prompts['auto_reply'],
+                custom_instructions,
+                email=email
+            )
         
         # Create draft
         draft_id = email_service.create_draft(
             email_id=email_id,
             subject=f"Re: {email['subject']}",
             body=draft_body,
-            metadata={"generated": True}
+            metadata={"generated": True, "precomputed": precomputed, "prompt_version": prompt_version}
         )
         
         return jsonify({
@@ -295,8 +610,96 @@ def generate_draft():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/drafts/generate/batch', methods=['POST'])
+def generate_drafts_batch():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        
+        email_ids = data.get('email_ids')
+        email_filter = data.get('filter')
+        custom_instructions = data.get('instructions', '')
+        
+        # Select emails either by id or by filter, e.g.
+        # {"filter": {"categories": ["To-Do"], "keywords": ["meeting"]}}
+        if email_ids:
+            emails = email_service.get_emails_by_ids(email_ids)
+        elif email_filter:
+            emails = email_service.find_emails_matching(
+                categories=email_filter.get('categories'),
+                keywords=email_filter.get('keywords'),
+                limit=email_filter.get('limit')
+            )
+        else:
+            return jsonify({"error": "Provide email_ids or filter"}), 400
+        
+        # Can only lower the parallelism; LLM_MAX_CONCURRENCY is the ceiling
+        concurrency = data.get('concurrency')
+        if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+            return jsonify({"error": "concurrency must be a positive integer"}), 400
+        
+        prompts, prompt_version = prompt_service.get_prompts_with_version()
+        
+        replies = llm_service.generate_replies(
+            emails,
+            prompts['auto_reply'],
+            custom_instructions,
+            max_workers=concurrency
+        )
+        
+        results = []
+        new_drafts = []
+        for email, reply in zip(emails, replies):
+            if isinstance(reply, Exception):
+                print(f"Error generating draft for email {email['id']}: {reply}")
+                results.append({"email_id": email['id'], "status": "error", "error": str(reply)})
+                continue
+            
+            new_drafts.append({
+                "email_id": email['id'],
+                "subject": f"Re: {email['subject']}",
+                "body": reply,
+                "metadata": {"generated": True, "batch": True, "prompt_version": prompt_version}
+            })
+            results.append({"email_id": email['id'], "status": "created"})
+        
+        # All successful drafts land in a single transaction
+        draft_ids = iter(email_service.create_drafts(new_drafts))
+        for result in results:
+            if result['status'] == 'created':
+                result['draft_id'] = next(draft_ids)
+        
+        found_ids = {email['id'] for email in emails}
+        for email_id in email_ids or []:
+            if email_id not in found_ids:
+                results.append({"email_id": email_id, "status": "not_found"})
+        
+        created = sum(1 for r in results if r['status'] == 'created')
+        return jsonify({
+            "message": f"Generated {created} of {len(results)} draft(s)",
+            "results": results
+        }), 201 if created else 200
+    except Exception as e:
+        print(f"Error in generate_drafts_batch: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     print("Initializing database...")
     db.initialize()
+    cleaned = email_service.preprocess_missing()
+    if cleaned:
+        print(f"Cleaned {cleaned} emails stored before the current body cleaning")
+    threaded = thread_service.assign_missing()
+    if threaded:
+        print(f"Grouped {threaded} emails stored before threading existed into threads")
+    indexed = email_service.index_missing()
+    if indexed:
+        print(f"Indexed {indexed} emails missing from the vector index")
+    # With the debug reloader, only the serving child process runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_service.resume_incomplete()
     print("Starting Flask server...")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
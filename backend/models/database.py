@@ -1,16 +1,20 @@
 import sqlite3
 import json
 import os
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 
 
 class Database:
-    def __init__(self, db_path='data/email_agent.db'):
+    def __init__(self, db_path='data/email_agent.db', span=None):
         self.db_path = db_path
+        # span(name) times each statement, e.g. the request tracer's trace_span; a no-op by default
+        self.span = span or nullcontext
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+        # Worker processes share the file, so wait for locks instead of failing at once
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row  
         return conn
     
@@ -18,6 +22,9 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets readers proceed while a worker process is writing
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create emails table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS emails (
@@ -33,6 +40,11 @@ class Database:
             )
         ''')
         
+        # Indexes backing the chat agent's structured queries
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_timestamp ON emails(timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_category_timestamp ON emails(category, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails(sender)')
+        
         # Create prompts table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS prompts (
@@ -57,6 +69,208 @@ class Database:
             )
         ''')
         
+        # Create chat session tables; older turns are folded into the rolling summary
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                summary TEXT DEFAULT '',
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                summarized INTEGER DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (session_id) REFERENCES chat_sessions(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages(session_id, summarized, id)')
+        
+        # Create table for speculatively precomputed summaries and drafts
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS precomputed_results (
+                cache_key TEXT PRIMARY KEY,
+                email_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (email_id) REFERENCES emails(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_precomputed_email ON precomputed_results(email_id, kind)')
+        
+        # Create prompt history table; each row is a full snapshot of the prompt set
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_versions (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                prompts TEXT NOT NULL,
+                note TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Create background processing jobs; job_items checkpoints each email
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                prompt_version INTEGER,
+                prompts TEXT,
+                total INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                run_started_at TEXT,
+                run_start_done INTEGER NOT NULL DEFAULT 0,
+                finished_at TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id INTEGER NOT NULL,
+                email_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                finished_at TEXT,
+                PRIMARY KEY (job_id, email_id),
+                FOREIGN KEY (job_id) REFERENCES jobs(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_items_status ON job_items(job_id, status, position)')
+        # Lease columns let several worker processes share the queue
+        self._add_column_if_missing(cursor, 'job_items', 'lease_owner', 'TEXT')
+        self._add_column_if_missing(cursor, 'job_items', 'lease_expires_at', 'REAL')
+        self._add_column_if_missing(cursor, 'job_items', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+        # 'urgent', 'recent' or 'backlog'; decides the email's LLM scheduling class
+        self._add_column_if_missing(cursor, 'job_items', 'priority', "TEXT NOT NULL DEFAULT 'backlog'")
+        # Per-run spend; a job that reaches its budget is paused until resumed
+        self._add_column_if_missing(cursor, 'jobs', 'token_budget', 'INTEGER')
+        self._add_column_if_missing(cursor, 'jobs', 'cost_budget', 'REAL')
+        self._add_column_if_missing(cursor, 'jobs', 'tokens_used', 'INTEGER NOT NULL DEFAULT 0')
+        self._add_column_if_missing(cursor, 'jobs', 'cost_used', 'REAL NOT NULL DEFAULT 0')
+        # Set once an item passes the budget check, so only started emails count as committed spend
+        self._add_column_if_missing(cursor, 'job_items', 'started_at', 'REAL')
+
+        # Shared LLM rate-limit buckets, used when LLM_RATE_LIMIT_SHARED=1
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+        # Body as sent to the LLM: plain text without quotes, signatures or boilerplate
+        self._add_column_if_missing(cursor, 'emails', 'body_clean', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'body_clean_version', 'INTEGER')
+        
+        # Record which prompt version produced each email's category/action items
+        self._add_column_if_missing(cursor, 'emails', 'prompt_version', 'INTEGER')
+
+        # Threading headers; reference_ids holds the References header as given
+        self._add_column_if_missing(cursor, 'emails', 'message_id', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'in_reply_to', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'reference_ids', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'thread_id', 'INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_message_id ON emails(message_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_thread ON emails(thread_id, timestamp)')
+
+        # Conversation threads; summary covers the thread up to summary_through (an email timestamp)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS threads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                participants TEXT NOT NULL DEFAULT '[]',
+                message_count INTEGER NOT NULL DEFAULT 0,
+                first_timestamp TEXT,
+                last_timestamp TEXT,
+                summary TEXT,
+                summary_through TEXT,
+                category TEXT,
+                prompt_version INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_threads_subject ON threads(subject, last_timestamp)')
+
+        # Ingest identity: reloads match rows on message_id, else on content_hash, within a source
+        self._add_column_if_missing(cursor, 'emails', 'content_hash', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'source', 'TEXT')
+        # Set when an email disappears from its source; the row stays so drafts keep their link
+        self._add_column_if_missing(cursor, 'emails', 'deleted_at', 'TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_emails_content_hash ON emails(content_hash)')
+        # One row per message even when imports and syncs overlap; writers insert with ON CONFLICT DO NOTHING
+        self._add_unique_email_identity(cursor)
+
+        # IMAP sync watermark per account and folder; a new UIDVALIDITY invalidates last_uid
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imap_folders (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                synced_at TEXT,
+                PRIMARY KEY (account, folder)
+            )
+        ''')
+
+        # Attachment bytes and large raw messages live in the blob store (data/blobs), keyed by SHA-256;
+        # only the metadata is kept here so SELECT * on emails stays cheap
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attachments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id INTEGER NOT NULL,
+                filename TEXT,
+                content_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                blob_hash TEXT NOT NULL,
+                FOREIGN KEY (email_id) REFERENCES emails(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attachments_email ON attachments(email_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attachments_blob ON attachments(blob_hash)')
+        self._add_column_if_missing(cursor, 'emails', 'raw_blob', 'TEXT')
+        self._add_column_if_missing(cursor, 'emails', 'raw_size', 'INTEGER')
+
+        # Change counters per table, bumped by triggers on every write from any process;
+        # RecordCache compares them to notice writes it wasn't told about
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # A random id per database file, so ETags built from the counters never repeat after it is recreated
+        cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('database', random() & 2147483647)")
+        for table in ('emails', 'drafts'):
+            cursor.execute('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)', (table,))
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                    END
+                ''')
+
+        # A job item covers the unprocessed messages of one thread
+        self._add_column_if_missing(cursor, 'job_items', 'thread_id', 'INTEGER')
+        self._add_column_if_missing(cursor, 'job_items', 'email_count', 'INTEGER NOT NULL DEFAULT 1')
+
         # Initialize default prompts if they don't exist
         default_prompts = [
             (
@@ -90,23 +304,86 @@ class Database:
                 VALUES (?, ?)
             ''', (prompt_type, prompt_text))
         
+        # Seed the history with the starting prompt set
+        cursor.execute('SELECT COUNT(*) AS count FROM prompt_versions')
+        if cursor.fetchone()['count'] == 0:
+            cursor.execute('SELECT prompt_type, prompt_text FROM prompts')
+            prompts = {row['prompt_type']: row['prompt_text'] for row in cursor.fetchall()}
+            cursor.execute(
+                'INSERT INTO prompt_versions (prompts, note) VALUES (?, ?)',
+                (json.dumps(prompts), 'initial')
+            )
+        
+        self._escape_legacy_prompts(cursor)
+        
         conn.commit()
         conn.close()
         print("Database initialized successfully")
         print(f"Database location: {os.path.abspath(self.db_path)}")
     
+    def _add_column_if_missing(self, cursor, table_name, column, definition):
+        cursor.execute(f'PRAGMA table_info({table_name})')
+        if column not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column} {definition}')
+    
+    def _escape_legacy_prompts(self, cursor):
+        cursor.execute('PRAGMA table_info(prompts)')
+        if 'template_syntax' in [row['name'] for row in cursor.fetchall()]:
+            return
+        # Before templating "{{" and "}}" were literal text; now they are escapes, so
+        # saved prompts and snapshots get them doubled to render exactly as before
+        def escape(text):
+            return text.replace('{{', '{{{{').replace('}}', '}}}}')
+        
+        cursor.execute('SELECT prompt_type, prompt_text FROM prompts')
+        cursor.executemany(
+            'UPDATE prompts SET prompt_text = ? WHERE prompt_type = ?',
+            [(escape(row['prompt_text']), row['prompt_type']) for row in cursor.fetchall()]
+        )
+        cursor.execute('SELECT version, prompts FROM prompt_versions')
+        cursor.executemany(
+            'UPDATE prompt_versions SET prompts = ? WHERE version = ?',
+            [(json.dumps({name: escape(text) for name, text in json.loads(row['prompts']).items()}), row['version'])
+             for row in cursor.fetchall()]
+        )
+        # Rows written from now on use the template syntax
+        cursor.execute('ALTER TABLE prompts ADD COLUMN template_syntax INTEGER NOT NULL DEFAULT 1')
+    
+    def _add_unique_email_identity(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_emails_unique_message_id'")
+        if cursor.fetchone() is None:
+            # Copies stored before the constraint existed are hidden and renamed out of its way
+            cursor.execute('''
+                UPDATE emails SET message_id = message_id || '#duplicate-' || id,
+                                  deleted_at = COALESCE(deleted_at, CURRENT_TIMESTAMP)
+                WHERE message_id IS NOT NULL
+                  AND id NOT IN (SELECT MIN(id) FROM emails WHERE message_id IS NOT NULL GROUP BY message_id)
+            ''')
+            cursor.execute('''
+                UPDATE emails SET content_hash = content_hash || '#duplicate-' || id,
+                                  deleted_at = COALESCE(deleted_at, CURRENT_TIMESTAMP)
+                WHERE message_id IS NULL AND content_hash IS NOT NULL
+                  AND id NOT IN (SELECT MIN(id) FROM emails WHERE message_id IS NULL AND content_hash IS NOT NULL
+                                 GROUP BY source, content_hash)
+            ''')
+        cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_emails_unique_message_id
+                          ON emails(message_id) WHERE message_id IS NOT NULL''')
+        cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_emails_unique_content
+                          ON emails(source, content_hash) WHERE message_id IS NULL''')
+    
     def execute_query(self, query, params=None):
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            results = cursor.fetchall()
-            conn.commit()
+            with self.span('db'):
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                results = cursor.fetchall()
+                conn.commit()
             return results
         except Exception as e:
             conn.rollback()
@@ -119,9 +396,10 @@ class Database:
         cursor = conn.cursor()
         
         try:
-            cursor.execute(query, params)
-            last_id = cursor.lastrowid
-            conn.commit()
+            with self.span('db'):
+                cursor.execute(query, params)
+                last_id = cursor.lastrowid
+                conn.commit()
             return last_id
         except Exception as e:
             conn.rollback()
@@ -129,6 +407,25 @@ class Database:
         finally:
             conn.close()
     
+    @contextmanager
+    def transaction(self):
+        """Yield a connection whose statements commit together or not at all."""
+        conn = self.get_connection()
+        try:
+            with self.span('db'):
+                yield conn
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def get_table_versions(self):
+        """{name: change counter} from ``table_versions``, plus the per-file ``database`` id."""
+        rows = self.execute_query('SELECT name, version FROM table_versions')
+        return {row['name']: row['version'] for row in rows}
+    
     def row_to_dict(self, row):
         if row is None:
             return None
@@ -1,5 +1,16 @@
 from .email_service import EmailService
 from .llm_service import LLMService
 from .prompt_service import PromptService
+from .intent_router import IntentRouter, QueryPlanner
+from .chat_context import ChatContext
+from .vector_index import VectorIndex
+from .conversation_service import ConversationService
+from .precompute_service import PrecomputeService
+from .evaluation_service import EvaluationService
+from .job_service import JobService
+from .thread_service import ThreadService
+from .mail_importer import MailImporter
+from .imap_sync import ImapSync
+from .tracing_service import TracingService, trace_span
 
-__all__ = ['EmailService', 'LLMService', 'PromptService']
\ No newline at end of file
+__all__ = ['EmailService', 'LLMService', 'PromptService', 'IntentRouter', 'QueryPlanner', 'ChatContext', 'VectorIndex', 'ConversationService', 'PrecomputeService', 'EvaluationService', 'JobService', 'ThreadService', 'MailImporter', 'ImapSync', 'TracingService', 'trace_span']
\ No newline at end of file
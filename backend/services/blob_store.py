@@ -0,0 +1,79 @@
+import os
+import mmap
+import hashlib
+import tempfile
+
+
+CHUNK_SIZE = 64 * 1024
+HASH_LENGTH = 64
+
+
+class BlobStore:
+    """Content-addressed files for attachments and raw MIME, kept out of SQLite.
+
+    A blob is stored once under the SHA-256 of its bytes, fanned out over two
+    directory levels (``ab/cd/abcd...``) so no directory grows huge. Writing
+    goes to a temporary file that is renamed into place, so concurrent
+    writers - including importer worker processes - of the same content end
+    up with one complete file and readers never see a partial one. The
+    database only stores the hash next to its metadata (filename, type,
+    size). Reads are memory-mapped, so serving a byte range touches only the
+    pages it covers.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv('BLOB_DIR') or os.path.join('data', 'blobs')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, blob_hash):
+        if len(blob_hash) != HASH_LENGTH or not all(c in '0123456789abcdef' for c in blob_hash):
+            raise ValueError(f"Invalid blob hash: {blob_hash!r}")
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def put(self, data):
+        """Store ``data`` (bytes) unless identical content is already stored; returns its hash."""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_hash)
+        if not os.path.exists(path):
+            self._write(path, data)
+        return blob_hash
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def exists(self, blob_hash):
+        return os.path.exists(self.path(blob_hash))
+
+    def size(self, blob_hash):
+        return os.path.getsize(self.path(blob_hash))
+
+    def get(self, blob_hash):
+        with open(self.path(blob_hash), 'rb') as f:
+            return f.read()
+
+    def iter_range(self, blob_hash, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Yield bytes ``start``..``end`` (exclusive; default: to the end) of a blob in chunks.
+
+        The file is memory-mapped and closed when the generator finishes or
+        is closed, e.g. when a client disconnects mid-download.
+        """
+        with open(self.path(blob_hash), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if start >= end:
+                return
+            # mmap cannot map an empty file, which the check above rules out
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(start, end, chunk_size):
+                    yield mapped[offset:min(offset + chunk_size, end)]
+
@@ -0,0 +1,104 @@
+class ChatContext:
+    """Lazily loaded context for a single chat query.
+
+    Behaves like the plain context dict ``process_chat_query`` used to receive,
+    but each key is fetched from the database only the first time it is read.
+    A summary request touches one email row; only open-ended questions pull
+    in a slice of the inbox, and never more than ``recent_limit`` rows of it:
+    the emails the vector index ranks closest to the query, or the most recent
+    ones when nothing in the index matches.
+    """
+
+    def __init__(self, email_service, prompt_service, email_id=None, intent=None, query=None,
+                 vector_index=None, conversation_service=None, session_id=None, precompute_service=None,
+                 recent_limit=10):
+        self.email_service = email_service
+        self.prompt_service = prompt_service
+        self.email_id = email_id
+        self.intent = intent
+        self.query = query
+        self.vector_index = vector_index
+        self.conversation_service = conversation_service
+        self.session_id = session_id
+        self.precompute_service = precompute_service
+        self.recent_limit = recent_limit
+
+        self._providers = {
+            'email': self._load_email,
+            'recent_emails': self._load_recent_emails,
+            'relevant_emails': self._load_relevant_emails,
+            'prompts': self._load_prompts,
+            'history': self._load_history,
+            'precomputed_summary': self._load_precomputed_summary,
+            'precomputed_draft': self._load_precomputed_draft,
+        }
+        self._cache = {}
+
+    def get(self, key, default=None):
+        if key not in self._cache:
+            provider = self._providers.get(key)
+            if provider is None:
+                return default
+            self._cache[key] = provider()
+
+        value = self._cache[key]
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in self._providers:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __contains__(self, key):
+        return key in self._providers
+
+    @property
+    def loaded_keys(self):
+        return list(self._cache)
+
+    def _load_email(self):
+        if not self.email_id:
+            return None
+        return self.email_service.get_email_by_id(self.email_id)
+
+    def _load_recent_emails(self):
+        # Scope the inbox slice to whatever the router picked out of the query,
+        # e.g. "which newsletter should I read?" only needs newsletters
+        slots = self.intent.slots if self.intent else {}
+        filters = {key: slots[key] for key in ('sender', 'category', 'since', 'until') if slots.get(key)}
+
+        emails = []
+        if filters:
+            emails = self.email_service.find_emails(limit=self.recent_limit, **filters)
+        if not emails:
+            emails = self.email_service.find_emails(limit=self.recent_limit)
+        return emails
+
+    def _load_relevant_emails(self):
+        if self.vector_index is None or not self.query:
+            return None
+
+        hits = self.vector_index.search(self.query, k=self.recent_limit)
+        if not hits:
+            return None
+        return self.email_service.get_emails_by_ids([email_id for email_id, _ in hits])
+
+    def _load_prompts(self):
+        return self.prompt_service.get_all_prompts()
+
+    def _load_history(self):
+        if self.conversation_service is None or not self.session_id:
+            return None
+        return self.conversation_service.get_history(self.session_id)
+
+    def _load_precomputed_summary(self):
+        email = self.get('email')
+        if self.precompute_service is None or email is None:
+            return None
+        return self.precompute_service.get_summary(email)
+
+    def _load_precomputed_draft(self):
+        email = self.get('email')
+        if self.precompute_service is None or email is None:
+            return None
+        return self.precompute_service.get_draft(email, self.get('prompts', {}).get('auto_reply', ''))
@@ -0,0 +1,164 @@
+import queue
+import threading
+
+from services.llm_service import llm_priority
+
+
+class ConversationService:
+    """Server-side chat sessions with a fixed per-turn token budget.
+
+    The newest turns are kept verbatim for as long as they fit in
+    ``token_budget - summary_budget`` tokens. Anything older is folded into a
+    rolling summary (itself capped at ``summary_budget`` tokens), so the
+    history sent with each prompt stays the same size however long the
+    conversation runs.
+
+    Folding costs an LLM call, so it runs on a background thread after the
+    turn has been answered, at background priority. Until it finishes, the
+    next prompt may carry a few turns more than the budget.
+    """
+
+    def __init__(self, database, llm_service, token_budget=2000, summary_budget=500, max_recent_messages=12):
+        self.db = database
+        self.llm = llm_service
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_recent_messages = max_recent_messages
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def create_session(self):
+        session_id = self.db.execute_insert(
+            "INSERT INTO chat_sessions (summary) VALUES (?)",
+            ('',)
+        )
+        print(f"Created chat session with ID: {session_id}")
+        return session_id
+
+    def session_exists(self, session_id):
+        rows = self.db.execute_query('SELECT id FROM chat_sessions WHERE id = ?', (session_id,))
+        return bool(rows)
+
+    def get_session(self, session_id):
+        rows = self.db.execute_query('SELECT * FROM chat_sessions WHERE id = ?', (session_id,))
+        if not rows:
+            return None
+
+        session = self.db.row_to_dict(rows[0])
+        messages = self.db.execute_query(
+            'SELECT role, content, summarized, created_at FROM chat_messages WHERE session_id = ? ORDER BY id',
+            (session_id,)
+        )
+        session['messages'] = [self.db.row_to_dict(row) for row in messages]
+        return session
+
+    def delete_session(self, session_id):
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM chat_messages WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM chat_sessions WHERE id = ?', (session_id,))
+        print(f"Deleted chat session with ID: {session_id}")
+
+    def add_messages(self, session_id, messages):
+        """Append [{'role', 'content'}] to a session and queue folding anything over budget."""
+        with self.db.transaction() as conn:
+            conn.executemany(
+                '''INSERT INTO chat_messages (session_id, role, content, tokens)
+                   VALUES (?, ?, ?, ?)''',
+                [(session_id, m['role'], m['content'], self.llm.estimate_tokens(m['content'])) for m in messages]
+            )
+            conn.execute('UPDATE chat_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (session_id,))
+        self._schedule_compaction(session_id)
+
+    def get_history(self, session_id):
+        """Return {'summary': str, 'messages': [{'role', 'content'}]} for the next prompt."""
+        rows = self.db.execute_query('SELECT summary FROM chat_sessions WHERE id = ?', (session_id,))
+        summary = rows[0]['summary'] if rows else ''
+
+        messages = self.db.execute_query(
+            '''SELECT role, content FROM chat_messages
+               WHERE session_id = ? AND summarized = 0
+               ORDER BY id''',
+            (session_id,)
+        )
+        return {
+            'summary': summary or '',
+            'messages': [{'role': row['role'], 'content': row['content']} for row in messages]
+        }
+
+    def _schedule_compaction(self, session_id):
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+            self._queue.put(session_id)
+
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        llm_priority.set('background')
+
+        while True:
+            try:
+                session_id = self._queue.get(timeout=5)
+            except queue.Empty:
+                # Exit when idle; checked under the lock so a new turn starts a new worker
+                with self._lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+
+            # Cleared first, so turns added while this one folds queue another pass
+            with self._lock:
+                self._pending.discard(session_id)
+            try:
+                self._compact(session_id)
+            except Exception as e:
+                print(f"Error compacting chat session {session_id}: {e}")
+
+    def _compact(self, session_id):
+        rows = self.db.execute_query(
+            '''SELECT id, role, content, tokens FROM chat_messages
+               WHERE session_id = ? AND summarized = 0
+               ORDER BY id''',
+            (session_id,)
+        )
+
+        # Walk back from the newest turn until the verbatim budget is spent
+        recent_budget = self.token_budget - self.summary_budget
+        used = 0
+        keep_from = len(rows)
+        for i in range(len(rows) - 1, -1, -1):
+            if used + rows[i]['tokens'] > recent_budget or len(rows) - i > self.max_recent_messages:
+                break
+            used += rows[i]['tokens']
+            keep_from = i
+
+        to_fold = rows[:keep_from]
+        if not to_fold:
+            return
+
+        current = self.db.execute_query('SELECT summary FROM chat_sessions WHERE id = ?', (session_id,))
+        previous_summary = current[0]['summary'] if current else ''
+
+        summary = self.llm.summarize_conversation(
+            previous_summary,
+            [{'role': row['role'], 'content': row['content']} for row in to_fold],
+            max_tokens=self.summary_budget
+        )
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                'UPDATE chat_sessions SET summary = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (summary, session_id)
+            )
+            conn.executemany(
+                'UPDATE chat_messages SET summarized = 1 WHERE id = ?',
+                [(row['id'],) for row in to_fold]
+            )
+
+        print(f"Folded {len(to_fold)} message(s) of chat session {session_id} into its summary")
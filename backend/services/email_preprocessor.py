@@ -0,0 +1,279 @@
+import os
+import re
+import sys
+import html
+from html.parser import HTMLParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.prompt_templates import estimate_tokens
+
+
+# Cleaned bodies longer than this keep their head and tail only; anything
+# shorter but still long is processed in chunks by LLMService
+MAX_CLEAN_TOKENS = int(os.getenv('EMAIL_CLEAN_MAX_TOKENS', '8000'))
+# Share of the capped length taken from the start of the message
+HEAD_SHARE = 0.7
+# Stored with each cleaned body; bump it when cleaning changes so old bodies are cleaned again
+CLEANER_VERSION = 2
+
+HTML_PATTERN = re.compile(r'<(?:html|body|div|p|br|table|span|td|a)\b[^>]*>', re.IGNORECASE)
+BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'blockquote', 'hr', 'section', 'article', 'header', 'footer'}
+SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+
+# A line that starts the quoted original of a reply; everything after it goes
+REPLY_HEADER_PATTERNS = [
+    re.compile(r'^On .{0,200}\bwrote:\s*$', re.IGNORECASE),
+    re.compile(r'^-{2,}\s*Original Message\s*-{2,}\s*$', re.IGNORECASE),
+]
+# A forwarded original is kept: it is usually what the forward is about
+FORWARD_HEADER_PATTERN = re.compile(r'^(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)\s*$',
+                                    re.IGNORECASE)
+# Outlook quotes with a From:/Sent: block, often below a line of underscores. It
+# only counts when the From: line holds an address and a Sent:/Date: line follows,
+# and a FW:/Fwd: subject in the block marks a forward rather than a reply
+OUTLOOK_SEPARATOR_PATTERN = re.compile(r'^_{10,}\s*$')
+OUTLOOK_FROM_PATTERN = re.compile(r'^From:\s.*?[\w.+-]+@[\w-]+(?:\.[\w-]+)+', re.IGNORECASE)
+QUOTE_CONFIRM_PATTERN = re.compile(r'^(?:Sent|Date):\s', re.IGNORECASE)
+FORWARD_SUBJECT_PATTERN = re.compile(r'^Subject:\s*(?:FW|Fwd?):', re.IGNORECASE)
+# Lines that start another message inside a body; used to place chunk boundaries
+MESSAGE_START_PATTERNS = REPLY_HEADER_PATTERNS + [FORWARD_HEADER_PATTERN, OUTLOOK_SEPARATOR_PATTERN, OUTLOOK_FROM_PATTERN]
+
+# Lines that end the message proper: signature delimiters and mobile footers
+SIGNATURE_PATTERNS = [
+    re.compile(r'^--\s*$'),
+    re.compile(r'^Sent from my \w+', re.IGNORECASE),
+    re.compile(r'^Get Outlook for \w+', re.IGNORECASE),
+]
+
+# Boilerplate paragraphs: legal disclaimers and mailing-list footers
+BOILERPLATE_PATTERNS = [
+    re.compile(r'\b(?:this|the) (?:e-?mail|message)(?: and any attachments?)? (?:is|are|may be) '
+               r'(?:confidential|privileged|intended (?:solely|only))', re.IGNORECASE),
+    re.compile(r'\bif you (?:are not|have received this (?:e-?mail|message) in error)', re.IGNORECASE),
+    re.compile(r'\b(?:to )?unsubscribe\b.{0,80}\b(?:click|here|link|preferences)\b', re.IGNORECASE),
+    re.compile(r'\byou (?:are )?receiv(?:e|ed|ing) this (?:e-?mail|message) because\b', re.IGNORECASE),
+    re.compile(r'\bview (?:this email )?in (?:your|a) browser\b', re.IGNORECASE),
+    re.compile(r'\bplease consider the environment before printing\b', re.IGNORECASE),
+    re.compile(r'^\s*(?:copyright|©|\(c\))\s*\d{4}', re.IGNORECASE),
+]
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(body):
+    """Visible text of an HTML body, one line per block element."""
+    extractor = _TextExtractor()
+    extractor.feed(body)
+    extractor.close()
+    text = html.unescape(''.join(extractor.parts))
+    lines = [' '.join(line.split()) for line in text.splitlines()]
+    return '\n'.join(lines)
+
+
+def strip_quoted(text):
+    """Drop quoted replies: '>' lines and everything below a reply header.
+
+    Forwarded originals stay, headers included, so the LLM sees who sent the
+    content it is asked about.
+    """
+    lines = text.splitlines()
+    kept = []
+    in_forward_header = False
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('>'):
+            continue
+        if FORWARD_HEADER_PATTERN.match(stripped):
+            in_forward_header = True
+        elif in_forward_header:
+            # The forwarded message's own From:/Date: block ends at the first blank line
+            in_forward_header = bool(stripped)
+        elif _starts_reply(stripped, lines[i + 1:i + 7]):
+            # A header on the first line means the whole body is quoted; keep it
+            if any(l.strip() for l in kept):
+                break
+        kept.append(line)
+    return '\n'.join(kept)
+
+
+def _starts_reply(line, following):
+    if any(p.match(line) for p in REPLY_HEADER_PATTERNS):
+        return True
+    if OUTLOOK_SEPARATOR_PATTERN.match(line):
+        if not following:
+            return False
+        line, following = following[0].strip(), following[1:]
+    if not OUTLOOK_FROM_PATTERN.match(line):
+        return False
+    block = [l.strip() for l in following[:5]]
+    return (any(QUOTE_CONFIRM_PATTERN.match(l) for l in block[:2])
+            and not any(FORWARD_SUBJECT_PATTERN.match(l) for l in block))
+
+
+def strip_signature(text):
+    """Cut the body at a signature delimiter or mobile-client footer."""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if i and any(p.match(line.strip()) for p in SIGNATURE_PATTERNS):
+            return '\n'.join(lines[:i])
+    return text
+
+
+def strip_boilerplate(text):
+    """Remove paragraphs that are legal disclaimers or mailing-list footers."""
+    paragraphs = re.split(r'\n\s*\n', text)
+    kept = [p for p in paragraphs if not any(pattern.search(p) for pattern in BOILERPLATE_PATTERNS)]
+    # Never strip a message down to nothing
+    return '\n\n'.join(kept) if kept else text
+
+
+def cap_length(text, max_tokens=None):
+    """Keep the start and end of an over-long body, where the ask and the sign-off usually are."""
+    max_tokens = max_tokens or MAX_CLEAN_TOKENS
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    max_chars = max_tokens * 4
+    head = text[:int(max_chars * HEAD_SHARE)].rsplit(' ', 1)[0]
+    tail = text[-int(max_chars * (1 - HEAD_SHARE)):].split(' ', 1)[-1]
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n[... {omitted} characters omitted ...]\n{tail}"
+
+
+def clean_body(body, max_tokens=None):
+    """Body text to send to the LLM: plain text, no quotes, signatures or boilerplate, capped."""
+    if not body:
+        return ''
+    text = html_to_text(body) if HTML_PATTERN.search(body) else body.replace('\r\n', '\n')
+    text = strip_quoted(text)
+    text = strip_signature(text)
+    text = strip_boilerplate(text)
+    text = re.sub(r'\n{3,}', '\n\n', text).strip()
+    # Fall back to the original if cleaning removed everything of substance
+    if not text:
+        text = body.strip()
+    return cap_length(text, max_tokens)
+
+
+def split_into_chunks(text, max_tokens):
+    """Split ``text`` into pieces of at most ``max_tokens``.
+
+    Pieces break between paragraphs, and a quoted or forwarded message starts
+    a new piece once the current one is half full. Paragraphs that are too
+    long on their own are split at lines, then sentences, then words.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    max_chars = max_tokens * 4
+    units = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        first_line = paragraph.splitlines()[0].strip()
+        starts_message = any(p.match(first_line) for p in MESSAGE_START_PATTERNS)
+        # Oversized paragraphs go in quarter-size pieces so the chunks around them still fill up
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars // 4)
+        for piece in pieces:
+            units.append((starts_message, piece))
+            starts_message = False
+
+    chunks, current, size = [], [], 0
+    for starts_message, piece in units:
+        full = size + len(piece) + 2 > max_chars
+        if current and (full or (starts_message and size >= max_chars // 2)):
+            chunks.append('\n\n'.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def _split_long(text, max_chars, separators=('\n', '. ', ' ')):
+    if len(text) <= max_chars:
+        return [text]
+    if not separators:
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    separator, finer = separators[0], separators[1:]
+    pieces, current = [], ''
+    for part in text.split(separator):
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        if len(part) > max_chars:
+            pieces.extend(_split_long(part, max_chars, finer))
+            current = ''
+        else:
+            current = part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def llm_body(email):
+    """The cleaned body stored at ingest, computed on the fly for emails that have none."""
+    return email.get('body_clean') or clean_body(email.get('body', ''))
+
+
+def token_reduction(emails):
+    """Estimated tokens per email before and after cleaning.
+
+    ``reduction`` is the share of all tokens removed, so long emails dominate
+    it; ``avg_email_reduction`` averages the saving of each email.
+    """
+    if not emails:
+        return {'emails': 0, 'avg_tokens_before': 0, 'avg_tokens_after': 0, 'reduction': 0.0, 'avg_email_reduction': 0.0}
+    before = [estimate_tokens(e.get('body', '')) for e in emails]
+    after = [estimate_tokens(clean_body(e.get('body', ''))) for e in emails]
+    savings = [1 - a / b for a, b in zip(after, before) if b]
+    return {
+        'emails': len(emails),
+        'avg_tokens_before': round(sum(before) / len(emails), 1),
+        'avg_tokens_after': round(sum(after) / len(emails), 1),
+        'reduction': round(1 - sum(after) / sum(before), 3) if sum(before) else 0.0,
+        'avg_email_reduction': round(sum(savings) / len(savings), 3) if savings else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    import json
+
+    # Report the token saving on one or more JSON inbox files (lists of emails with a 'body')
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+    paths = sys.argv[1:] or [os.path.join(data_dir, 'mock_inbox.json'), os.path.join(data_dir, 'preprocess_samples.json')]
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            emails = json.load(f)
+        stats = token_reduction(emails)
+        print(f"{os.path.basename(path)}: {stats['emails']} emails, "
+              f"{stats['avg_tokens_before']} -> {stats['avg_tokens_after']} tokens on average "
+              f"({stats['reduction']:.1%} fewer; {stats['avg_email_reduction']:.1%} fewer per email on average)")
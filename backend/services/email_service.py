@@ -1,10 +1,23 @@
 import json
 import os
+import sys
 from datetime import datetime
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.email_preprocessor import clean_body, token_reduction, CLEANER_VERSION
+from services.mail_importer import MailImporter, content_hash
+
 class EmailService:
-    def __init__(self, database):
+    def __init__(self, database, vector_index=None, thread_service=None, blob_store=None, write_queue=None,
+                 cache=None):
         self.db = database
+        self.vector_index = vector_index
+        self.thread_service = thread_service
+        self.blob_store = blob_store
+        # With a WriteQueue, results and drafts are group-committed by its writer thread
+        self.write_queue = write_queue
+        # With a RecordCache, lookups by id are served from memory
+        self.cache = cache
     
     def load_mock_inbox(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -25,22 +38,156 @@ class EmailService:
         
         print(f"Loaded {len(emails)} emails from JSON")
         
-        # Clear existing emails
-        self.db.execute_query('DELETE FROM emails')
-        print("Cleared existing emails from database")
+        diff = self.sync_emails(emails, source='mock_inbox')
+        print(f"Synced mock inbox: {diff['new']} new, {diff['changed']} changed, {diff['unchanged']} unchanged, "
+              f"{diff['restored']} restored, {diff['removed']} removed")
         
-        # Insert mock emails
-        count = 0
-        for email in emails:
-            self.db.execute_insert(
-                '''INSERT INTO emails (sender, subject, body, timestamp)
-                   VALUES (?, ?, ?, ?)''',
-                (email['sender'], email['subject'], email['body'], email['timestamp'])
+        stats = token_reduction(emails)
+        print(f"Successfully loaded {diff['total']} emails from mock inbox "
+              f"(bodies {stats['reduction']:.0%} smaller after cleaning)")
+        return diff['total']
+    
+    def sync_emails(self, emails, source):
+        """Make the stored emails of ``source`` match ``emails``; returns counts of what changed.
+        
+        Emails are matched on Message-ID, else on a hash of their content, so
+        a reload only writes the difference. Unchanged rows keep their id,
+        results and drafts. A message whose content changed under the same
+        Message-ID is updated in place and marked unprocessed. Rows missing
+        from ``emails`` are soft-deleted (``deleted_at``) rather than removed,
+        and come back if the message reappears.
+        """
+        # Rows stored before sources were recorded count as this source's
+        rows = self.db.execute_query(
+            'SELECT id, message_id, content_hash, source, deleted_at, sender, subject, timestamp, body '
+            'FROM emails WHERE source = ? OR source IS NULL',
+            (source,)
+        )
+        existing = {}
+        for row in rows:
+            row = self.db.row_to_dict(row)
+            row['untagged'] = row['content_hash'] is None or row['source'] is None
+            row['content_hash'] = row['content_hash'] or content_hash(row)
+            existing[row['message_id'] or row['content_hash']] = row
+        
+        diff = {'total': len(emails), 'new': 0, 'changed': 0, 'unchanged': 0, 'restored': 0, 'removed': 0}
+        inserted, changed, reindex, seen = [], [], [], set()
+        with self.db.transaction() as conn:
+            for email in emails:
+                # Threading headers are optional; without them threads are matched on subject
+                references = email.get('references')
+                if isinstance(references, list):
+                    references = ' '.join(references)
+                email = dict(email, message_id=email.get('message_id'), in_reply_to=email.get('in_reply_to'),
+                             reference_ids=references)
+                email['content_hash'] = content_hash(email)
+                key = email['message_id'] or email['content_hash']
+                if key in seen:
+                    continue
+                seen.add(key)
+                
+                current = existing.get(key)
+                if current is None:
+                    # Clean each body once for every later LLM prompt
+                    row = conn.execute(
+                        '''INSERT INTO emails (sender, subject, body, body_clean, body_clean_version, timestamp,
+                                               message_id, in_reply_to, reference_ids, content_hash, source)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT DO NOTHING RETURNING id''',
+                        (email['sender'], email['subject'], email['body'], clean_body(email['body']), CLEANER_VERSION,
+                         email['timestamp'], email['message_id'], email['in_reply_to'], references,
+                         email['content_hash'], source)
+                    ).fetchone()
+                    if row is None:
+                        # Already stored by an import, another source or a concurrent sync
+                        diff['unchanged'] += 1
+                        continue
+                    email['id'] = row[0]
+                    inserted.append(email)
+                    diff['new'] += 1
+                    continue
+                
+                email['id'] = current['id']
+                if current['content_hash'] != email['content_hash']:
+                    # Same message, new content: earlier results no longer apply
+                    conn.execute(
+                        '''UPDATE emails
+                           SET sender = ?, subject = ?, body = ?, body_clean = ?, body_clean_version = ?, timestamp = ?,
+                               in_reply_to = ?, reference_ids = ?, content_hash = ?, source = ?, deleted_at = NULL,
+                               category = NULL, action_items = NULL, processed = 0, prompt_version = NULL
+                           WHERE id = ?''',
+                        (email['sender'], email['subject'], email['body'], clean_body(email['body']), CLEANER_VERSION,
+                         email['timestamp'], email['in_reply_to'], references, email['content_hash'], source,
+                         current['id'])
+                    )
+                    changed.append(email)
+                    reindex.append(email)
+                    diff['changed'] += 1
+                elif current['deleted_at'] is not None:
+                    conn.execute(
+                        'UPDATE emails SET deleted_at = NULL, content_hash = ?, source = ? WHERE id = ?',
+                        (email['content_hash'], source, current['id'])
+                    )
+                    reindex.append(email)
+                    diff['restored'] += 1
+                else:
+                    if current['untagged']:
+                        conn.execute(
+                            'UPDATE emails SET content_hash = ?, source = ? WHERE id = ?',
+                            (email['content_hash'], source, current['id'])
+                        )
+                    diff['unchanged'] += 1
+            
+            removed = [row['id'] for key, row in existing.items() if key not in seen and row['deleted_at'] is None]
+            conn.executemany(
+                'UPDATE emails SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?',
+                [(email_id,) for email_id in removed]
             )
-            count += 1
+            diff['removed'] = len(removed)
+        
+        # Changed messages may carry new threading headers or a new subject
+        if self.thread_service is not None and (inserted or changed):
+            threads = len(set(self.thread_service.assign(inserted + changed).values()))
+            print(f"Grouped {len(inserted)} new and {len(changed)} changed emails into {threads} thread(s)")
+        
+        if self.cache is not None:
+            self.cache.clear('emails')
         
-        print(f"Successfully loaded {count} emails from mock inbox")
-        return count
+        # Embed at ingest so retrieval never has to touch email bodies at query time
+        if self.vector_index is not None:
+            for email_id in removed:
+                self.vector_index.remove(email_id)
+            self.vector_index.add_emails(inserted + reindex)
+        
+        return diff
+    
+    def import_mailbox(self, path, fmt=None, workers=None, progress=None):
+        """Import an mbox file, Maildir or .eml files; returns the import statistics."""
+        importer = MailImporter(self.db, self.thread_service, self.vector_index, workers=workers,
+                                blob_store=self.blob_store)
+        return importer.import_path(path, fmt=fmt, progress=progress)
+    
+    def index_missing(self):
+        """Add emails missing from the vector index, e.g. stored by the import CLIs; returns how many."""
+        if self.vector_index is None:
+            return 0
+        rows = self.db.execute_query('SELECT id FROM emails WHERE deleted_at IS NULL')
+        missing = [row['id'] for row in rows if row['id'] not in self.vector_index]
+        return self.vector_index.sync(self.get_emails_by_ids(missing)) if missing else 0
+    
+    def preprocess_missing(self):
+        """Fill ``body_clean`` for emails stored before it existed or by an older cleaner; returns how many."""
+        rows = self.db.execute_query(
+            'SELECT id, body FROM emails WHERE body_clean IS NULL OR body_clean_version IS NOT ?',
+            (CLEANER_VERSION,)
+        )
+        if rows:
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    'UPDATE emails SET body_clean = ?, body_clean_version = ? WHERE id = ?',
+                    [(clean_body(row['body']), CLEANER_VERSION, row['id']) for row in rows]
+                )
+        return len(rows)
     
     def _create_mock_inbox(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -132,7 +279,7 @@ class EmailService:
         print(f"Created mock inbox file at {mock_inbox_path}")
     
     def get_all_emails(self):
-        rows = self.db.execute_query('SELECT * FROM emails ORDER BY timestamp DESC')
+        rows = self.db.execute_query('SELECT * FROM emails WHERE deleted_at IS NULL ORDER BY timestamp DESC')
         emails = []
         
         for row in rows:
@@ -149,10 +296,25 @@ class EmailService:
         return emails
     
     def get_email_by_id(self, email_id):
-        rows = self.db.execute_query('SELECT * FROM emails WHERE id = ?', (email_id,))
+        emails = self.get_emails_by_ids([email_id])
+        return emails[0] if emails else None
+    
+    def get_emails_by_ids(self, email_ids):
+        if not email_ids:
+            return []
         
-        if rows:
-            email = self.db.row_to_dict(rows[0])
+        if self.cache is not None:
+            rows = self.cache.read_through('emails', email_ids, self._load_emails)
+        else:
+            rows = self._load_emails(email_ids)
+        
+        by_id = {}
+        for email_id, row in rows.items():
+            # Soft-deleted emails stay cached by id but are hidden, as in get_all_emails
+            if row['deleted_at'] is not None:
+                continue
+            # Cached rows are shared, so every caller gets its own parsed copy
+            email = dict(row)
             if email['action_items']:
                 try:
                     email['action_items'] = json.loads(email['action_items'])
@@ -160,26 +322,83 @@ class EmailService:
                     email['action_items'] = []
             else:
                 email['action_items'] = []
-            return email
+            by_id[email_id] = email
         
-        return None
+        # Keep the caller's order (e.g. retrieval rank)
+        return [by_id[eid] for eid in email_ids if eid in by_id]
+    
+    def _load_emails(self, email_ids):
+        placeholders = ', '.join('?' for _ in email_ids)
+        rows = self.db.execute_query(
+            f'SELECT * FROM emails WHERE id IN ({placeholders})',
+            list(email_ids)
+        )
+        return {row['id']: self.db.row_to_dict(row) for row in rows}
+    
+    def get_emails_in_thread(self, thread_id):
+        """Messages of a thread, oldest first."""
+        rows = self.db.execute_query(
+            'SELECT id FROM emails WHERE thread_id = ? AND deleted_at IS NULL ORDER BY timestamp, id',
+            (thread_id,)
+        )
+        return self.get_emails_by_ids([row['id'] for row in rows])
     
-    def update_email(self, email_id, category=None, action_items=None):
+    def get_attachments(self, email_id):
+        """Attachment metadata of an email; the bytes are in the blob store under ``blob_hash``."""
+        rows = self.db.execute_query(
+            'SELECT id, email_id, filename, content_type, size, blob_hash FROM attachments WHERE email_id = ? ORDER BY id',
+            (email_id,)
+        )
+        return [self.db.row_to_dict(row) for row in rows]
+    
+    def get_attachment(self, attachment_id):
+        rows = self.db.execute_query(
+            'SELECT id, email_id, filename, content_type, size, blob_hash FROM attachments WHERE id = ?',
+            (attachment_id,)
+        )
+        return self.db.row_to_dict(rows[0]) if rows else None
+    
+    def update_email(self, email_id, category=None, action_items=None, prompt_version=None):
+        """Save processing results; with a write queue, returns the write's ticket without waiting for it."""
         if action_items:
             action_items_json = json.dumps(action_items)
         else:
             action_items_json = None
         
-        self.db.execute_query(
+        return self._write(lambda conn: conn.execute(
             '''UPDATE emails 
-               SET category = ?, action_items = ?, processed = 1
+               SET category = ?, action_items = ?, processed = 1, prompt_version = ?
                WHERE id = ?''',
-            (category, action_items_json, email_id)
-        )
+            (category, action_items_json, prompt_version, email_id)
+        ).rowcount, changes=('emails', [email_id]))
+    
+    def _write(self, operation, wait=False, changes=None):
+        """Apply ``operation(conn)`` through the write queue, or in a transaction of its own without one.
+        
+        A queued write returns its ticket unless ``wait`` is set, in which
+        case it blocks until the write is committed; otherwise the result of
+        ``operation`` is returned. ``changes`` is the (table, ids) the write
+        touches, so the cache can evict those ids instead of the whole table.
+        """
+        if changes and self.cache is not None:
+            table, ids = changes
+            if self.write_queue is None:
+                return self.cache.run_write(self.db, table, ids, operation)
+            operation, committed = self.cache.track(table, ids, operation)
+        else:
+            committed = None
+        
+        if self.write_queue is not None:
+            ticket = self.write_queue.submit(operation)
+            if committed is not None:
+                ticket.add_done_callback(lambda t: t.exception() is None and committed())
+            return ticket.result() if wait else ticket
+        with self.db.transaction() as conn:
+            return operation(conn)
     
     def get_emails_by_category(self, category):
         rows = self.db.execute_query(
-            'SELECT * FROM emails WHERE category = ? ORDER BY timestamp DESC',
+            'SELECT * FROM emails WHERE category = ? AND deleted_at IS NULL ORDER BY timestamp DESC',
             (category,)
         )
         
@@ -201,7 +420,7 @@ class EmailService:
         search_pattern = f"%{query}%"
         rows = self.db.execute_query(
             '''SELECT * FROM emails 
-               WHERE subject LIKE ? OR body LIKE ? OR sender LIKE ?
+               WHERE (subject LIKE ? OR body LIKE ? OR sender LIKE ?) AND deleted_at IS NULL
                ORDER BY timestamp DESC''',
             (search_pattern, search_pattern, search_pattern)
         )
@@ -219,6 +438,128 @@ class EmailService:
             emails.append(email)
         return emails
     
+
+    def _email_filter(self, sender=None, category=None, since=None, until=None, sender_match='prefix'):
+        clauses = ['deleted_at IS NULL']
+        params = []
+        
+        if sender:
+            sender = sender.lower()
+            if sender_match == 'prefix':
+                # Range scan on idx_emails_sender instead of a full-table LIKE
+                clauses.append('sender >= ? AND sender < ?')
+                params.extend([sender, sender + '\uffff'])
+            else:
+                clauses.append('lower(sender) LIKE ?')
+                params.append(f"%{sender}%")
+        if category:
+            clauses.append('category = ?')
+            params.append(category)
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        
+        return 'WHERE ' + ' AND '.join(clauses), params
+    
+    def _resolve_sender_match(self, sender, **filters):
+        # Prefer the indexed prefix match; fall back to a substring scan for
+        # fragments like a domain ("company.com") that are not a prefix
+        if not sender:
+            return 'prefix'
+        where, params = self._email_filter(sender=sender, sender_match='prefix', **filters)
+        rows = self.db.execute_query(f'SELECT 1 FROM emails {where} LIMIT 1', params)
+        return 'prefix' if rows else 'contains'
+    
+    def find_emails(self, sender=None, category=None, since=None, until=None, limit=None):
+        sender_match = self._resolve_sender_match(sender, category=category, since=since, until=until)
+        where, params = self._email_filter(sender, category, since, until, sender_match)
+        query = f'SELECT * FROM emails {where} ORDER BY timestamp DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        emails = []
+        for row in self.db.execute_query(query, params):
+            email = self.db.row_to_dict(row)
+            if email['action_items']:
+                try:
+                    email['action_items'] = json.loads(email['action_items'])
+                except json.JSONDecodeError:
+                    email['action_items'] = []
+            else:
+                email['action_items'] = []
+            emails.append(email)
+        
+        return emails
+    
+    def count_emails(self, sender=None, category=None, since=None, until=None):
+        sender_match = self._resolve_sender_match(sender, category=category, since=since, until=until)
+        where, params = self._email_filter(sender, category, since, until, sender_match)
+        rows = self.db.execute_query(f'SELECT COUNT(*) AS count FROM emails {where}', params)
+        return rows[0]['count'] if rows else 0
+    
+    def find_emails_matching(self, categories=None, keywords=None, limit=None):
+        """Emails in any of ``categories`` OR mentioning any of ``keywords`` in subject/body."""
+        clauses = []
+        params = []
+        
+        if categories:
+            clauses.append(f"category IN ({', '.join('?' for _ in categories)})")
+            params.extend(categories)
+        for keyword in keywords or []:
+            clauses.append('(subject LIKE ? OR body LIKE ?)')
+            params.extend([f"%{keyword}%", f"%{keyword}%"])
+        
+        if not clauses:
+            return []
+        
+        query = f"SELECT id FROM emails WHERE ({' OR '.join(clauses)}) AND deleted_at IS NULL ORDER BY timestamp DESC"
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        email_ids = [row['id'] for row in self.db.execute_query(query, params)]
+        return self.get_emails_by_ids(email_ids)
+    
+    def _action_item_query(self, select, sender, category, since, until):
+        sender_match = self._resolve_sender_match(sender, category=category, since=since, until=until)
+        where, params = self._email_filter(sender, category, since, until, sender_match)
+        where += ' AND action_items IS NOT NULL AND json_valid(action_items)'
+        # json_each expands the stored task arrays so SQLite does the counting and limiting
+        query = f'''SELECT {select}
+                    FROM emails, json_each(emails.action_items) AS item
+                    {where}'''
+        return query, params
+    
+    def get_action_items(self, sender=None, category=None, since=None, until=None, limit=None):
+        query, params = self._action_item_query(
+            "json_extract(item.value, '$.task') AS task, "
+            "json_extract(item.value, '$.deadline') AS deadline, "
+            "emails.sender AS sender, emails.id AS email_id",
+            sender, category, since, until
+        )
+        query += ' ORDER BY emails.timestamp DESC, item.key'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        return [
+            {
+                'task': row['task'] or 'Unknown task',
+                'deadline': row['deadline'],
+                'from': row['sender'],
+                'email_id': row['email_id']
+            }
+            for row in self.db.execute_query(query, params)
+        ]
+    
+    def count_action_items(self, sender=None, category=None, since=None, until=None):
+        query, params = self._action_item_query('COUNT(*) AS count', sender, category, since, until)
+        rows = self.db.execute_query(query, params)
+        return rows[0]['count'] if rows else 0
     
     def get_all_drafts(self):
         rows = self.db.execute_query('SELECT * FROM drafts ORDER BY created_at DESC')
@@ -239,10 +580,13 @@ class EmailService:
         return drafts
     
     def get_draft_by_id(self, draft_id):
-        rows = self.db.execute_query('SELECT * FROM drafts WHERE id = ?', (draft_id,))
+        if self.cache is not None:
+            rows = list(self.cache.read_through('drafts', [draft_id], self._load_drafts).values())
+        else:
+            rows = list(self._load_drafts([draft_id]).values())
         
         if rows:
-            draft = self.db.row_to_dict(rows[0])
+            draft = dict(rows[0])
             if draft['metadata']:
                 try:
                     draft['metadata'] = json.loads(draft['metadata'])
@@ -254,18 +598,42 @@ class EmailService:
         
         return None
     
+    def _load_drafts(self, draft_ids):
+        placeholders = ', '.join('?' for _ in draft_ids)
+        rows = self.db.execute_query(f'SELECT * FROM drafts WHERE id IN ({placeholders})', list(draft_ids))
+        return {row['id']: self.db.row_to_dict(row) for row in rows}
+    
     def create_draft(self, email_id, subject, body, metadata=None):
         metadata_json = json.dumps(metadata) if metadata else None
         
-        draft_id = self.db.execute_insert(
+        draft_id = self._write(lambda conn: conn.execute(
             '''INSERT INTO drafts (email_id, subject, body, metadata)
                VALUES (?, ?, ?, ?)''',
             (email_id, subject, body, metadata_json)
-        )
+        ).lastrowid, wait=True, changes=('drafts', []))
         
         print(f"Created draft with ID: {draft_id}")
         return draft_id
     
+    def create_drafts(self, drafts):
+        """Insert several drafts in one transaction and return their ids in order."""
+        def insert(conn):
+            draft_ids = []
+            for draft in drafts:
+                metadata = draft.get('metadata')
+                cursor = conn.execute(
+                    '''INSERT INTO drafts (email_id, subject, body, metadata)
+                       VALUES (?, ?, ?, ?)''',
+                    (draft['email_id'], draft['subject'], draft['body'],
+                     json.dumps(metadata) if metadata else None)
+                )
+                draft_ids.append(cursor.lastrowid)
+            return draft_ids
+        
+        draft_ids = self._write(insert, wait=True, changes=('drafts', []))
+        print(f"Created {len(draft_ids)} draft(s)")
+        return draft_ids
+    
     def update_draft(self, draft_id, subject=None, body=None, metadata=None):
         draft = self.db.execute_query('SELECT * FROM drafts WHERE id = ?', (draft_id,))
         
@@ -278,17 +646,18 @@ class EmailService:
         body = body if body is not None else current['body']
         metadata_json = json.dumps(metadata) if metadata is not None else current['metadata']
         
-        self.db.execute_query(
+        self._write(lambda conn: conn.execute(
             '''UPDATE drafts 
                SET subject = ?, body = ?, metadata = ?, updated_at = CURRENT_TIMESTAMP
                WHERE id = ?''',
             (subject, body, metadata_json, draft_id)
-        )
+        ).rowcount, wait=True, changes=('drafts', [draft_id]))
         
         print(f"Updated draft with ID: {draft_id}")
     
     def delete_draft(self, draft_id):
-        self.db.execute_query('DELETE FROM drafts WHERE id = ?', (draft_id,))
+        self._write(lambda conn: conn.execute('DELETE FROM drafts WHERE id = ?', (draft_id,)).rowcount,
+                    wait=True, changes=('drafts', [draft_id]))
         print(f"Deleted draft with ID: {draft_id}")
     
     def get_drafts_for_email(self, email_id):
@@ -344,8 +713,6 @@ class EmailService:
         return stats
 
 if __name__ == '__main__':
-    import sys
-    sys.path.append('..')
     from models.database import Database
     
     # Initialize
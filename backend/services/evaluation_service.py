@@ -0,0 +1,297 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.email_preprocessor import llm_body
+
+
+CATEGORIES = ['Important', 'Newsletter', 'Spam', 'To-Do']
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+TASK_STOPWORDS = {'the', 'a', 'an', 'for', 'to', 'and', 'or', 'of', 'on', 'my', 'your', 'by', 'with'}
+
+
+def _default_data_path(filename):
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(backend_dir, 'data', filename)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _task_words(task):
+    return {w for w in WORD_PATTERN.findall(task.lower()) if w not in TASK_STOPWORDS}
+
+
+class EvaluationService:
+    """Offline evaluation of a prompt set against a labelled golden set.
+
+    Runs categorization and action-item extraction through an LLMService for
+    every golden email and reports per-category precision/recall, the share
+    of expected action items that were found, p50/p95 latency and token cost.
+    Pair it with an offline LLMService (mock responses) or one whose client
+    is a replaying CassetteClient so results are deterministic and free.
+    """
+
+    def __init__(self, llm_service, golden_path=None, inbox_path=None, task_match_threshold=0.5):
+        self.llm = llm_service
+        self.golden_path = golden_path or _default_data_path('golden_set.json')
+        self.inbox_path = inbox_path or _default_data_path('mock_inbox.json')
+        self.task_match_threshold = task_match_threshold
+        # run() temporarily reconfigures the LLMService, so runs are serialized
+        self._lock = threading.Lock()
+
+    def load_golden_set(self):
+        with open(self.golden_path, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+        with open(self.inbox_path, 'r', encoding='utf-8') as f:
+            inbox = json.load(f)
+
+        cases = []
+        for email in inbox:
+            labels = golden.get('mock_inbox', {}).get(email['subject'])
+            if labels:
+                cases.append(dict(email, source='mock_inbox', **labels))
+        for case in golden.get('synthetic', []):
+            cases.append(dict(case, source='synthetic'))
+
+        for i, case in enumerate(cases, 1):
+            case['id'] = i
+        return cases
+
+    def run(self, prompts, model_routes=None):
+        with self._lock:
+            return self._run(prompts, model_routes)
+
+    def _run(self, prompts, model_routes):
+        cases = self.load_golden_set()
+        calls = []
+
+        def record_call(call):
+            # A replaying cassette reports the latency it was recorded with
+            recorded = getattr(self.llm.client, 'last_latency_ms', None)
+            if recorded is not None:
+                call = dict(call, latency_ms=recorded)
+            calls.append(call)
+
+        saved_routes = self.llm.model_routes
+        saved_fallback = self.llm.fallback_to_mock
+        self.llm.model_routes = dict(model_routes or {})
+        self.llm.fallback_to_mock = False
+        self.llm.call_listeners.append(record_call)
+
+        results = []
+        try:
+            for case in cases:
+                result = {'id': case['id'], 'subject': case['subject'], 'expected_category': case['category']}
+                start = time.perf_counter()
+                try:
+                    # Same cleaned body the job workers send
+                    body = llm_body(case)
+                    result['category'] = self.llm.categorize_email(
+                        case['subject'] + " " + body, prompts['categorization'], email=case
+                    )
+                    tasks = self.llm.extract_action_items(body, prompts['action_item'], email=case)
+                    result['action_items'] = [t.get('task', '') for t in tasks if isinstance(t, dict)]
+                except Exception as e:
+                    result['error'] = str(e)
+                result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+                result['expected_action_items'] = case['action_items']
+                results.append(result)
+        finally:
+            self.llm.call_listeners.remove(record_call)
+            self.llm.model_routes = saved_routes
+            self.llm.fallback_to_mock = saved_fallback
+
+        return self._report(results, calls)
+
+    def _match_tasks(self, expected, predicted):
+        remaining = [_task_words(p) for p in predicted]
+        matched = 0
+        for task in expected:
+            words = _task_words(task)
+            best, best_index = 0.0, None
+            for i, candidate in enumerate(remaining):
+                if not words or not candidate:
+                    continue
+                overlap = len(words & candidate) / len(words | candidate)
+                if overlap > best:
+                    best, best_index = overlap, i
+            if best_index is not None and best >= self.task_match_threshold:
+                matched += 1
+                remaining.pop(best_index)
+        return matched
+
+    def _report(self, results, calls):
+        per_category = {}
+        for category in CATEGORIES:
+            tp = sum(1 for r in results if r.get('category') == category and r['expected_category'] == category)
+            predicted = sum(1 for r in results if r.get('category') == category)
+            actual = sum(1 for r in results if r['expected_category'] == category)
+            per_category[category] = {
+                'precision': round(tp / predicted, 3) if predicted else None,
+                'recall': round(tp / actual, 3) if actual else None,
+                'support': actual,
+            }
+
+        correct = sum(1 for r in results if r.get('category') == r['expected_category'])
+        expected_tasks = sum(len(r['expected_action_items']) for r in results)
+        matched_tasks = 0
+        predicted_tasks = 0
+        for r in results:
+            predicted = r.get('action_items', [])
+            predicted_tasks += len(predicted)
+            r['matched_action_items'] = self._match_tasks(r['expected_action_items'], predicted)
+            matched_tasks += r['matched_action_items']
+
+        latencies = [c['latency_ms'] for c in calls]
+        input_tokens = sum(c['input_tokens'] for c in calls)
+        output_tokens = sum(c['output_tokens'] for c in calls)
+        cost = sum(self.llm.estimate_cost(c['model'], c['input_tokens'], c['output_tokens']) for c in calls)
+
+        return {
+            'cases': len(results),
+            'errors': sum(1 for r in results if 'error' in r),
+            'accuracy': round(correct / len(results), 3) if results else 0.0,
+            'per_category': per_category,
+            'action_items': {
+                'expected': expected_tasks,
+                'predicted': predicted_tasks,
+                'matched': matched_tasks,
+                'match_rate': round(matched_tasks / expected_tasks, 3) if expected_tasks else 1.0,
+            },
+            'latency_ms': {
+                'p50': round(_percentile(latencies, 50), 2),
+                'p95': round(_percentile(latencies, 95), 2),
+                'calls': len(calls),
+            },
+            'tokens': {
+                'input': input_tokens,
+                'output': output_tokens,
+                'estimated_cost_usd': round(cost, 6),
+            },
+            'results': results,
+        }
+
+    def compare(self, report, baseline, max_accuracy_drop=0.0, max_match_rate_drop=0.0,
+                max_latency_increase=0.5, max_token_increase=0.25):
+        """Return a list of regressions of ``report`` relative to ``baseline`` (empty if none)."""
+        regressions = []
+
+        if report['errors'] > baseline['errors']:
+            regressions.append(f"errors rose from {baseline['errors']} to {report['errors']}")
+
+        if report['accuracy'] < baseline['accuracy'] - max_accuracy_drop:
+            regressions.append(f"accuracy fell from {baseline['accuracy']:.3f} to {report['accuracy']:.3f}")
+
+        old_rate, new_rate = baseline['action_items']['match_rate'], report['action_items']['match_rate']
+        if new_rate < old_rate - max_match_rate_drop:
+            regressions.append(f"action-item match rate fell from {old_rate:.3f} to {new_rate:.3f}")
+
+        old_p95, new_p95 = baseline['latency_ms']['p95'], report['latency_ms']['p95']
+        if old_p95 and new_p95 > old_p95 * (1 + max_latency_increase):
+            regressions.append(f"p95 latency rose from {old_p95:.1f}ms to {new_p95:.1f}ms")
+
+        old_tokens = baseline['tokens']['input'] + baseline['tokens']['output']
+        new_tokens = report['tokens']['input'] + report['tokens']['output']
+        if old_tokens and new_tokens > old_tokens * (1 + max_token_increase):
+            regressions.append(f"tokens rose from {old_tokens} to {new_tokens}")
+
+        return regressions
+
+
+def format_report(report):
+    lines = [
+        f"Cases: {report['cases']} ({report['errors']} error(s))",
+        f"Accuracy: {report['accuracy']:.1%}",
+        "",
+        f"{'Category':<12}{'Precision':>10}{'Recall':>10}{'Support':>9}",
+    ]
+    for category, stats in report['per_category'].items():
+        precision = '-' if stats['precision'] is None else f"{stats['precision']:.2f}"
+        recall = '-' if stats['recall'] is None else f"{stats['recall']:.2f}"
+        lines.append(f"{category:<12}{precision:>10}{recall:>10}{stats['support']:>9}")
+
+    items = report['action_items']
+    lines += [
+        "",
+        f"Action items: {items['matched']}/{items['expected']} matched "
+        f"({items['match_rate']:.1%}), {items['predicted']} predicted",
+        f"Latency: p50 {report['latency_ms']['p50']:.1f}ms, p95 {report['latency_ms']['p95']:.1f}ms "
+        f"over {report['latency_ms']['calls']} call(s)",
+        f"Tokens: {report['tokens']['input']} in / {report['tokens']['output']} out, "
+        f"~${report['tokens']['estimated_cost_usd']:.4f}",
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from services.llm_service import LLMService
+    from services.llm_cassette import Cassette, CassetteClient
+    from models.database import Database
+    from services.prompt_service import PromptService
+
+    parser = argparse.ArgumentParser(description="Evaluate a prompt set offline against the golden set")
+    parser.add_argument('--prompts', help="JSON file with categorization/action_item prompts (default: current database prompts)")
+    parser.add_argument('--cassette', help="Replay LLM responses from this cassette instead of mock responses")
+    parser.add_argument('--record', action='store_true', help="Call the real API and record responses into --cassette")
+    parser.add_argument('--route', action='append', default=[], metavar='TASK=MODEL',
+                        help="Model override per task, e.g. categorization=claude-3-5-haiku-20241022")
+    parser.add_argument('--baseline', help="Report JSON to compare against; exits 1 on regressions")
+    parser.add_argument('--save', help="Write the JSON report here")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0)
+    parser.add_argument('--max-latency-increase', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.prompts:
+        with open(args.prompts, 'r', encoding='utf-8') as f:
+            prompts = json.load(f)
+    else:
+        prompts = PromptService(Database()).get_all_prompts()
+
+    if args.cassette:
+        cassette = Cassette(args.cassette)
+        if args.record:
+            from anthropic import Anthropic
+            client = CassetteClient(cassette, inner=Anthropic(), mode='record')
+        else:
+            client = CassetteClient(cassette)
+        llm = LLMService(client=client)
+    else:
+        llm = LLMService(offline=True)
+
+    routes = dict(route.split('=', 1) for route in args.route)
+    evaluation = EvaluationService(llm)
+    report = evaluation.run(prompts, model_routes=routes)
+    print(format_report(report))
+
+    if args.cassette and args.record:
+        cassette.save()
+        print(f"\nRecorded {len(cassette)} response(s) to {args.cassette}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = evaluation.compare(report, baseline, max_accuracy_drop=args.max_accuracy_drop,
+                                         max_latency_increase=args.max_latency_increase)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import socketserver
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.mail_importer import READERS, detect_format
+
+
+TOKEN_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|\([^)]*\)|\S+')
+LITERAL_PATTERN = re.compile(rb'\{(\d+)\+?\}\r\n$')
+
+
+def mock_inbox_messages(path):
+    """Render a JSON inbox (as in data/mock_inbox.json) as raw RFC 822 messages."""
+    with open(path, 'r', encoding='utf-8') as f:
+        emails = json.load(f)
+    raws = []
+    for email in emails:
+        message = EmailMessage()
+        message['From'] = email['sender']
+        message['To'] = 'me@example.com'
+        message['Subject'] = email['subject']
+        message['Date'] = format_datetime(datetime.fromisoformat(email['timestamp']))
+        message['Message-ID'] = email.get('message_id') or make_msgid(domain='imap-stub.local')
+        message.set_content(email['body'])
+        raws.append(bytes(message))
+    return raws
+
+
+class StubMailbox:
+    """Folders of raw messages with IMAP UIDs, shared by all connections.
+
+    UIDs only ever grow within a folder. ``reset_uidvalidity`` renumbers a
+    folder the way a server does after a rebuild, to exercise a client's
+    full-resync path.
+    """
+
+    def __init__(self, folders=None, username='user', password='password'):
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._folders = {}
+        for name, raws in (folders or {'INBOX': []}).items():
+            self.create(name)
+            for raw in raws:
+                self.append(name, raw)
+
+    def create(self, folder):
+        with self._lock:
+            self._folders.setdefault(folder, {'uidvalidity': int(time.time()), 'next_uid': 1, 'messages': []})
+
+    def append(self, folder, raw):
+        """Add a message to ``folder``; returns its UID."""
+        with self._lock:
+            box = self._folders[folder]
+            uid = box['next_uid']
+            box['next_uid'] += 1
+            box['messages'].append((uid, raw))
+            return uid
+
+    def reset_uidvalidity(self, folder):
+        with self._lock:
+            box = self._folders[folder]
+            box['uidvalidity'] += 1
+            box['messages'] = [(uid, raw) for uid, (_, raw) in enumerate(box['messages'], 1)]
+            box['next_uid'] = len(box['messages']) + 1
+
+    def folders(self):
+        with self._lock:
+            return list(self._folders)
+
+    def snapshot(self, folder):
+        with self._lock:
+            box = self._folders.get(folder)
+            if box is None:
+                return None
+            return {'uidvalidity': box['uidvalidity'], 'next_uid': box['next_uid'], 'messages': list(box['messages'])}
+
+
+def parse_uid_set(spec, highest):
+    """UIDs matched by an IMAP sequence set such as ``1:5,9,12:*``, given the highest UID."""
+    ranges = []
+    for part in spec.split(','):
+        start, _, end = part.partition(':')
+        start = highest if start == '*' else int(start)
+        end = start if not end else (highest if end == '*' else int(end))
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+def in_ranges(uid, ranges):
+    return any(low <= uid <= high for low, high in ranges)
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    """Speaks the subset of IMAP4rev1 that ImapSync and imaplib use.
+
+    CAPABILITY, LOGIN, LIST, SELECT/EXAMINE, UID SEARCH, UID FETCH (the whole
+    message), APPEND, NOOP and LOGOUT. Messages are never flagged or expunged.
+    """
+
+    def setup(self):
+        super().setup()
+        self.selected = None
+        self.authenticated = False
+
+    def send(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode('utf-8'))
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send("* OK [CAPABILITY IMAP4rev1 LITERAL+] IMAP stub ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            # A literal ({n}) carries the message for APPEND; read it before parsing the command
+            literal = None
+            match = LITERAL_PATTERN.search(line)
+            if match:
+                if not line.rstrip().endswith(b'+}'):
+                    self.send("+ Ready for literal data\r\n")
+                literal = self.rfile.read(int(match.group(1)))
+                self.rfile.readline()
+                line = line[:match.start()]
+            text = line.decode('utf-8', errors='replace').strip()
+            if not text:
+                continue
+            tag, _, rest = text.partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                command, _, args = args.partition(' ')
+                command = 'UID ' + command.upper()
+            try:
+                if not self.dispatch(mailbox, tag, command, args, literal):
+                    return
+            except (ValueError, KeyError, IndexError) as e:
+                self.send(f"{tag} BAD {e}\r\n")
+            self.wfile.flush()
+
+    def dispatch(self, mailbox, tag, command, args, literal):
+        tokens = [m.group(1) if m.group(1) is not None else m.group(0) for m in TOKEN_PATTERN.finditer(args)]
+
+        if command == 'CAPABILITY':
+            self.send("* CAPABILITY IMAP4rev1 LITERAL+\r\n")
+        elif command == 'NOOP':
+            pass
+        elif command == 'LOGOUT':
+            self.send("* BYE IMAP stub closing\r\n")
+            self.send(f"{tag} OK LOGOUT completed\r\n")
+            return False
+        elif command == 'LOGIN':
+            if tokens[:2] != [mailbox.username, mailbox.password]:
+                self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n")
+                return True
+            self.authenticated = True
+        elif not self.authenticated:
+            self.send(f"{tag} NO Not authenticated\r\n")
+            return True
+        elif command == 'LIST':
+            for folder in mailbox.folders():
+                self.send(f'* LIST (\\HasNoChildren) "/" "{folder}"\r\n')
+        elif command in ('SELECT', 'EXAMINE'):
+            box = mailbox.snapshot(tokens[0])
+            if box is None:
+                self.send(f"{tag} NO Mailbox does not exist\r\n")
+                return True
+            self.selected = tokens[0]
+            self.send(f"* {len(box['messages'])} EXISTS\r\n* 0 RECENT\r\n")
+            self.send(f"* OK [UIDVALIDITY {box['uidvalidity']}] UIDs valid\r\n")
+            self.send(f"* OK [UIDNEXT {box['next_uid']}] Predicted next UID\r\n")
+            mode = 'READ-ONLY' if command == 'EXAMINE' else 'READ-WRITE'
+            self.send(f"{tag} OK [{mode}] {command} completed\r\n")
+            return True
+        elif command == 'APPEND':
+            if literal is None:
+                raise ValueError("APPEND needs a message literal")
+            uid = mailbox.append(tokens[0], literal)
+            box = mailbox.snapshot(tokens[0])
+            self.send(f"{tag} OK [APPENDUID {box['uidvalidity']} {uid}] APPEND completed\r\n")
+            return True
+        elif command in ('UID SEARCH', 'UID FETCH'):
+            box = mailbox.snapshot(self.selected) if self.selected else None
+            if box is None:
+                self.send(f"{tag} NO No mailbox selected\r\n")
+                return True
+            highest = box['messages'][-1][0] if box['messages'] else 0
+            if command == 'UID SEARCH':
+                # Only "UID <set>" and "ALL" are understood
+                spec = tokens[1] if tokens[0].upper() == 'UID' else '1:*'
+                ranges = parse_uid_set(spec, highest)
+                found = [str(uid) for uid, _ in box['messages'] if in_ranges(uid, ranges)]
+                self.send(f"* SEARCH {' '.join(found)}\r\n".replace(' \r\n', '\r\n'))
+            else:
+                ranges = parse_uid_set(tokens[0], highest)
+                for seq, (uid, raw) in enumerate(box['messages'], 1):
+                    if in_ranges(uid, ranges):
+                        self.send(f"* {seq} FETCH (UID {uid} BODY[] {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+        else:
+            self.send(f"{tag} BAD Unknown command {command}\r\n")
+            return True
+
+        self.send(f"{tag} OK {command} completed\r\n")
+        return True
+
+
+class IMAPStubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mailbox):
+        super().__init__(address, IMAPHandler)
+        self.mailbox = mailbox
+
+
+def create_server(mailbox, host='127.0.0.1', port=1143):
+    return IMAPStubServer((host, port), mailbox)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+    parser = argparse.ArgumentParser(description="Local IMAP stand-in serving an inbox for sync testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1143)
+    parser.add_argument('--user', default='user')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--source', default=os.path.join(data_dir, 'mock_inbox.json'),
+                        help="JSON inbox, mbox file, Maildir or .eml files to serve as INBOX")
+    args = parser.parse_args()
+
+    if args.source.endswith('.json'):
+        raws = mock_inbox_messages(args.source)
+    else:
+        raws = list(READERS[detect_format(args.source)](args.source))
+    server = create_server(StubMailbox({'INBOX': raws}, args.user, args.password), args.host, args.port)
+    print(f"IMAP stub serving {len(raws)} message(s) on {args.host}:{args.port} "
+          f"(user {args.user!r}); add more with imaplib's append()")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
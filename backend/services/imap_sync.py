@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+import imaplib
+import threading
+from collections import deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.mail_importer import MailImporter
+
+
+FETCH_UID_PATTERN = re.compile(rb'\bUID (\d+)')
+# Messages per UID FETCH command
+DEFAULT_FETCH_BATCH = 100
+
+
+class SyncInProgressError(RuntimeError):
+    pass
+
+
+class ImapSync:
+    """Incrementally copies new messages from IMAP folders into the ``emails`` table.
+
+    Each folder's UIDVALIDITY and the highest UID stored so far are kept in
+    ``imap_folders``. A sync asks only for UIDs above that watermark and
+    fetches them in batches of ``fetch_batch``; while the next batch is on the
+    wire, MailImporter's process pool parses the previous ones. The watermark
+    advances after each batch is committed, so an interrupted sync resumes
+    where it stopped. If the server reports a different UIDVALIDITY the
+    folder is rescanned from the start; Message-ID deduplication keeps that
+    from inserting copies. Existing rows, and the results and drafts attached
+    to them, are never modified.
+    """
+
+    def __init__(self, database, host, username, password, port=None, use_ssl=True, folders=('INBOX',),
+                 fetch_batch=DEFAULT_FETCH_BATCH, importer=None):
+        self.db = database
+        self.host = host
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.port = port or (993 if use_ssl else 143)
+        self.folders = list(folders)
+        self.fetch_batch = fetch_batch
+        self.importer = importer or MailImporter(database)
+        self.account = f"{username}@{host}:{self.port}"
+        self._running = threading.Lock()
+
+    @classmethod
+    def from_env(cls, database, importer=None):
+        """Build from IMAP_HOST, IMAP_PORT, IMAP_USER, IMAP_PASSWORD, IMAP_SSL and IMAP_FOLDERS; None if unset."""
+        if not os.getenv('IMAP_HOST'):
+            return None
+        return cls(
+            database,
+            host=os.getenv('IMAP_HOST'),
+            username=os.getenv('IMAP_USER', ''),
+            password=os.getenv('IMAP_PASSWORD', ''),
+            port=int(os.getenv('IMAP_PORT')) if os.getenv('IMAP_PORT') else None,
+            use_ssl=os.getenv('IMAP_SSL', '1') != '0',
+            folders=[f.strip() for f in os.getenv('IMAP_FOLDERS', 'INBOX').split(',') if f.strip()],
+            fetch_batch=int(os.getenv('IMAP_FETCH_BATCH', str(DEFAULT_FETCH_BATCH))),
+            importer=importer,
+        )
+
+    def connect(self):
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.host, self.port)
+        else:
+            conn = imaplib.IMAP4(self.host, self.port)
+        conn.login(self.username, self.password)
+        return conn
+
+    def sync(self, progress=None):
+        """Fetch new messages from every folder; returns per-folder statistics.
+
+        Raises SyncInProgressError instead of waiting when a sync is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            raise SyncInProgressError(f"A sync of {self.account} is already running")
+        try:
+            conn = self.connect()
+            try:
+                return {folder: self.sync_folder(conn, folder, progress) for folder in self.folders}
+            finally:
+                try:
+                    conn.logout()
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+        finally:
+            self._running.release()
+
+    def sync_folder(self, conn, folder, progress=None):
+        typ, data = conn.select(self._quote(folder), readonly=True)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"Cannot select {folder}: {data}")
+        uidvalidity = int(conn.response('UIDVALIDITY')[1][0])
+
+        state = self.get_state(folder)
+        last_uid = 0
+        if state and state['uidvalidity'] == uidvalidity:
+            last_uid = state['last_uid']
+        elif state:
+            print(f"UIDVALIDITY of {folder} changed ({state['uidvalidity']} -> {uidvalidity}); rescanning the folder")
+
+        # "n:*" always matches the newest message, even when its UID is below n
+        typ, data = conn.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+        uids = sorted(uid for uid in (int(u) for u in (data[0] or b'').split()) if uid > last_uid)
+        if not uids:
+            self._save_state(folder, uidvalidity, last_uid)
+            return {'uidvalidity': uidvalidity, 'last_uid': last_uid, 'new': 0, 'imported': 0, 'duplicates': 0, 'failed': 0}
+
+        # UIDs fetched but not yet committed, in order; the watermark follows the committed prefix
+        fetched = deque()
+        watermark = {'uid': last_uid}
+
+        def on_stored(count):
+            for _ in range(count):
+                watermark['uid'] = fetched.popleft()
+            self._save_state(folder, uidvalidity, watermark['uid'])
+
+        def raw_messages():
+            for i in range(0, len(uids), self.fetch_batch):
+                for uid, raw in self._fetch(conn, uids[i:i + self.fetch_batch]):
+                    fetched.append(uid)
+                    yield raw
+
+        stats = self.importer.import_messages(raw_messages(), source=f'imap:{folder}', progress=progress,
+                                              on_stored=on_stored)
+        self._save_state(folder, uidvalidity, watermark['uid'])
+        stats.update(uidvalidity=uidvalidity, last_uid=watermark['uid'], new=len(uids))
+        return stats
+
+    def _fetch(self, conn, uids):
+        """(uid, raw message) pairs for ``uids`` in UID order; BODY.PEEK leaves the \\Seen flag alone."""
+        typ, data = conn.uid('FETCH', ','.join(str(uid) for uid in uids), '(UID BODY.PEEK[])')
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        messages = []
+        for i, item in enumerate(data):
+            if not isinstance(item, tuple):
+                continue
+            match = FETCH_UID_PATTERN.search(item[0])
+            # Some servers send the UID after the literal: b'1 (BODY[] {n}', raw, b' UID 5)'
+            if match is None and i + 1 < len(data) and isinstance(data[i + 1], bytes):
+                match = FETCH_UID_PATTERN.search(data[i + 1])
+            if match is not None:
+                messages.append((int(match.group(1)), item[1]))
+        # Keep UID order so the watermark only ever covers committed messages
+        messages.sort()
+        return messages
+
+    def _quote(self, folder):
+        return folder if re.fullmatch(r'[\w./-]+', folder) else '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def get_state(self, folder):
+        rows = self.db.execute_query(
+            'SELECT uidvalidity, last_uid, synced_at FROM imap_folders WHERE account = ? AND folder = ?',
+            (self.account, folder)
+        )
+        return self.db.row_to_dict(rows[0]) if rows else None
+
+    def _save_state(self, folder, uidvalidity, last_uid):
+        self.db.execute_query(
+            '''INSERT INTO imap_folders (account, folder, uidvalidity, last_uid, synced_at)
+               VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(account, folder) DO UPDATE SET
+                   uidvalidity = excluded.uidvalidity, last_uid = excluded.last_uid, synced_at = excluded.synced_at''',
+            (self.account, folder, uidvalidity, last_uid)
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from models.database import Database
+    from services.blob_store import BlobStore
+    from services.thread_service import ThreadService
+    from services.vector_index import VectorIndex
+
+    parser = argparse.ArgumentParser(description="Fetch new messages from an IMAP account into the email database")
+    parser.add_argument('--host', default=os.getenv('IMAP_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('IMAP_PORT', '0')) or None)
+    parser.add_argument('--user', default=os.getenv('IMAP_USER', ''))
+    parser.add_argument('--password', default=os.getenv('IMAP_PASSWORD', ''))
+    parser.add_argument('--no-ssl', action='store_true', help="Plain IMAP, e.g. against imap_stub_server.py")
+    parser.add_argument('--folder', action='append', help="Folder to sync (repeatable; default: IMAP_FOLDERS or INBOX)")
+    parser.add_argument('--fetch-batch', type=int, default=DEFAULT_FETCH_BATCH, help="Messages per UID FETCH")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--index', action='store_true',
+                        help="Also update the retrieval index; only while app.py is stopped, since it holds the "
+                             "index in memory (by default it indexes the new emails on startup or its next sync)")
+    args = parser.parse_args()
+
+    db = Database()
+    db.initialize()
+    importer = MailImporter(db, ThreadService(db), VectorIndex() if args.index else None,
+                            workers=args.workers, blob_store=BlobStore())
+    folders = args.folder or [f.strip() for f in os.getenv('IMAP_FOLDERS', 'INBOX').split(',') if f.strip()]
+    imap = ImapSync(db, args.host, args.user, args.password, port=args.port,
+                    use_ssl=not args.no_ssl and os.getenv('IMAP_SSL', '1') != '0',
+                    folders=folders, fetch_batch=args.fetch_batch, importer=importer)
+    for folder, result in imap.sync().items():
+        print(f"{folder}: {result['new']} new, {result['imported']} imported, {result['duplicates']} duplicate(s), "
+              f"{result['failed']} failed; UID watermark {result['last_uid']} (UIDVALIDITY {result['uidvalidity']})")
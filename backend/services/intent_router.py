@@ -0,0 +1,287 @@
+import re
+from datetime import datetime, timedelta
+
+
+CATEGORY_ALIASES = {
+    'Important': ['urgent', 'important', 'critical', 'priority'],
+    'Newsletter': ['newsletter', 'newsletters', 'digest', 'digests'],
+    'Spam': ['spam', 'promotional', 'promotions', 'promo', 'junk'],
+    'To-Do': ['to-do', 'todo', 'to do'],
+}
+
+# Intents that can be answered straight from SQLite without calling the LLM
+STRUCTURED_INTENTS = ('list_emails', 'count_emails', 'list_tasks')
+
+# Weighted keyword rules for the lightweight classifier; the highest total wins
+INTENT_RULES = [
+    ('summarize_email', r'\bsummar(?:y|ize|ise|izing|ising)\b|\btl;?dr\b|\bgist\b', 3),
+    ('draft_reply', r'\bdraft\b|\brepl(?:y|ies)\b|\brespond\b|\bwrite back\b|\banswer (?:this|it)\b', 3),
+    ('count_emails', r'\bhow many\b|\bcount\b|\bnumber of\b', 3),
+    ('list_tasks', r'\btasks?\b|\baction items?\b|\bactions\b|\bneed to do\b|\bdeadlines?\b', 2),
+    ('list_tasks', r'\bto-?dos?\b|\bto do\b', 1),
+    ('list_emails', r'\b(?:e-?mails?|messages?|mails?|anything|inbox)\b', 1),
+    ('list_emails', r'\b(?:show|list|find|which|what are|any)\b', 1),
+]
+
+# "about the budget", "mention the offsite": a subject the structured queries can't filter on
+TOPIC_PATTERN = r'\b(?:about|regarding|concerning|mention(?:s|ed|ing)?|on the topic of)\s+(?:the\s+)?([\w][\w\s\-\'&]*?)\s*(?:[?.!,]|$)'
+
+SENDER_STOPWORDS = {
+    'today', 'yesterday', 'last', 'this', 'the', 'my', 'me', 'past', 'earlier',
+    'a', 'an', 'them', 'him', 'her', 'it', 'since', 'before', 'now',
+}
+
+
+class Intent:
+    def __init__(self, name, slots=None, confidence=0.0):
+        self.name = name
+        self.slots = slots or {}
+        self.confidence = confidence
+
+    @property
+    def is_structured(self):
+        return self.name in STRUCTURED_INTENTS
+
+    def to_dict(self):
+        return {'intent': self.name, 'slots': self.slots, 'confidence': self.confidence}
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, {self.slots!r})"
+
+
+class IntentRouter:
+    """Classifies chat queries into intents and extracts sender, category, date and topic slots.
+
+    All patterns are compiled once at construction; routing a query is a handful
+    of regex scans, so it is cheap enough to run on every chat message.
+    """
+
+    def __init__(self):
+        self.rules = [(name, re.compile(pattern, re.IGNORECASE), weight)
+                      for name, pattern, weight in INTENT_RULES]
+
+        self.category_patterns = [
+            (category, re.compile(r'\b(?:' + '|'.join(re.escape(a) for a in aliases) + r')\b', re.IGNORECASE))
+            for category, aliases in CATEGORY_ALIASES.items()
+        ]
+        self.topic_pattern = re.compile(TOPIC_PATTERN, re.IGNORECASE)
+        self.sender_pattern = re.compile(r'\b(?:from|by|sent by|sender)\s+([\w.@+\-]+)', re.IGNORECASE)
+        self.last_n_pattern = re.compile(r'\b(?:last|past)\s+(\d+)\s+(day|week|month)s?\b', re.IGNORECASE)
+        self.since_date_pattern = re.compile(r'\bsince\s+(\d{4}-\d{2}-\d{2})\b', re.IGNORECASE)
+        self.on_date_pattern = re.compile(r'\bon\s+(\d{4}-\d{2}-\d{2})\b', re.IGNORECASE)
+        self.relative_patterns = [
+            ('today', re.compile(r'\btoday\b', re.IGNORECASE)),
+            ('yesterday', re.compile(r'\byesterday\b', re.IGNORECASE)),
+            ('this_week', re.compile(r'\bthis week\b', re.IGNORECASE)),
+            ('last_week', re.compile(r'\blast week\b', re.IGNORECASE)),
+            ('this_month', re.compile(r'\bthis month\b', re.IGNORECASE)),
+        ]
+
+    def route(self, query, has_email=False, now=None):
+        slots = self.extract_slots(query, now=now)
+
+        scores = {}
+        for name, pattern, weight in self.rules:
+            if pattern.search(query):
+                scores[name] = scores.get(name, 0) + weight
+
+        # A category or sender on its own ("anything from alice?") is a listing request
+        if slots.get('category') or slots.get('sender'):
+            scores['list_emails'] = scores.get('list_emails', 0) + 1
+
+        # Email-specific intents only make sense with an email selected
+        if not has_email:
+            scores.pop('summarize_email', None)
+            scores.pop('draft_reply', None)
+
+        # "To-Do" can name a category; prefer listing emails when the query asks for emails
+        if slots.get('category') == 'To-Do' and 'list_tasks' in scores and scores.get('list_emails', 0) >= 2:
+            scores['list_tasks'] -= 1
+
+        if not scores:
+            return Intent('open_ended', slots)
+
+        name = max(scores, key=scores.get)
+        total = sum(scores.values())
+        confidence = round(scores[name] / total, 2)
+
+        # Listings, counts and task lists can't filter on a topic, so questions about one go to the LLM
+        if name in STRUCTURED_INTENTS and slots.get('topic'):
+            return Intent('open_ended', slots, confidence)
+
+        # Bare listing words with no filter at all ("what's in my inbox?") stay open-ended
+        if name == 'list_emails' and not (slots or scores[name] >= 2):
+            return Intent('open_ended', slots, confidence)
+
+        # The 'To-Do' category slot is implied by list_tasks, not a filter on it
+        if name == 'list_tasks' and slots.get('category') == 'To-Do':
+            slots.pop('category')
+
+        return Intent(name, slots, confidence)
+
+    def extract_slots(self, query, now=None):
+        slots = {}
+
+        for category, pattern in self.category_patterns:
+            if pattern.search(query):
+                slots['category'] = category
+                break
+
+        for match in self.sender_pattern.finditer(query):
+            candidate = match.group(1).strip('?.,!\'"').lower()
+            if candidate and candidate not in SENDER_STOPWORDS and not candidate.isdigit():
+                slots['sender'] = candidate
+                break
+
+        match = self.topic_pattern.search(query)
+        if match:
+            slots['topic'] = match.group(1).strip().lower()
+
+        date_range = self._extract_date_range(query, now or datetime.now())
+        if date_range:
+            since, until = date_range
+            slots['since'] = since
+            if until:
+                slots['until'] = until
+
+        return slots
+
+    def _extract_date_range(self, query, now):
+        start_of_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        match = self.last_n_pattern.search(query)
+        if match:
+            amount, unit = int(match.group(1)), match.group(2).lower()
+            days = amount * {'day': 1, 'week': 7, 'month': 30}[unit]
+            return self._iso(now - timedelta(days=days)), None
+
+        match = self.since_date_pattern.search(query)
+        if match:
+            return match.group(1) + 'T00:00:00', None
+
+        match = self.on_date_pattern.search(query)
+        if match:
+            day = datetime.strptime(match.group(1), '%Y-%m-%d')
+            return self._iso(day), self._iso(day + timedelta(days=1))
+
+        for name, pattern in self.relative_patterns:
+            if not pattern.search(query):
+                continue
+            if name == 'today':
+                return self._iso(start_of_today), None
+            if name == 'yesterday':
+                return self._iso(start_of_today - timedelta(days=1)), self._iso(start_of_today)
+            if name == 'this_week':
+                return self._iso(start_of_today - timedelta(days=start_of_today.weekday())), None
+            if name == 'last_week':
+                this_week = start_of_today - timedelta(days=start_of_today.weekday())
+                return self._iso(this_week - timedelta(days=7)), self._iso(this_week)
+            if name == 'this_month':
+                return self._iso(start_of_today.replace(day=1)), None
+
+        return None
+
+    def _iso(self, value):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class QueryPlanner:
+    """Answers structured intents with indexed SQL queries on EmailService."""
+
+    def __init__(self, email_service, list_limit=5, task_limit=10):
+        self.email_service = email_service
+        self.list_limit = list_limit
+        self.task_limit = task_limit
+
+    def answer(self, intent):
+        if intent.name == 'list_emails':
+            return self._list_emails(intent.slots)
+        if intent.name == 'count_emails':
+            return self._count_emails(intent.slots)
+        if intent.name == 'list_tasks':
+            return self._list_tasks(intent.slots)
+        return None
+
+    def _filters(self, slots):
+        return {
+            'sender': slots.get('sender'),
+            'category': slots.get('category'),
+            'since': slots.get('since'),
+            'until': slots.get('until'),
+        }
+
+    def _describe(self, slots):
+        parts = []
+        if slots.get('sender'):
+            parts.append(f"from {slots['sender']}")
+        if slots.get('since') and slots.get('until'):
+            parts.append(f"between {slots['since'][:10]} and {slots['until'][:10]}")
+        elif slots.get('since'):
+            parts.append(f"since {slots['since'][:10]}")
+        return (" " + " ".join(parts)) if parts else ""
+
+    def _label(self, slots, count):
+        category = slots.get('category')
+        noun = "email" if count == 1 else "emails"
+        if category == 'Important':
+            return f"urgent {noun}"
+        if category:
+            return f"{category} {noun}"
+        return noun
+
+    def _list_emails(self, slots):
+        filters = self._filters(slots)
+        total = self.email_service.count_emails(**filters)
+        if total == 0:
+            if slots.get('category') == 'Important' and not slots.get('sender'):
+                return "You have no urgent emails at the moment. Great job staying on top of things!"
+            return f"No {self._label(slots, 0)} found{self._describe(slots)}."
+
+        emails = self.email_service.find_emails(limit=self.list_limit, **filters)
+        lines = "\n".join(f"• {e['subject']} - from {e['sender']}" for e in emails)
+
+        header = f"You have {total} {self._label(slots, total)}{self._describe(slots)}"
+        if total > self.list_limit:
+            return f"{header}. Here are the most recent:\n{lines}\n...and {total - self.list_limit} more."
+        return f"{header}:\n{lines}"
+
+    def _count_emails(self, slots):
+        total = self.email_service.count_emails(**self._filters(slots))
+        return f"You have {total} {self._label(slots, total)}{self._describe(slots)}."
+
+    def _list_tasks(self, slots):
+        filters = self._filters(slots)
+        total = self.email_service.count_action_items(**filters)
+        if total == 0:
+            return "You have no pending tasks in your emails. Your inbox is all caught up!"
+
+        tasks = self.email_service.get_action_items(limit=self.task_limit, **filters)
+        task_list = []
+        for i, t in enumerate(tasks, 1):
+            deadline_str = f" (Due: {t['deadline']})" if t.get('deadline') else ""
+            task_list.append(f"{i}. {t['task']}{deadline_str} - from {t['from']}")
+
+        response = "Here are your pending tasks:\n\n" + "\n".join(task_list)
+        if total > self.task_limit:
+            response += f"\n\n...and {total - self.task_limit} more tasks."
+        return response
+
+
+if __name__ == '__main__':
+    router = IntentRouter()
+
+    test_queries = [
+        ("What are my urgent emails?", False),
+        ("List all my tasks", False),
+        ("Summarize this email", True),
+        ("Draft a reply to this email", True),
+        ("Show emails from sarah", False),
+        ("How many newsletters did I get this week?", False),
+        ("Any spam from the last 3 days?", False),
+        ("What should I focus on first?", False),
+        ("Any emails about the budget?", False),
+        ("What did the email from my boss say about the deadline?", False),
+    ]
+
+    for query, has_email in test_queries:
+        print(f"{query!r} -> {router.route(query, has_email=has_email)}")
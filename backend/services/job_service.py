@@ -0,0 +1,707 @@
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from services.llm_service import llm_priority, llm_deadline, llm_usage, PROMPT_WRAPPERS
+from services.prompt_templates import estimate_tokens
+from services.email_preprocessor import llm_body, cap_length
+from services.write_queue import write_tickets
+
+
+ACTIVE_STATUSES = ('queued', 'running')
+# Paused jobs hit their budget; they keep their pending items until resumed or cancelled
+OPEN_STATUSES = ACTIVE_STATUSES + ('paused',)
+MAX_REPORTED_ERRORS = 20
+
+# Emails this close to the newest one in a job count as recent
+RECENT_WINDOW = timedelta(days=int(os.getenv('JOB_RECENT_DAYS', '3')))
+URGENT_PATTERN = re.compile(r'\b(urgent|asap|action required|critical|important|deadline|eod|today)\b', re.IGNORECASE)
+
+# Earlier messages of a thread that has no stored summary yet are quoted up to this size
+THREAD_CONTEXT_TOKENS = int(os.getenv('THREAD_CONTEXT_TOKENS', '600'))
+
+# LLM scheduling class and deadline (seconds) for each kind of email, in processing order
+EMAIL_PRIORITIES = {
+    'urgent': ('priority', 10),
+    'recent': ('priority', 60),
+    'backlog': ('bulk', None),
+}
+
+
+class JobService:
+    """Runs inbox processing as background jobs with per-email checkpoints.
+
+    Submitting a job records it and one ``job_items`` row per email, then
+    returns immediately. Workers claim pending items in batches by taking a
+    lease on them (``lease_owner`` / ``lease_expires_at``), renew the lease
+    while they work, and checkpoint each finished email. A worker that dies
+    simply lets its leases expire and another worker reclaims them, so any
+    number of workers, in this process (``start()``) or in separate processes
+    (``worker.py``), can share the queue without processing an email twice.
+    Every job pins the prompt version it was submitted with.
+
+    A job may carry a token and/or cost budget. Its LLM usage is added up per
+    email, and before starting an email the worker checks that the spend so
+    far plus the expected cost of the emails in flight stays within budget;
+    otherwise the job is paused with its remaining items left pending, rather
+    than running on into provider rate limits or an unexpected bill.
+
+    With a ThreadService, emails are processed per conversation: a job has
+    one item per thread, keyed by its newest email, and the worker reads only
+    the messages since the thread's stored summary plus that summary, then
+    folds the new messages into it. ``total`` still counts emails.
+    """
+
+    def __init__(self, database, llm_service, email_service, prompt_service, precompute_service=None,
+                 max_workers=None, lease_seconds=None, worker_id=None, inline=True, thread_service=None,
+                 write_queue=None):
+        self.db = database
+        self.llm = llm_service
+        self.email_service = email_service
+        self.prompt_service = prompt_service
+        self.precompute_service = precompute_service
+        self.thread_service = thread_service
+        self.write_queue = write_queue
+        self.max_workers = max_workers or llm_service.max_concurrency
+        self.lease_seconds = lease_seconds or float(os.getenv('JOB_LEASE_SECONDS', '60'))
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-worker')
+        self._lock = threading.Lock()
+        self._budget_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._dispatcher = None
+        self._job_prompts = {}
+        # When False this process only submits jobs and separate worker processes run them
+        self.inline = inline
+
+    # Submission and control
+
+    def submit(self, email_ids=None, token_budget=None, cost_budget=None):
+        """Create a processing job for ``email_ids`` (default: every email).
+
+        ``token_budget`` / ``cost_budget`` (USD) cap the job's LLM usage and
+        default to JOB_TOKEN_BUDGET / JOB_COST_BUDGET_USD when set.
+        """
+        if token_budget is None and os.getenv('JOB_TOKEN_BUDGET'):
+            token_budget = int(os.getenv('JOB_TOKEN_BUDGET'))
+        if cost_budget is None and os.getenv('JOB_COST_BUDGET_USD'):
+            cost_budget = float(os.getenv('JOB_COST_BUDGET_USD'))
+
+        if email_ids:
+            emails = self.email_service.get_emails_by_ids(email_ids)
+        else:
+            emails = self.email_service.get_all_emails()
+        # Urgent, then recent mail first; the rest is backlog, newest first
+        classes = self.classify(emails)
+        ranks = list(EMAIL_PRIORITIES)
+        groups = self._group_by_thread(emails)
+        for group in groups:
+            group.sort(key=lambda e: e['timestamp'] or '', reverse=True)
+        # A thread is as urgent as its most urgent new message
+        groups.sort(key=lambda g: g[0]['timestamp'] or '', reverse=True)
+        groups.sort(key=lambda g: min(ranks.index(classes[e['id']]) for e in g))
+        prompts, prompt_version = self.prompt_service.get_prompts_with_version()
+
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO jobs (kind, status, prompt_version, prompts, total, token_budget, cost_budget)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                ('process_emails', 'queued', prompt_version, json.dumps(prompts), len(emails), token_budget, cost_budget)
+            )
+            job_id = cursor.lastrowid
+            conn.executemany(
+                '''INSERT INTO job_items (job_id, email_id, position, priority, thread_id, email_count)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                [(job_id, group[0]['id'], position, ranks[min(ranks.index(classes[e['id']]) for e in group)],
+                  group[0].get('thread_id') if self.thread_service else None, len(group))
+                 for position, group in enumerate(groups)]
+            )
+
+        self._finish_if_done(job_id)
+        if self.inline:
+            self.start()
+        self._wake.set()
+        return self.get_job(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; emails already in flight finish, the rest are skipped."""
+        self.db.execute_query(
+            f'''UPDATE jobs SET cancel_requested = 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ({','.join('?' * len(OPEN_STATUSES))})''',
+            (job_id, *OPEN_STATUSES)
+        )
+        self._finish_if_done(job_id)
+        return self.get_job(job_id)
+
+    def resume(self, job_id, token_budget=None, cost_budget=None):
+        """Requeue a paused job, optionally raising its budgets.
+
+        Raises ValueError if the job is not paused or would still be over budget.
+        """
+        job = self.get_job(job_id)
+        if job is None or job['status'] != 'paused':
+            raise ValueError(f"Job {job_id} is not paused")
+        if token_budget is not None:
+            job['token_budget'] = token_budget
+        if cost_budget is not None:
+            job['cost_budget'] = cost_budget
+
+        first_estimate = (0, 0.0)
+        if not job['completed'] + job['failed']:
+            rows = self.db.execute_query(
+                "SELECT email_id FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY position LIMIT 1",
+                (job_id,)
+            )
+            if rows:
+                first_estimate = self._estimate_email_usage(job_id, rows[0]['email_id'])
+        # Must afford at least one more email, or the job would pause again straight away
+        exceeded = self._budget_exceeded(job, in_flight=1, first_estimate=first_estimate)
+        if exceeded:
+            raise ValueError(f"{exceeded}; raise the budget to resume")
+
+        self.db.execute_query(
+            '''UPDATE jobs SET status = 'queued', error = NULL, token_budget = ?, cost_budget = ?,
+               run_started_at = NULL, run_start_done = completed + failed, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ? AND status = 'paused' ''',
+            (job['token_budget'], job['cost_budget'], job_id)
+        )
+        if self.inline:
+            self.start()
+        self._wake.set()
+        return self.get_job(job_id)
+
+    def resume_incomplete(self):
+        """Restart processing of jobs left unfinished by a previous run; returns their ids."""
+        rows = self.db.execute_query(
+            f'''SELECT id FROM jobs
+                WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) ORDER BY id''',
+            ACTIVE_STATUSES
+        )
+        resumed = [row['id'] for row in rows]
+        if resumed:
+            # Rates restart with this run so the ETA isn't skewed by the downtime
+            self.db.execute_query(
+                f'''UPDATE jobs SET run_started_at = NULL, run_start_done = completed + failed
+                    WHERE id IN ({','.join('?' * len(resumed))})''',
+                resumed
+            )
+            print(f"Resuming {len(resumed)} unfinished job(s): {resumed}")
+
+        if self.inline:
+            self.start()
+        return resumed
+
+    def _group_by_thread(self, emails):
+        """Split ``emails`` into per-thread groups; every email is its own group without threading."""
+        if self.thread_service is None:
+            return [[email] for email in emails]
+        groups = {}
+        for email in emails:
+            key = ('thread', email['thread_id']) if email.get('thread_id') else ('email', email['id'])
+            groups.setdefault(key, []).append(email)
+        return list(groups.values())
+
+    def classify(self, emails):
+        """Map email id to 'urgent', 'recent' or 'backlog' (see EMAIL_PRIORITIES)."""
+        timestamps = [self._parse_timestamp(e.get('timestamp')) for e in emails]
+        newest = max((t for t in timestamps if t), default=None)
+
+        classes = {}
+        for email, timestamp in zip(emails, timestamps):
+            text = f"{email.get('subject', '')} {email.get('body', '')[:500]}"
+            if email.get('category') == 'Important' or URGENT_PATTERN.search(text):
+                classes[email['id']] = 'urgent'
+            elif newest and timestamp and newest - timestamp <= RECENT_WINDOW:
+                classes[email['id']] = 'recent'
+            else:
+                classes[email['id']] = 'backlog'
+        return classes
+
+    def _parse_timestamp(self, value):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+        except (AttributeError, ValueError):
+            return None
+
+    # Status
+
+    def get_job(self, job_id):
+        rows = self.db.execute_query('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        job = self.db.row_to_dict(rows[0])
+        job.pop('prompts', None)
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        job['cost_used'] = round(job['cost_used'], 6)
+
+        done = job['completed'] + job['failed']
+        remaining = job['total'] - done
+        job['progress'] = round(done / job['total'], 3) if job['total'] else 1.0
+
+        # Rates cover the current run only, so a resumed job isn't credited with earlier work
+        job['throughput_per_min'] = None
+        job['eta_seconds'] = None
+        if job['run_started_at']:
+            end = job['finished_at'] or datetime.utcnow().isoformat(sep=' ')
+            elapsed = (datetime.fromisoformat(end) - datetime.fromisoformat(job['run_started_at'])).total_seconds()
+            processed = done - job['run_start_done']
+            if elapsed > 0 and processed > 0:
+                rate = processed / elapsed
+                job['throughput_per_min'] = round(rate * 60, 2)
+                if job['status'] in ACTIVE_STATUSES:
+                    job['eta_seconds'] = round(remaining / rate, 1)
+
+        job['workers'] = [row['lease_owner'] for row in self.db.execute_query(
+            '''SELECT DISTINCT lease_owner FROM job_items
+               WHERE job_id = ? AND status = 'pending' AND lease_expires_at >= ?''',
+            (job_id, time.time())
+        )]
+
+        errors = self.db.execute_query(
+            '''SELECT email_id, error FROM job_items
+               WHERE job_id = ? AND status = 'error' ORDER BY finished_at DESC LIMIT ?''',
+            (job_id, MAX_REPORTED_ERRORS)
+        )
+        job['errors'] = [self.db.row_to_dict(row) for row in errors]
+        return job
+
+    def get_jobs(self, limit=20):
+        rows = self.db.execute_query('SELECT id FROM jobs ORDER BY id DESC LIMIT ?', (limit,))
+        return [self.get_job(row['id']) for row in rows]
+
+    # Leases
+
+    def claim(self, limit):
+        """Atomically lease up to ``limit`` pending items, including ones whose lease expired."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            claimed = conn.execute(
+                f'''UPDATE job_items
+                    SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                    WHERE rowid IN (
+                        SELECT job_items.rowid FROM job_items
+                        JOIN jobs ON jobs.id = job_items.job_id
+                        WHERE job_items.status = 'pending'
+                          AND (job_items.lease_expires_at IS NULL OR job_items.lease_expires_at < ?)
+                          AND jobs.status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+                          AND jobs.cancel_requested = 0
+                        ORDER BY CASE job_items.priority WHEN 'urgent' THEN 0 WHEN 'recent' THEN 1 ELSE 2 END,
+                                 job_items.job_id, job_items.position
+                        LIMIT ?
+                    )
+                    RETURNING job_id, email_id, priority, attempts, thread_id, email_count''',
+                (self.worker_id, now + self.lease_seconds, now, *ACTIVE_STATUSES, limit)
+            ).fetchall()
+
+            job_ids = sorted({row['job_id'] for row in claimed})
+            if job_ids:
+                conn.execute(
+                    f'''UPDATE jobs SET status = 'running',
+                        run_started_at = COALESCE(run_started_at, strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                        updated_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({','.join('?' * len(job_ids))})''',
+                    job_ids
+                )
+
+        reclaimed = sum(1 for row in claimed if row['attempts'] > 1)
+        if reclaimed:
+            print(f"Worker {self.worker_id} reclaimed {reclaimed} item(s) with expired leases")
+        return [
+            {'job_id': row['job_id'], 'email_id': row['email_id'], 'priority': row['priority'],
+             'thread_id': row['thread_id'], 'email_count': row['email_count']}
+            for row in claimed
+        ]
+
+    def heartbeat(self, items):
+        """Extend the leases this worker holds on ``items``."""
+        if not items:
+            return
+        expires_at = time.time() + self.lease_seconds
+        with self.db.transaction() as conn:
+            conn.executemany(
+                '''UPDATE job_items SET lease_expires_at = ?
+                   WHERE job_id = ? AND email_id = ? AND lease_owner = ? AND status = 'pending' ''',
+                [(expires_at, item['job_id'], item['email_id'], self.worker_id) for item in items]
+            )
+
+    # Execution
+
+    def start(self):
+        """Process jobs on a background thread in this process."""
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            self._stopping.clear()
+            self._dispatcher = threading.Thread(target=self.run, daemon=True, name='job-dispatcher')
+        self._dispatcher.start()
+
+    def request_stop(self):
+        """Ask ``run()`` to stop claiming work; safe to call from a signal handler."""
+        self._stopping.set()
+        self._wake.set()
+
+    def stop(self):
+        """Stop claiming work; items in flight are finished and checkpointed."""
+        self.request_stop()
+        dispatcher = self._dispatcher
+        if dispatcher is not None and dispatcher is not threading.current_thread():
+            dispatcher.join()
+        self._pool.shutdown(wait=True)
+
+    def run(self, stop_when_idle=False, idle_wait=2.0):
+        """Claim and process items until stopped (or, with ``stop_when_idle``, until none are left).
+
+        Returns the number of items this worker processed.
+        """
+        in_flight = {}
+        last_heartbeat = time.monotonic()
+        processed = 0
+
+        try:
+            while not self._stopping.is_set():
+                free = self.max_workers - len(in_flight)
+                if free > 0:
+                    for item in self.claim(free):
+                        in_flight[self._pool.submit(self._process_item, item)] = item
+
+                if not in_flight:
+                    self._finish_stalled()
+                    if stop_when_idle:
+                        break
+                    self._wake.wait(idle_wait)
+                    self._wake.clear()
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.lease_seconds / 3, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                processed += len(done)
+
+                # Renew well before expiry so a slow LLM call never loses its lease
+                if time.monotonic() - last_heartbeat >= self.lease_seconds / 3:
+                    self.heartbeat(list(in_flight.values()))
+                    last_heartbeat = time.monotonic()
+        finally:
+            wait(in_flight)
+            with self._lock:
+                self._dispatcher = None
+        return processed + len(in_flight)
+
+    def _prompts_for(self, job_id):
+        with self._lock:
+            cached = self._job_prompts.get(job_id)
+        if cached is None:
+            rows = self.db.execute_query('SELECT prompts, prompt_version FROM jobs WHERE id = ?', (job_id,))
+            cached = (json.loads(rows[0]['prompts']), rows[0]['prompt_version'])
+            with self._lock:
+                self._job_prompts[job_id] = cached
+        return cached
+
+    def _process_item(self, item):
+        job_id, email_id = item['job_id'], item['email_id']
+        # Pool threads are reused, so the class is set per item and reset afterwards
+        priority, deadline_seconds = EMAIL_PRIORITIES.get(item.get('priority'), EMAIL_PRIORITIES['backlog'])
+        priority_token = llm_priority.set(priority)
+        deadline_token = llm_deadline.set(time.monotonic() + deadline_seconds if deadline_seconds else None)
+        try:
+            if self._check_budget(job_id, email_id, item.get('email_count') or 1):
+                self._run_item(job_id, email_id, item.get('thread_id'))
+        finally:
+            llm_priority.reset(priority_token)
+            llm_deadline.reset(deadline_token)
+        self._finish_if_done(job_id)
+
+    def _run_item(self, job_id, email_id, thread_id=None):
+        usage = {}
+        usage_token = llm_usage.set(usage)
+        writes = []
+        writes_token = write_tickets.set(writes)
+        try:
+            prompts, prompt_version = self._prompts_for(job_id)
+            email = self.email_service.get_email_by_id(email_id)
+            if email is None:
+                raise LookupError(f"Email {email_id} no longer exists")
+            if thread_id and self.thread_service is not None:
+                self.process_thread(thread_id, email, prompts, prompt_version)
+            else:
+                self.process_email(email, prompts, prompt_version)
+            # The item is only done once its results are durable
+            for ticket in writes:
+                ticket.result()
+            self._checkpoint(job_id, email_id, 'done', usage=usage)
+        except Exception as e:
+            print(f"Error processing email {email_id}: {e}")
+            self._checkpoint(job_id, email_id, 'error', str(e), usage=usage)
+        finally:
+            write_tickets.reset(writes_token)
+            llm_usage.reset(usage_token)
+
+    # Budgets
+
+    def _budget_exceeded(self, job, in_flight=0, first_estimate=(0, 0.0)):
+        """Describe the budget ``job`` would exceed with ``in_flight`` more emails, or None.
+
+        Each email is expected to cost what the job's emails have cost on
+        average, or ``first_estimate`` (tokens, USD) before any has finished.
+        """
+        done = job['completed'] + job['failed']
+        tokens_each, cost_each = (job['tokens_used'] / done, job['cost_used'] / done) if done else first_estimate
+
+        if job['token_budget'] is not None and job['tokens_used'] + in_flight * tokens_each > job['token_budget']:
+            return (f"Token budget of {job['token_budget']} reached "
+                    f"({job['tokens_used']} used, about {tokens_each:.0f} per email)")
+        if job['cost_budget'] is not None and job['cost_used'] + in_flight * cost_each > job['cost_budget']:
+            return (f"Cost budget of ${job['cost_budget']:.4f} reached "
+                    f"(${job['cost_used']:.4f} used, about ${cost_each:.4f} per email)")
+        return None
+
+    def _estimate_email_usage(self, job_id, email_id):
+        """Rough tokens and cost of processing one email, from its length and the job's prompts."""
+        prompts, _ = self._prompts_for(job_id)
+        email = self.email_service.get_email_by_id(email_id)
+        if email is None:
+            return 0, 0.0
+
+        body_tokens = estimate_tokens(email['subject'] + " " + llm_body(email))
+        tokens, cost = 0, 0.0
+        for task in ('categorization', 'action_item'):
+            input_tokens = body_tokens + estimate_tokens(PROMPT_WRAPPERS[task] + prompts[task])
+            output_tokens = self.llm.expected_output_tokens(task)
+            tokens += input_tokens + output_tokens
+            cost += self.llm.estimate_cost(self.llm.model_routes.get(task, self.llm.model), input_tokens, output_tokens)
+        return tokens, cost
+
+    def _check_budget(self, job_id, email_id, email_count=1):
+        """Return True if the job can afford this item; otherwise pause it and hand the item back."""
+        # Checking and marking the email started happen together, so this worker's threads can't all pass at once
+        with self._budget_lock:
+            exceeded = self._reserve_budget(job_id, email_id, email_count)
+        if not exceeded:
+            return True
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                '''UPDATE job_items SET lease_owner = NULL, lease_expires_at = NULL, attempts = attempts - 1
+                   WHERE job_id = ? AND email_id = ? AND status = 'pending' AND lease_owner = ?''',
+                (job_id, email_id, self.worker_id)
+            )
+            paused = conn.execute(
+                f'''UPDATE jobs SET status = 'paused', error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})''',
+                (exceeded, job_id, *ACTIVE_STATUSES)
+            ).rowcount
+        if paused:
+            print(f"Job {job_id} paused: {exceeded}")
+        return False
+
+    def _reserve_budget(self, job_id, email_id, email_count=1):
+        """Mark the item started if the job's budget allows it; returns the exceeded budget otherwise."""
+        # Spend is tracked per email, so a thread item counts for each of its new messages
+        rows = self.db.execute_query(
+            '''SELECT jobs.*, (SELECT COALESCE(SUM(email_count), 0) FROM job_items
+                               WHERE job_id = jobs.id AND status = 'pending' AND started_at IS NOT NULL
+                                 AND lease_expires_at >= ?) AS in_flight
+               FROM jobs WHERE id = ?''',
+            (time.time(), job_id)
+        )
+        job = self.db.row_to_dict(rows[0])
+        if job['token_budget'] is None and job['cost_budget'] is None:
+            return None
+
+        first_estimate = (0, 0.0)
+        if not job['completed'] + job['failed']:
+            first_estimate = self._estimate_email_usage(job_id, email_id)
+        # Counts the emails already being worked on, so concurrent workers can't all overspend
+        exceeded = self._budget_exceeded(job, in_flight=job['in_flight'] + email_count, first_estimate=first_estimate)
+        if not exceeded:
+            self.db.execute_query(
+                'UPDATE job_items SET started_at = ? WHERE job_id = ? AND email_id = ?',
+                (time.time(), job_id, email_id)
+            )
+        return exceeded
+
+    def process_email(self, email, prompts, prompt_version=None):
+        """Categorize one email and extract its action items, saving the results."""
+        body = llm_body(email)
+        category = self.llm.categorize_email(
+            email['subject'] + " " + body,
+            prompts['categorization'],
+            email=email
+        )
+        action_items = self.llm.extract_action_items(
+            body,
+            prompts['action_item'],
+            email=email
+        )
+        self.email_service.update_email(
+            email['id'],
+            category=category,
+            action_items=action_items,
+            prompt_version=prompt_version
+        )
+        return category, action_items
+
+    def process_thread(self, thread_id, email, prompts, prompt_version=None):
+        """Process the messages of a thread up to ``email`` that its stored summary doesn't cover yet.
+
+        The LLM sees the thread summary plus the new messages only. Every new
+        message gets the thread's category, judged on the new messages'
+        bodies. Action items are extracted per new message, with the rest of
+        the thread as context, and stored on the message that asked for them.
+        """
+        thread = self.thread_service.get_thread(thread_id)
+        timeline = [e for e in self.email_service.get_emails_in_thread(thread_id)
+                    if (e['timestamp'], e['id']) <= (email['timestamp'], email['id'])]
+        if thread is None or not timeline:
+            return self.process_email(email, prompts, prompt_version)
+
+        covered, delta = [], timeline
+        through = thread['summary_through']
+        if through and thread['prompt_version'] == prompt_version:
+            covered = [e for e in timeline if e['timestamp'] <= through]
+            delta = [e for e in timeline if e['timestamp'] > through]
+            # Nothing new means an explicit reprocess; a late arrival inside the covered part means a rebuild
+            if not delta or any(not e['processed'] for e in covered):
+                covered, delta = [], timeline
+
+        if len(timeline) == 1:
+            category, action_items = self.process_email(email, prompts, prompt_version)
+            # A lone message needs no summary; its body is the context for the first reply
+            self.thread_service.save_summary(thread_id, None, email['timestamp'], category, prompt_version)
+            return category, action_items
+
+        if thread['summary'] and covered:
+            context = thread['summary']
+        else:
+            context = self._messages_text(covered) if covered else ''
+
+        new_bodies = "\n\n".join(llm_body(m) for m in delta)
+        category = self.llm.categorize_email(email['subject'] + " " + new_bodies, prompts['categorization'], email=email)
+        # One call per new message, so each task lands on the email (and sender) it came from
+        extracted = self.llm._map(
+            lambda i: self.llm.extract_action_items(
+                self._extraction_text(context, delta[:i], delta[i]), prompts['action_item'], email=delta[i]
+            ),
+            range(len(delta))
+        )
+        summary = self.llm.summarize_thread(context, delta)
+
+        for message, items in zip(delta, extracted):
+            self.email_service.update_email(
+                message['id'],
+                category=category,
+                action_items=items,
+                prompt_version=prompt_version
+            )
+        self.thread_service.save_summary(thread_id, summary, email['timestamp'], category, prompt_version)
+        return category, extracted[-1]
+
+    def _messages_text(self, messages):
+        return cap_length("\n\n".join(f"From: {m['sender']}\n{llm_body(m)}" for m in messages), THREAD_CONTEXT_TOKENS)
+
+    def _extraction_text(self, context, earlier, message):
+        parts = []
+        earlier_text = "\n\n".join(part for part in (context, self._messages_text(earlier) if earlier else '') if part)
+        if earlier_text:
+            parts.append(f"Earlier in this thread (for context only):\n{earlier_text}")
+        parts.append("New message (only this one may contain new tasks):")
+        parts.append(f"From: {message['sender']}\nDate: {message['timestamp']}\n{llm_body(message)}")
+        return "\n\n".join(parts)
+
+    def _checkpoint(self, job_id, email_id, status, error=None, usage=None):
+        counter = 'completed' if status == 'done' else 'failed'
+        usage = usage or {}
+
+        def record(conn):
+            # Only the current lease holder may record the result
+            claimed = conn.execute(
+                '''UPDATE job_items SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP, lease_expires_at = NULL
+                   WHERE job_id = ? AND email_id = ? AND status = 'pending' AND lease_owner = ?
+                   RETURNING email_count''',
+                (status, error, job_id, email_id, self.worker_id)
+            ).fetchone()
+            if claimed:
+                conn.execute(
+                    f'''UPDATE jobs SET {counter} = {counter} + ?, tokens_used = tokens_used + ?,
+                        cost_used = cost_used + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
+                    (claimed['email_count'], usage.get('tokens', 0), usage.get('cost_usd', 0.0), job_id)
+                )
+            else:
+                print(f"Worker {self.worker_id} lost its lease on email {email_id} of job {job_id}")
+
+        if self.write_queue is not None:
+            # Shares a commit with other workers' results; waiting keeps _finish_if_done accurate
+            self.write_queue.submit(record).result()
+            return
+        with self.db.transaction() as conn:
+            record(conn)
+
+    def _finish_if_done(self, job_id):
+        """Mark the job completed or cancelled once nothing is left to do; returns the new status."""
+        now = time.time()
+        statuses = ','.join('?' * len(ACTIVE_STATUSES))
+        open_statuses = ','.join('?' * len(OPEN_STATUSES))
+        with self.db.transaction() as conn:
+            # Each statement re-checks its condition, so exactly one worker finishes a job
+            finished = conn.execute(
+                f'''UPDATE jobs SET status = 'completed', finished_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status IN ({statuses}) AND cancel_requested = 0
+                      AND NOT EXISTS (SELECT 1 FROM job_items WHERE job_id = ? AND status = 'pending')''',
+                (job_id, *ACTIVE_STATUSES, job_id)
+            ).rowcount
+            status = 'completed'
+            if not finished:
+                finished = conn.execute(
+                    f'''UPDATE jobs SET status = 'cancelled', finished_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                        updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND status IN ({open_statuses}) AND cancel_requested = 1
+                          AND NOT EXISTS (SELECT 1 FROM job_items WHERE job_id = ? AND status = 'pending'
+                                          AND lease_expires_at >= ?)''',
+                    (job_id, *OPEN_STATUSES, job_id, now)
+                ).rowcount
+                status = 'cancelled'
+
+        if not finished:
+            return None
+
+        with self._lock:
+            self._job_prompts.pop(job_id, None)
+        job = self.get_job(job_id)
+        print(f"Job {job_id} {status}: {job['completed']} processed, {job['failed']} failed of {job['total']}")
+
+        if status == 'completed' and self.precompute_service:
+            rows = self.db.execute_query(
+                "SELECT email_id, thread_id, email_count FROM job_items WHERE job_id = ? AND status = 'done'",
+                (job_id,)
+            )
+            queued = self.precompute_service.enqueue(self._processed_emails(rows))
+            if queued:
+                print(f"Queued {queued} email(s) for background precomputation")
+        return status
+
+    def _processed_emails(self, items):
+        """Every email the done ``items`` processed; a thread item covers its newest ``email_count`` messages."""
+        emails = self.email_service.get_emails_by_ids([item['email_id'] for item in items if not item['thread_id']])
+        for item in items:
+            if item['thread_id']:
+                emails.extend(self.email_service.get_emails_in_thread(item['thread_id'])[-item['email_count']:])
+        return emails
+
+    def _finish_stalled(self):
+        # Cancelled jobs whose last worker died never see a final checkpoint
+        rows = self.db.execute_query(
+            f'''SELECT id FROM jobs WHERE cancel_requested = 1
+                AND status IN ({','.join('?' * len(OPEN_STATUSES))})''',
+            OPEN_STATUSES
+        )
+        for row in rows:
+            self._finish_if_done(row['id'])
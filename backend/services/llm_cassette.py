@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    """Recorded Messages API exchanges, keyed by a hash of model, system prompt and messages."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def key(self, model, system, messages):
+        payload = json.dumps({'model': model, 'system': system, 'messages': messages}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CassetteClient:
+    """Drop-in for ``anthropic.Anthropic`` that replays, or records, a cassette.
+
+    In ``replay`` mode a call that is not on the cassette raises CassetteMiss,
+    so offline runs never silently reach the network. In ``record`` mode calls
+    go to ``inner`` (a real client) and the responses, token usage and
+    latency are stored. ``last_latency_ms`` holds the recorded latency of the
+    most recent call, so offline runs can still report realistic timings.
+    """
+
+    def __init__(self, cassette, inner=None, mode='replay'):
+        if mode == 'record' and inner is None:
+            raise ValueError("Recording needs a real client to forward calls to")
+
+        self.cassette = cassette
+        self.inner = inner
+        self.mode = mode
+        self.messages = self
+        self.last_latency_ms = None
+
+    def create(self, model, max_tokens, system, messages, **kwargs):
+        key = self.cassette.key(model, system, messages)
+        entry = self.cassette.get(key)
+
+        if entry is None and self.mode == 'replay':
+            raise CassetteMiss(f"No recorded response for this {model} call")
+
+        if entry is None:
+            start = time.perf_counter()
+            message = self.inner.messages.create(
+                model=model, max_tokens=max_tokens, system=system, messages=messages, **kwargs
+            )
+            entry = {
+                'model': model,
+                'text': message.content[0].text,
+                'input_tokens': message.usage.input_tokens,
+                'output_tokens': message.usage.output_tokens,
+                'latency_ms': (time.perf_counter() - start) * 1000,
+            }
+            self.cassette.put(key, entry)
+
+        self.last_latency_ms = entry.get('latency_ms')
+        return SimpleNamespace(
+            model=entry.get('model', model),
+            content=[SimpleNamespace(type='text', text=entry['text'])],
+            usage=SimpleNamespace(input_tokens=entry.get('input_tokens'), output_tokens=entry.get('output_tokens')),
+        )
@@ -0,0 +1,136 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+
+# Highest first; the value of the llm_priority context variable picks the class
+PRIORITY_CLASSES = ('interactive', 'priority', 'bulk', 'background')
+
+# Share of the concurrency budget each class gets while several have work
+DEFAULT_WEIGHTS = {'interactive': 8, 'priority': 4, 'bulk': 2, 'background': 1}
+
+# Seconds from submission used as the deadline when the caller gives none;
+# within a class, calls run earliest-deadline-first
+DEFAULT_DEADLINES = {'interactive': 2, 'priority': 30, 'bulk': 600, 'background': 3600}
+
+
+class LLMScheduler:
+    """Admits LLM calls by priority class under one concurrency budget.
+
+    Each class has its own queue ordered by deadline. When a slot frees up the
+    next call comes from the class with the lowest virtual time, and every
+    grant advances that class by ``1 / weight`` (stride scheduling), so busy
+    classes share the budget in proportion to their weights and an idle
+    class's share goes to the others. ``reserved_interactive`` slots are only
+    ever used by interactive calls, so a bulk run cannot make chat wait for a
+    slot, and background calls start only while no interactive call is
+    running or waiting.
+    """
+
+    def __init__(self, max_in_flight=None, weights=None, reserved_interactive=1):
+        self.max_in_flight = max_in_flight or int(os.getenv('LLM_MAX_IN_FLIGHT', '8'))
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.reserved_interactive = max(0, min(reserved_interactive, self.max_in_flight - 1))
+        self._cond = threading.Condition()
+        self._queues = {c: [] for c in PRIORITY_CLASSES}
+        self._in_flight = {c: 0 for c in PRIORITY_CLASSES}
+        self._virtual_time = {c: 0.0 for c in PRIORITY_CLASSES}
+        self._sequence = itertools.count()
+        self._stats = {c: {'granted': 0, 'wait_ms_total': 0.0, 'max_wait_ms': 0.0} for c in PRIORITY_CLASSES}
+
+    @contextmanager
+    def slot(self, priority='interactive', deadline=None):
+        """Hold one slot of the budget for the duration of an LLM call.
+
+        ``deadline`` is a ``time.monotonic()`` timestamp; earlier deadlines in
+        the same class are served first.
+        """
+        ticket = self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def acquire(self, priority, deadline=None):
+        if priority not in self._queues:
+            raise ValueError(f"Unknown LLM priority class: {priority}")
+
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + DEFAULT_DEADLINES[priority]
+        ticket = {'key': (deadline, next(self._sequence)), 'priority': priority, 'queued_at': now, 'granted': False}
+
+        with self._cond:
+            if not self._queues[priority] and not self._in_flight[priority]:
+                # A class coming back from idle starts level with the busy ones instead of banking credit
+                busy = [self._virtual_time[c] for c in PRIORITY_CLASSES if self._queues[c] or self._in_flight[c]]
+                if busy:
+                    self._virtual_time[priority] = max(self._virtual_time[priority], min(busy))
+
+            heapq.heappush(self._queues[priority], (ticket['key'], ticket))
+            self._dispatch()
+            self._cond.wait_for(lambda: ticket['granted'])
+        return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            self._in_flight[ticket['priority']] -= 1
+            self._dispatch()
+
+    def _eligible(self, priority):
+        if not self._queues[priority]:
+            return False
+        if priority == 'interactive':
+            return True
+
+        others = sum(n for c, n in self._in_flight.items() if c != 'interactive')
+        if others >= self.max_in_flight - self.reserved_interactive:
+            return False
+        if priority == 'background':
+            return not self._in_flight['interactive'] and not self._queues['interactive']
+        return True
+
+    def _dispatch(self):
+        granted = False
+        while sum(self._in_flight.values()) < self.max_in_flight:
+            eligible = [c for c in PRIORITY_CLASSES if self._eligible(c)]
+            if not eligible:
+                break
+
+            priority = min(eligible, key=lambda c: (self._virtual_time[c], PRIORITY_CLASSES.index(c)))
+            _, ticket = heapq.heappop(self._queues[priority])
+            ticket['granted'] = True
+            self._in_flight[priority] += 1
+            self._virtual_time[priority] += 1.0 / self.weights[priority]
+
+            waited_ms = (time.monotonic() - ticket['queued_at']) * 1000
+            stats = self._stats[priority]
+            stats['granted'] += 1
+            stats['wait_ms_total'] += waited_ms
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], waited_ms)
+            granted = True
+
+        if granted:
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'reserved_interactive': self.reserved_interactive,
+                'classes': {
+                    c: {
+                        'weight': self.weights[c],
+                        'waiting': len(self._queues[c]),
+                        'in_flight': self._in_flight[c],
+                        'granted': self._stats[c]['granted'],
+                        'avg_wait_ms': round(self._stats[c]['wait_ms_total'] / self._stats[c]['granted'], 2)
+                                       if self._stats[c]['granted'] else 0.0,
+                        'max_wait_ms': round(self._stats[c]['max_wait_ms'], 2),
+                    }
+                    for c in PRIORITY_CLASSES
+                },
+            }
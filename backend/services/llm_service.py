@@ -1,14 +1,106 @@
 import os
 import json
 import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from services.intent_router import IntentRouter
+from services.prompt_templates import TemplateEngine, estimate_tokens
+from services.tracing_service import trace_span
+from services.llm_scheduler import LLMScheduler
+from services.rate_limiter import RateLimiter
+from services.email_preprocessor import llm_body, split_into_chunks, cap_length
+
+
+# Built-in wrappers around the user-editable prompts, which fill {instructions}
+CATEGORIZE_TEMPLATE = """{instructions}
+
+Email content:
+{body_truncated}
+
+Please respond with only the category name: Important, Newsletter, Spam, or To-Do."""
+
+ACTION_ITEM_TEMPLATE = """{instructions}
+
+Email body:
+{body_truncated}
+
+Please respond with a JSON array of tasks, or an empty array [] if no tasks found."""
+
+REPLY_TEMPLATE = """{instructions}
+
+Email body:
+{body_truncated}
+
+{additional_instructions}
+
+Please draft a professional reply."""
+
+PROMPT_WRAPPERS = {
+    'categorization': CATEGORIZE_TEMPLATE,
+    'action_item': ACTION_ITEM_TEMPLATE,
+    'auto_reply': REPLY_TEMPLATE,
+}
+
+# USD per million (input, output) tokens, used for cost estimates
+MODEL_PRICING = {
+    'claude-sonnet-4-20250514': (3.00, 15.00),
+    'claude-3-5-haiku-20241022': (0.80, 4.00),
+    'claude-opus-4-20250514': (15.00, 75.00),
+    'default': (3.00, 15.00),
+}
+
+# Draft requests with no extra instructions, which a precomputed draft can answer
+GENERIC_DRAFT_PATTERN = re.compile(
+    r"^(?:please\s+)?(?:draft|write|generate)\s+(?:a\s+)?(?:reply|response)(?:\s+to\s+(?:this|the)\s+email)?[.!]?$",
+    re.IGNORECASE
+)
+
+# Scheduling class of the calls made in this context (see PRIORITY_CLASSES);
+# request handlers are interactive, job workers set 'priority' or 'bulk' per
+# email and speculative precomputation runs as 'background'
+llm_priority = contextvars.ContextVar('llm_priority', default='interactive')
+# Optional time.monotonic() deadline; earlier deadlines go first within a class
+llm_deadline = contextvars.ContextVar('llm_deadline', default=None)
+# Optional dict accumulating the calls, tokens and cost of this context's LLM
+# calls; job workers set one per email to enforce a run's budget
+llm_usage = contextvars.ContextVar('llm_usage', default=None)
+
+# Output tokens assumed for a task before any call has been seen
+DEFAULT_OUTPUT_ESTIMATE = 256
+
+# Rounds of combining partial summaries in groups before the rest is truncated
+MAX_COMBINE_ROUNDS = 3
+
+# Action items from different chunks of one email with this much word overlap are the same task
+DUPLICATE_TASK_OVERLAP = 0.6
 
 
 class LLMService:
     
-    def __init__(self):
+    def __init__(self, client=None, offline=False, base_url=None, rate_limiter=None):
         api_key = os.getenv('ANTHROPIC_API_KEY')
+        # Point at a local Messages API stand-in, e.g. http://127.0.0.1:8787
+        base_url = base_url or os.getenv('ANTHROPIC_BASE_URL')
         
-        if not api_key or api_key == 'your_api_key_here':
+        if client is not None:
+            # Injected client, e.g. a record/replay cassette
+            self.client = client
+        elif offline:
+            self.client = None
+        elif base_url:
+            # An explicitly configured endpoint must not quietly turn into mock responses
+            try:
+                from anthropic import Anthropic
+                # The local stand-in ignores the key, so a real one is not required
+                if not api_key or api_key == 'your_api_key_here':
+                    api_key = 'local-stub'
+                self.client = Anthropic(api_key=api_key, base_url=base_url)
+            except Exception as e:
+                raise RuntimeError(f"Could not create an Anthropic client for {base_url}: {e}") from e
+            print(f"Anthropic API initialized with base URL {base_url}")
+        elif not api_key or api_key == 'your_api_key_here':
             print("WARNING: ANTHROPIC_API_KEY not set. Using mock responses.")
             print("   Set your API key in .env file to use real AI responses.")
             self.client = None
@@ -24,26 +116,111 @@ class LLMService:
         
         self.model = "claude-sonnet-4-20250514"
         self.max_tokens = 1000
+        # Optional per-task model overrides, e.g. {'categorization': 'claude-3-5-haiku-20241022'}
+        self.model_routes = {}
+        # When False, API errors propagate instead of silently using a mock response
+        self.fallback_to_mock = True
+        # Callbacks receiving a usage dict after every LLM call
+        self.call_listeners = []
+        self.intent_router = IntentRouter()
+        self.templates = TemplateEngine()
+        # Upper bound on LLM calls in flight for one batch operation
+        self.max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))
+        # Longer bodies are summarized and searched for action items chunk by chunk, in parallel
+        self.chunk_tokens = int(os.getenv('LLM_CHUNK_TOKENS', '2000'))
+        # Process-wide admission of LLM calls by priority class
+        self.scheduler = LLMScheduler()
+        # Client-side RPM/TPM limits, so bursts wait here instead of drawing 429s
+        self.rate_limiter = rate_limiter or RateLimiter.from_env()
+        # Moving average of output tokens per task, used to reserve TPM before a call
+        self._output_estimates = {}
+    
+    def _call_llm(self, prompt, system_prompt="", task=None):
+        with self.scheduler.slot(llm_priority.get(), llm_deadline.get()):
+            return self._send(prompt, system_prompt, task)
     
-    def _call_llm(self, prompt, system_prompt=""):
+    def _send(self, prompt, system_prompt="", task=None):
+        model = self.model_routes.get(task, self.model)
+        system_prompt = system_prompt if system_prompt else "You are a helpful email assistant."
+        start = time.perf_counter()
+        
         if not self.client:
             # Return mock responses for testing without API key
-            return self._mock_response(prompt, system_prompt)
+            with trace_span('llm'):
+                text = self._mock_response(prompt, system_prompt)
+            self._notify(task, model, system_prompt, prompt, text, start)
+            return text
         
+        taken = self.rate_limiter.acquire(
+            estimate_tokens(system_prompt + prompt), self.expected_output_tokens(task)
+        )
+        # A failed call still counts as a request, but its token estimate is given back
+        usage = (0, 0)
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                system=system_prompt if system_prompt else "You are a helpful email assistant.",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return message.content[0].text
+            with trace_span('llm'):
+                message = self.client.messages.create(
+                    model=model,
+                    max_tokens=self.max_tokens,
+                    system=system_prompt,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ]
+                )
+            text = message.content[0].text
+            call = self._notify(task, model, system_prompt, prompt, text, start, getattr(message, 'usage', None))
+            usage = (call['input_tokens'], call['output_tokens'])
+            return text
         except Exception as e:
+            if getattr(e, 'status_code', None) == 429:
+                # The provider's limits are tighter than ours; hold everyone back for a while
+                self.rate_limiter.pause(self._retry_after(e))
+            if not self.fallback_to_mock:
+                raise
             print(f"LLM API Error: {e}")
             print("   Falling back to mock response")
             return self._mock_response(prompt, system_prompt)
+        finally:
+            self.rate_limiter.settle(taken, *usage)
+    
+    def _notify(self, task, model, system_prompt, prompt, text, start, usage=None):
+        call = {
+            'task': task,
+            'model': model,
+            'input_tokens': getattr(usage, 'input_tokens', None) or estimate_tokens(system_prompt + prompt),
+            'output_tokens': getattr(usage, 'output_tokens', None) or estimate_tokens(text),
+            'latency_ms': (time.perf_counter() - start) * 1000,
+        }
+        
+        previous = self._output_estimates.get(task, call['output_tokens'])
+        self._output_estimates[task] = 0.8 * previous + 0.2 * call['output_tokens']
+        
+        totals = llm_usage.get()
+        if totals is not None:
+            totals['calls'] = totals.get('calls', 0) + 1
+            totals['tokens'] = totals.get('tokens', 0) + call['input_tokens'] + call['output_tokens']
+            totals['cost_usd'] = totals.get('cost_usd', 0.0) + self.estimate_cost(
+                model, call['input_tokens'], call['output_tokens']
+            )
+        
+        for listener in self.call_listeners:
+            listener(call)
+        return call
+    
+    def expected_output_tokens(self, task):
+        """Output tokens a call for ``task`` is likely to use, from recent calls."""
+        estimate = self._output_estimates.get(task, DEFAULT_OUTPUT_ESTIMATE)
+        return min(self.max_tokens, int(estimate) + 1)
+    
+    def _retry_after(self, error):
+        response = getattr(error, 'response', None)
+        try:
+            return max(1.0, float(response.headers.get('retry-after')))
+        except (AttributeError, TypeError, ValueError):
+            return 5.0
+    
+    def estimate_cost(self, model, input_tokens, output_tokens):
+        input_price, output_price = MODEL_PRICING.get(model, MODEL_PRICING['default'])
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
     
     def _mock_response(self, prompt, system_prompt=""):
         prompt_lower = prompt.lower()
@@ -76,6 +253,9 @@ class LLMService:
         elif ('extract task' in prompt_lower or 'action item' in prompt_lower) and 'email body:' in prompt_lower:
             tasks = []
             content = email_body or prompt
+            # Thread context is framed as such; only the new message may add tasks
+            if 'only this one may contain new tasks):' in content:
+                content = content.split('only this one may contain new tasks):', 1)[1]
             
             if 'submit' in content.lower():
                 if 'timesheet' in content.lower():
@@ -110,6 +290,16 @@ class LLMService:
             
             return json.dumps(tasks) if tasks else "[]"
         
+        # CONVERSATION SUMMARY - before drafting, since transcripts often mention replies and drafts
+        elif 'summary of a conversation' in prompt_lower and 'new messages:' in prompt_lower:
+            before, transcript = prompt.split("New messages:", 1)
+            previous = before.split("Summary so far:", 1)[-1].strip()
+            requests = [line.split(':', 1)[1].strip() for line in transcript.strip().split('\n')
+                        if line.startswith('User:')]
+            parts = [] if previous in ('', '(none)') else [previous]
+            parts.extend(f"The user asked: {request[:100].rstrip('.')}." for request in requests)
+            return " ".join(parts) or "The user and the assistant talked about the inbox."
+        
         elif 'draft' in prompt_lower or 'reply' in prompt_lower:
             # Extract the actual user instruction from the full prompt
             user_instruction = ""
@@ -214,15 +404,66 @@ class LLMService:
         else:
             return "I understand your request and will help you with that. Could you please provide more specific details about what you'd like me to do?"
     
-    def categorize_email(self, email_content, categorization_prompt):
-        prompt = f"""{categorization_prompt}
+    def estimate_tokens(self, text):
+        return estimate_tokens(text)
+    
+    def summarize_conversation(self, previous_summary, messages, max_tokens=500):
+        transcript = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+        prompt = f"""Please update the running summary of a conversation between a user and their email assistant.
 
-Email content:
-{email_content}
+Summary so far:
+{previous_summary or "(none)"}
 
-Please respond with only the category name: Important, Newsletter, Spam, or To-Do."""
+New messages:
+{transcript}
+
+Write a concise summary of the whole conversation in at most {max_tokens * 3 // 4} words. Keep names, emails referred to, decisions and open requests."""
+        
+        summary = self._call_llm(prompt, system_prompt="You are a conversation summarization assistant.", task='conversation_summary').strip()
+        
+        # Hard cap so one verbose summary cannot blow the per-turn budget
+        max_chars = max_tokens * 4
+        if len(summary) > max_chars:
+            summary = summary[:max_chars].rsplit(' ', 1)[0] + "..."
+        return summary
+    
+    def _format_history(self, history):
+        if not history or not (history.get('summary') or history.get('messages')):
+            return ""
+        
+        parts = []
+        if history.get('summary'):
+            parts.append(f"Summary of the earlier conversation:\n{history['summary']}")
+        if history.get('messages'):
+            turns = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in history['messages'])
+            parts.append(f"Most recent messages:\n{turns}")
+        return "\n\n".join(parts) + "\n\n"
+    
+    def _render_prompt(self, wrapper, instructions, email=None, body='', **extra):
+        values = self.templates.email_variables(email, body)
+        values.update(extra)
+        prompt, tokens, truncated = self.templates.render(wrapper, instructions, values)
+        if truncated:
+            print(f"Truncated email body to fit the prompt budget (~{tokens} tokens)")
+        return prompt
+    
+    def _map(self, fn, items, max_workers=None):
+        """Apply ``fn`` to ``items`` concurrently, in order, each in a copy of the caller's context.
+        
+        ``max_workers`` can lower the pool size but never raise it above ``max_concurrency``.
+        """
+        max_workers = max(1, min(max_workers or self.max_concurrency, self.max_concurrency, len(items) or 1))
+        # Copies keep request tracing and the LLM priority class of the caller
+        contexts = [contextvars.copy_context() for _ in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda ctx, item: ctx.run(fn, item), contexts, items))
+    
+    def categorize_email(self, email_content, categorization_prompt, email=None):
+        # The gist of a long email is in its opening and closing, so one call on those is enough
+        email_content = cap_length(email_content, self.chunk_tokens)
+        prompt = self._render_prompt(CATEGORIZE_TEMPLATE, categorization_prompt, email, email_content)
         
-        response = self._call_llm(prompt, system_prompt="You are an email categorization assistant.")
+        response = self._call_llm(prompt, system_prompt="You are an email categorization assistant.", task='categorization')
         response = response.strip()
         valid_categories = ['Important', 'Newsletter', 'Spam', 'To-Do']
         
@@ -232,15 +473,40 @@ Please respond with only the category name: Important, Newsletter, Spam, or To-D
         
         return 'Important'  
     
-    def extract_action_items(self, email_body, action_item_prompt):
-        prompt = f"""{action_item_prompt}
-
-Email body:
-{email_body}
-
-Please respond with a JSON array of tasks, or an empty array [] if no tasks found."""
+    def extract_action_items(self, email_body, action_item_prompt, email=None):
+        chunks = split_into_chunks(email_body, self.chunk_tokens)
+        if len(chunks) == 1:
+            return self._extract_action_items(email_body, action_item_prompt, email)
         
-        response = self._call_llm(prompt, system_prompt="You are an action item extraction assistant.")
+        # Map: search every chunk at once (the scheduler bounds real concurrency);
+        # reduce: merge tasks found in more than one chunk
+        results = self._map(
+            lambda chunk: self._extract_action_items(chunk, action_item_prompt, email), chunks, max_workers=len(chunks)
+        )
+        return self._merge_action_items(results)
+    
+    def _merge_action_items(self, results):
+        merged = []
+        for tasks in results:
+            for task in tasks:
+                if not isinstance(task, dict) or not task.get('task'):
+                    continue
+                words = set(re.findall(r'[a-z0-9]+', str(task['task']).lower()))
+                for seen_words, seen in merged:
+                    overlap = len(words & seen_words) / len(words | seen_words) if words | seen_words else 1.0
+                    if overlap >= DUPLICATE_TASK_OVERLAP:
+                        # Keep the first wording, but take a deadline from whichever chunk had one
+                        if not seen.get('deadline') and task.get('deadline'):
+                            seen['deadline'] = task['deadline']
+                        break
+                else:
+                    merged.append((words, dict(task)))
+        return [task for _, task in merged]
+    
+    def _extract_action_items(self, email_body, action_item_prompt, email=None):
+        prompt = self._render_prompt(ACTION_ITEM_TEMPLATE, action_item_prompt, email, email_body)
+        
+        response = self._call_llm(prompt, system_prompt="You are an action item extraction assistant.", task='action_item')
         
         # Try to parse JSON from response
         try:
@@ -263,110 +529,155 @@ Please respond with a JSON array of tasks, or an empty array [] if no tasks foun
             print(f"Response was: {response[:100]}...")
             return []
     
-    def generate_reply(self, email_body, auto_reply_prompt, custom_instructions=""):
-        prompt = f"""{auto_reply_prompt}
+    def generate_reply(self, email_body, auto_reply_prompt, custom_instructions="", email=None):
+        prompt = self._render_prompt(
+            REPLY_TEMPLATE, auto_reply_prompt, email, email_body,
+            additional_instructions=f"Additional instructions: {custom_instructions}" if custom_instructions else ""
+        )
+        
+        response = self._call_llm(prompt, system_prompt="You are a professional email writing assistant.", task='auto_reply')
+        return response.strip()
+    
+    def generate_replies(self, emails, auto_reply_prompt, custom_instructions="", max_workers=None):
+        """Draft replies for several emails concurrently.
 
-Email body:
-{email_body}
+        Returns one entry per email, in order: the draft text, or the exception
+        raised while generating it, so one failure doesn't sink the batch.
+        """
+        def generate(email):
+            try:
+                return self.generate_reply(llm_body(email), auto_reply_prompt, custom_instructions, email=email)
+            except Exception as e:
+                return e
+        
+        return self._map(generate, emails, max_workers)
+    
+    def summarize_email(self, email):
+        body = llm_body(email)
+        chunks = split_into_chunks(body, self.chunk_tokens)
+        if len(chunks) == 1:
+            prompt = f"""Please provide a brief summary of this email:
 
-{f"Additional instructions: {custom_instructions}" if custom_instructions else ""}
+From: {email['sender']}
+Subject: {email['subject']}
+Body: {body}
 
-Please draft a professional reply."""
+Provide a 2-3 sentence summary highlighting the key points and any actions needed."""
+            return self._call_llm(prompt, system_prompt="You are an email summarization assistant.", task='summary')
         
-        response = self._call_llm(prompt, system_prompt="You are a professional email writing assistant.")
-        return response.strip()
+        # Map: summarize each chunk in parallel; reduce: combine the partial summaries
+        def summarize_part(numbered):
+            number, chunk = numbered
+            prompt = f"""Please summarize part {number} of {len(chunks)} of a long email:
+
+From: {email['sender']}
+Subject: {email['subject']}
+Body (part {number}): {chunk}
+
+Summarize this part in 2-3 sentences, keeping any requests, decisions, figures and deadlines."""
+            return self._call_llm(prompt, system_prompt="You are an email summarization assistant.", task='summary').strip()
+        
+        partials = self._map(summarize_part, list(enumerate(chunks, 1)), max_workers=len(chunks))
+        return self._combine_summaries(email, partials)
     
-    def process_chat_query(self, query, context, prompts):
-        query_lower = query.lower()
+    def _combine_summaries(self, email, partials):
+        combined = "\n\n".join(f"Part {number}: {summary}" for number, summary in enumerate(partials, 1))
+        for _ in range(MAX_COMBINE_ROUNDS):
+            if len(partials) <= 1 or estimate_tokens(combined) <= self.chunk_tokens:
+                break
+            # Very long emails give too many partial summaries for one call; combine them in groups first
+            groups = split_into_chunks(combined, self.chunk_tokens)
+            if len(groups) >= len(partials):
+                break
+            partials = self._map(lambda group: self._combine_summaries(email, [group]), groups, max_workers=len(groups))
+            previous, combined = combined, "\n\n".join(f"Part {number}: {summary}" for number, summary in enumerate(partials, 1))
+            # Summaries that come back no shorter would keep this going forever
+            if estimate_tokens(combined) >= estimate_tokens(previous):
+                break
+        # Whatever still doesn't fit after the rounds is cut rather than summarized again
+        combined = cap_length(combined, self.chunk_tokens)
         
-        # Summarize email
-        if 'summarize' in query_lower and context.get('email'):
-            email = context['email']
-            prompt = f"""Please provide a brief summary of this email:
+        prompt = f"""Please combine these summaries of consecutive parts of one email into a single summary:
 
 From: {email['sender']}
 Subject: {email['subject']}
-Body: {email['body']}
+
+{combined}
 
 Provide a 2-3 sentence summary highlighting the key points and any actions needed."""
-            
-            return self._call_llm(prompt, system_prompt="You are an email summarization assistant.")
+        return self._call_llm(prompt, system_prompt="You are an email summarization assistant.", task='summary')
+
+    def summarize_thread(self, previous_summary, messages, max_tokens=300):
+        """Fold the new ``messages`` of an email thread into its running summary."""
+        transcript = "\n\n".join(
+            f"From: {m['sender']}\nDate: {m['timestamp']}\n{cap_length(llm_body(m), self.chunk_tokens)}" for m in messages
+        )
+        prompt = f"""Please update the running summary of an email thread.
+
+Summary so far:
+{previous_summary or "(none)"}
+
+New messages:
+{transcript}
+
+Write a concise summary of the whole thread in at most {max_tokens * 3 // 4} words. Keep who asked for what, decisions, figures, deadlines and open questions."""
+
+        summary = self._call_llm(prompt, system_prompt="You are an email summarization assistant.", task='thread_summary').strip()
+
+        # Hard cap so the summary stays a small, fixed cost on every later delta
+        max_chars = max_tokens * 4
+        if len(summary) > max_chars:
+            summary = summary[:max_chars].rsplit(' ', 1)[0] + "..."
+        return summary
+
+    def process_chat_query(self, query, context, prompts=None, intent=None):
+        if intent is None:
+            intent = self.intent_router.route(query, has_email=bool(context.get('email')))
         
-        # Find urgent/important emails
-        elif 'urgent' in query_lower or 'important' in query_lower:
-            emails = context.get('all_emails', [])
-            urgent = [e for e in emails if e.get('category') == 'Important']
-            
-            if urgent:
-                subjects = [e['subject'] for e in urgent[:5]]
-                if len(urgent) > 5:
-                    return f"You have {len(urgent)} urgent emails. Here are the most recent:\n" + "\n".join(f"• {s}" for s in subjects) + f"\n...and {len(urgent) - 5} more."
-                else:
-                    return f"You have {len(urgent)} urgent email(s):\n" + "\n".join(f"• {s}" for s in subjects)
-            return "You have no urgent emails at the moment. Great job staying on top of things!"
+        # Summarize email
+        if intent.name == 'summarize_email' and context.get('email'):
+            # Served instantly when the background precompute already produced it
+            cached = context.get('precomputed_summary')
+            if cached:
+                return cached
+            return self.summarize_email(context['email'])
         
-        # List tasks/to-dos
-        elif 'task' in query_lower or 'to-do' in query_lower or 'action' in query_lower:
-            emails = context.get('all_emails', [])
-            all_tasks = []
-            
-            for email in emails:
-                if email.get('action_items'):
-                    for item in email['action_items']:
-                        all_tasks.append({
-                            'task': item.get('task', 'Unknown task'),
-                            'deadline': item.get('deadline', 'No deadline'),
-                            'from': email['sender']
-                        })
-            
-            if all_tasks:
-                task_list = []
-                for i, t in enumerate(all_tasks[:10], 1):
-                    deadline_str = f" (Due: {t['deadline']})" if t['deadline'] != 'No deadline' else ""
-                    task_list.append(f"{i}. {t['task']}{deadline_str} - from {t['from']}")
-                
-                response = f"Here are your pending tasks:\n\n" + "\n".join(task_list)
-                if len(all_tasks) > 10:
-                    response += f"\n\n...and {len(all_tasks) - 10} more tasks."
-                return response
-            return "You have no pending tasks in your emails. Your inbox is all caught up!"
-        
-        elif 'draft' in query_lower and context.get('email'):
+        elif intent.name == 'draft_reply' and context.get('email'):
             email = context['email']
-            draft = self.generate_reply(email['body'], prompts.get('auto_reply', ''), query)
+            cached = context.get('precomputed_draft')
+            if cached and GENERIC_DRAFT_PATTERN.match(query.strip()) and not context.get('history'):
+                return f"Here's a draft reply:\n\n{cached}\n\n---\nYou can edit this draft in the Drafts tab before sending."
+            if prompts is None:
+                prompts = context.get('prompts', {})
+            # Earlier turns may refine the draft ("make it shorter", "mention Friday")
+            instructions = self._format_history(context.get('history')) + query
+            draft = self.generate_reply(llm_body(email), prompts.get('auto_reply', ''), instructions, email=email)
             return f"Here's a draft reply:\n\n{draft}\n\n---\nYou can edit this draft in the Drafts tab before sending."
         
-        elif 'from' in query_lower or 'sender' in query_lower:
-            emails = context.get('all_emails', [])
-            words = query.split()
-            potential_sender = None
-            for i, word in enumerate(words):
-                if word.lower() == 'from' and i + 1 < len(words):
-                    potential_sender = words[i + 1].strip('?.,!')
-                    break
-            
-            if potential_sender:
-                matching = [e for e in emails if potential_sender.lower() in e['sender'].lower()]
-                if matching:
-                    subjects = [f"• {e['subject']}" for e in matching[:5]]
-                    return f"Found {len(matching)} email(s) from {potential_sender}:\n" + "\n".join(subjects)
-                return f"No emails found from {potential_sender}."
-        
+        # Structured intents are answered from SQLite by the QueryPlanner before
+        # reaching here; anything else is an open-ended question for the LLM
         else:
-            emails = context.get('all_emails', [])
+            emails = context.get('relevant_emails')
+            if emails:
+                heading = "Here are the emails in their inbox most relevant to the question"
+            else:
+                emails = context.get('recent_emails') or context.get('all_emails', [])
+                heading = "Here are the most recent emails in their inbox"
+            
             email_summaries = "\n".join([
-                f"- From {e['sender']}: {e['subject']} (Category: {e.get('category', 'Uncategorized')})"
+                f"- From {e['sender']}: {e['subject']} (Category: {e.get('category') or 'Uncategorized'})\n"
+                f"  {' '.join(llm_body(e).split())[:200]}"
                 for e in emails[:10]
             ])
             
-            prompt = f"""You are an email assistant. The user has asked: "{query}"
+            prompt = f"""{self._format_history(context.get('history'))}You are an email assistant. The user has asked: "{query}"
 
-Here are the most recent emails in their inbox:
+{heading}:
 {email_summaries}
 
 Please provide a helpful, concise response to their query."""
             
-            return self._call_llm(prompt, system_prompt="You are a helpful email management assistant.")
+            return self._call_llm(prompt, system_prompt="You are a helpful email management assistant.", task='chat')
 
 
 if __name__ == '__main__':    
@@ -0,0 +1,425 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.llm_cassette import Cassette, CassetteClient, CassetteMiss
+from services.prompt_templates import estimate_tokens
+
+
+class LatencyModel:
+    """Samples response latency in milliseconds.
+
+    Specs: ``fixed:200``, ``uniform:100,400``, ``normal:800,200`` (mean, stddev)
+    or ``lognormal:800,0.5`` (median, sigma). ``per_token_ms`` is added for
+    every output token, so long answers are slower, as with the real API.
+    """
+
+    def __init__(self, spec='fixed:0', per_token_ms=0.0, seed=None):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',') if p]
+        self.per_token_ms = per_token_ms
+        self._random = random.Random(seed)
+
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+
+    def sample(self, output_tokens=0):
+        p, r = self.params, self._random
+        if self.kind == 'fixed':
+            base = p[0] if p else 0.0
+        elif self.kind == 'uniform':
+            base = r.uniform(p[0], p[1])
+        elif self.kind == 'normal':
+            base = r.gauss(p[0], p[1])
+        else:
+            base = p[0] * r.lognormvariate(0, p[1])
+        return max(0.0, base) + self.per_token_ms * output_tokens
+
+
+class StubBackend:
+    """Produces Messages API responses for the stub server.
+
+    Answers come from a cassette when one is loaded (recording misses from the
+    real API in ``record`` mode), otherwise from LLMService's offline mock
+    responses. Injected failures and usage are counted for ``GET /stats``.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, overload_rate=0.0, rate_limit_rate=0.0,
+                 cassette_path=None, record=False, seed=None):
+        from services.llm_service import LLMService
+
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.mock = LLMService(offline=True)
+
+        self.cassette = Cassette(cassette_path) if cassette_path else None
+        self.client = None
+        if self.cassette is not None:
+            if record:
+                from anthropic import Anthropic
+                # Real calls go to the production API, never back to this server
+                self.client = CassetteClient(self.cassette, inner=Anthropic(base_url='https://api.anthropic.com'), mode='record')
+            else:
+                self.client = CassetteClient(self.cassette)
+
+        self.batches = {}
+        self.stats = {
+            'requests': 0,
+            'streamed': 0,
+            'errors': {},
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cassette_misses': 0,
+        }
+
+    def _count(self, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                self.stats[key] += value
+
+    def _count_error(self, status):
+        with self._lock:
+            self.stats['errors'][str(status)] = self.stats['errors'].get(str(status), 0) + 1
+
+    def injected_error(self):
+        """Return (status, error_type, message) for a simulated failure, or None."""
+        roll = self._random.random()
+        for rate, error in (
+            (self.rate_limit_rate, (429, 'rate_limit_error', 'Number of requests has exceeded your rate limit')),
+            (self.overload_rate, (529, 'overloaded_error', 'Overloaded')),
+            (self.error_rate, (500, 'api_error', 'Internal server error')),
+        ):
+            if roll < rate:
+                self._count_error(error[0])
+                return error
+            roll -= rate
+        return None
+
+    def complete(self, request):
+        """Answer one Messages API request body; returns (message, latency_ms)."""
+        model = request.get('model', 'claude-sonnet-4-20250514')
+        system = request.get('system', '')
+        messages = request.get('messages', [])
+        prompt = '\n'.join(self._text(m.get('content', '')) for m in messages if m.get('role') == 'user')
+
+        input_tokens = output_tokens = None
+        recorded_latency = None
+        if self.client is not None:
+            try:
+                response = self.client.messages.create(
+                    model=model, max_tokens=request.get('max_tokens', 1024), system=system, messages=messages
+                )
+            except CassetteMiss:
+                self._count(cassette_misses=1)
+                raise
+            text = response.content[0].text
+            input_tokens = response.usage.input_tokens
+            output_tokens = response.usage.output_tokens
+            recorded_latency = self.client.last_latency_ms
+        else:
+            text = self.mock._mock_response(prompt, system)
+
+        if input_tokens is None:
+            input_tokens = estimate_tokens(self._text(system) + prompt)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(text)
+
+        # Keep to the caller's max_tokens like the real API, at ~4 characters per token
+        max_tokens = request.get('max_tokens')
+        stop_reason = 'end_turn'
+        if max_tokens and output_tokens > max_tokens:
+            text = text[:max_tokens * 4]
+            output_tokens = max_tokens
+            stop_reason = 'max_tokens'
+
+        self._count(requests=1, input_tokens=input_tokens, output_tokens=output_tokens)
+        message = {
+            'id': f"msg_stub_{uuid.uuid4().hex[:24]}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': model,
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': stop_reason,
+            'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+        }
+        latency_ms = recorded_latency if recorded_latency is not None else self.latency.sample(output_tokens)
+        return message, latency_ms
+
+    def _text(self, content):
+        if isinstance(content, str):
+            return content
+        return ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+
+    # Message batches
+
+    def create_batch(self, requests):
+        batch_id = f"msgbatch_stub_{uuid.uuid4().hex[:24]}"
+        batch = {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'in_progress',
+            'request_counts': {'processing': len(requests), 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0},
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'ended_at': None,
+            'results': [],
+        }
+        with self._lock:
+            self.batches[batch_id] = batch
+
+        threading.Thread(target=self._run_batch, args=(batch, requests), daemon=True).start()
+        return self.batch_view(batch)
+
+    def _run_batch(self, batch, requests):
+        for item in requests:
+            try:
+                message, latency_ms = self.complete(item.get('params', {}))
+                time.sleep(latency_ms / 1000)
+                result = {'type': 'succeeded', 'message': message}
+                counter = 'succeeded'
+            except Exception as e:
+                result = {'type': 'errored', 'error': {'type': 'api_error', 'message': str(e)}}
+                counter = 'errored'
+
+            with self._lock:
+                batch['results'].append({'custom_id': item.get('custom_id'), 'result': result})
+                batch['request_counts']['processing'] -= 1
+                batch['request_counts'][counter] += 1
+
+        with self._lock:
+            batch['processing_status'] = 'ended'
+            batch['ended_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    def batch_view(self, batch):
+        with self._lock:
+            return {k: v for k, v in batch.items() if k != 'results'}
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    backend = None
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, error_type, message, headers=None):
+        self._send_json(status, {'type': 'error', 'error': {'type': error_type, 'message': message}}, headers)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '/stats':
+            with self.backend._lock:
+                return self._send_json(200, json.loads(json.dumps(self.backend.stats)))
+
+        if path.startswith('/v1/messages/batches/'):
+            parts = path[len('/v1/messages/batches/'):].split('/')
+            batch = self.backend.batches.get(parts[0])
+            if batch is None:
+                return self._send_error(404, 'not_found_error', 'Batch not found')
+            if len(parts) == 1:
+                return self._send_json(200, self.backend.batch_view(batch))
+            if parts[1] == 'results':
+                if batch['processing_status'] != 'ended':
+                    return self._send_error(400, 'invalid_request_error', 'Batch is still processing')
+                body = '\n'.join(json.dumps(r) for r in batch['results']).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-jsonl')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+        self._send_error(404, 'not_found_error', f"Unknown path {path}")
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        try:
+            request = self._read_json()
+        except ValueError:
+            return self._send_error(400, 'invalid_request_error', 'Request body is not valid JSON')
+
+        if path == '/v1/messages/batches':
+            return self._send_json(200, self.backend.create_batch(request.get('requests', [])))
+
+        if path != '/v1/messages':
+            return self._send_error(404, 'not_found_error', f"Unknown path {path}")
+
+        error = self.backend.injected_error()
+        if error:
+            status, error_type, message = error
+            headers = {'retry-after': '1'} if status == 429 else None
+            return self._send_error(status, error_type, message, headers)
+
+        try:
+            message, latency_ms = self.backend.complete(request)
+        except CassetteMiss as e:
+            return self._send_error(404, 'not_found_error', str(e))
+
+        if request.get('stream'):
+            self.backend._count(streamed=1)
+            return self._stream(message, latency_ms)
+
+        time.sleep(latency_ms / 1000)
+        self._send_json(200, message, {'request-id': message['id']})
+
+    def _stream(self, message, latency_ms):
+        """Send ``message`` as server-sent events, spreading the latency over its deltas."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        text = message['content'][0]['text']
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)] or ['']
+        # Time to first token takes a third of the latency, the rest is spread over the chunks
+        first_token_s = latency_ms / 3000
+        per_chunk_s = (latency_ms * 2 / 3000) / len(chunks)
+
+        start = dict(message, content=[], stop_reason=None, usage={'input_tokens': message['usage']['input_tokens'], 'output_tokens': 1})
+        event('message_start', {'type': 'message_start', 'message': start})
+        time.sleep(first_token_s)
+        event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for chunk in chunks:
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}})
+            time.sleep(per_chunk_s)
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': message['stop_reason'], 'stop_sequence': None},
+            'usage': {'output_tokens': message['usage']['output_tokens']},
+        })
+        event('message_stop', {'type': 'message_stop'})
+
+
+def create_server(backend, host='127.0.0.1', port=8787, quiet=True):
+    handler = type('BoundStubRequestHandler', (StubRequestHandler,), {'backend': backend, 'quiet': quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def run_benchmark(base_url, requests, concurrency):
+    """Drive LLMService against the stub over HTTP and report throughput and failures."""
+    from concurrent.futures import ThreadPoolExecutor
+    from services.llm_service import LLMService
+
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'mock_inbox.json')) as f:
+        inbox = json.load(f)
+
+    llm = LLMService(base_url=base_url)
+    if llm.client is None:
+        # The in-process mock would be measured instead of the server
+        raise SystemExit(f"No API client for {base_url}; not benchmarking the mock responses")
+    llm.fallback_to_mock = False
+    latencies = []
+    llm.call_listeners.append(lambda call: latencies.append(call['latency_ms']))
+
+    def one(i):
+        email = inbox[i % len(inbox)]
+        try:
+            llm.categorize_email(email['subject'] + " " + email['body'], "Categorize this email.", email=email)
+            return None
+        except Exception as e:
+            return type(e).__name__
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    failures = {}
+    for outcome in outcomes:
+        if outcome:
+            failures[outcome] = failures.get(outcome, 0) + 1
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+    print(f"{requests} requests at concurrency {concurrency} in {elapsed:.2f}s: {requests / elapsed:.1f} req/s")
+    print(f"Latency (successful calls, including client retries): p50 {p50:.0f}ms, p95 {p95:.0f}ms")
+    print(f"Failed after retries: {sum(failures.values())} {failures or ''}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic Messages API")
+    sub = parser.add_subparsers(dest='command')
+
+    serve = sub.add_parser('serve', help="Run the stub server (default)")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8787)
+    serve.add_argument('--latency', default='fixed:0', help="fixed:MS, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA")
+    serve.add_argument('--per-token-ms', type=float, default=0.0, help="Extra latency per output token")
+    serve.add_argument('--error-rate', type=float, default=0.0, help="Share of requests failing with 500")
+    serve.add_argument('--overload-rate', type=float, default=0.0, help="Share of requests failing with 529")
+    serve.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests failing with 429")
+    serve.add_argument('--cassette', help="Answer from this cassette instead of mock responses")
+    serve.add_argument('--record', action='store_true', help="Forward cassette misses to the real API and record them")
+    serve.add_argument('--seed', type=int)
+    serve.add_argument('--verbose', action='store_true')
+
+    bench = sub.add_parser('bench', help="Benchmark LLMService against a running stub")
+    bench.add_argument('--url', default='http://127.0.0.1:8787')
+    bench.add_argument('--requests', type=int, default=200)
+    bench.add_argument('--concurrency', type=int, default=8)
+
+    args = parser.parse_args()
+    if args.command == 'bench':
+        run_benchmark(args.url, args.requests, args.concurrency)
+        sys.exit(0)
+    if args.command is None:
+        args = parser.parse_args(['serve'] + sys.argv[1:])
+
+    backend = StubBackend(
+        latency=LatencyModel(args.latency, args.per_token_ms, args.seed),
+        error_rate=args.error_rate,
+        overload_rate=args.overload_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        cassette_path=args.cassette,
+        record=args.record,
+        seed=args.seed,
+    )
+    server = create_server(backend, args.host, args.port, quiet=not args.verbose)
+    print(f"Messages API stub listening on http://{args.host}:{args.port} (set ANTHROPIC_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if backend.cassette is not None and args.record:
+            backend.cassette.save()
+            print(f"Saved {len(backend.cassette)} recorded response(s) to {args.cassette}")
@@ -0,0 +1,402 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from datetime import datetime, timezone
+from email.header import decode_header, make_header
+from email.parser import BytesParser
+from email.utils import parseaddr, parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.email_preprocessor import clean_body, CLEANER_VERSION
+from services.blob_store import BlobStore
+
+
+MBOX_FROM_LINE = re.compile(rb'^From \S')
+# mboxrd escapes body lines starting with "From " as ">From ", ">>From ", ...
+MBOX_ESCAPED_FROM = re.compile(rb'^>(>*From )')
+
+# Raw messages handed to a worker process at a time; amortizes the pickling round trip
+DEFAULT_BATCH_SIZE = 200
+# Raw messages at least this large are kept whole in the blob store (emails.raw_blob)
+RAW_BLOB_MIN_BYTES = int(os.getenv('RAW_BLOB_MIN_BYTES', str(64 * 1024)))
+
+
+def iter_mbox(path):
+    """Yield the raw bytes of each message in an mbox file without reading it whole."""
+    lines = []
+    previous_blank = True
+    with open(path, 'rb') as f:
+        for line in f:
+            if previous_blank and MBOX_FROM_LINE.match(line):
+                if lines:
+                    yield b''.join(lines)
+                lines = []
+            else:
+                lines.append(MBOX_ESCAPED_FROM.sub(rb'\1', line) if line[:1] == b'>' else line)
+            previous_blank = not line.strip()
+    if lines:
+        yield b''.join(lines)
+
+
+def iter_maildir(path):
+    for folder in ('cur', 'new'):
+        directory = os.path.join(path, folder)
+        if not os.path.isdir(directory):
+            continue
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and not entry.name.startswith('.'):
+                with open(entry.path, 'rb') as f:
+                    yield f.read()
+
+
+def iter_eml(path):
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path) for name in names if name.lower().endswith('.eml')
+        )
+    for eml_path in paths:
+        with open(eml_path, 'rb') as f:
+            yield f.read()
+
+
+def detect_format(path):
+    if os.path.isdir(path):
+        if os.path.isdir(os.path.join(path, 'cur')) or os.path.isdir(os.path.join(path, 'new')):
+            return 'maildir'
+        return 'eml'
+    if path.lower().endswith('.eml'):
+        return 'eml'
+    return 'mbox'
+
+
+READERS = {'mbox': iter_mbox, 'maildir': iter_maildir, 'eml': iter_eml}
+
+
+def decode_part(part):
+    """Text of a MIME part, honouring its declared charset and surviving wrong or unknown ones."""
+    payload = part.get_payload(decode=True) or b''
+    charset = part.get_content_charset()
+    if charset:
+        try:
+            return payload.decode(charset, errors='replace')
+        except LookupError:
+            pass
+    try:
+        return payload.decode('utf-8')
+    except UnicodeDecodeError:
+        # Undeclared 8-bit mail is almost always Windows-1252/Latin-1
+        return payload.decode('cp1252', errors='replace')
+
+
+def parse_timestamp(value):
+    """ISO timestamp in UTC, the format stored in ``emails.timestamp``; None if unparseable."""
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec='seconds')
+
+
+def decode_header_value(value):
+    """Header text with RFC 2047 encoded words (=?utf-8?q?...?=) decoded."""
+    if value is None:
+        return ''
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (LookupError, UnicodeError, ValueError):
+        return str(value)
+
+
+def body_part(message):
+    """The first inline text/plain part, else the first inline text/html part, else None."""
+    html = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_maintype() != 'text':
+            continue
+        if (part.get('Content-Disposition') or '').strip().lower().startswith('attachment'):
+            continue
+        subtype = part.get_content_subtype()
+        if subtype == 'plain':
+            return part
+        if subtype == 'html' and html is None:
+            html = part
+    return html
+
+
+def attachment_parts(message, body):
+    """Leaf parts other than ``body`` that are attachments, named files or non-text content."""
+    for part in message.walk():
+        if part.is_multipart() or part is body:
+            continue
+        disposition = (part.get('Content-Disposition') or '').strip().lower()
+        if disposition.startswith('attachment') or part.get_filename() or part.get_content_maintype() != 'text':
+            yield part
+
+
+def parse_message(raw, blob_store=None):
+    """Turn one raw RFC 822 message into an ``emails`` row dict, or None if it can't be used.
+
+    The body is the text/plain part, falling back to text/html (cleaned to
+    text by ``clean_body``). With a ``blob_store``, attachment bytes and raw
+    messages of RAW_BLOB_MIN_BYTES or more are written to it and the row
+    carries their hashes (``attachments``, ``raw_blob``); without one,
+    attachments are skipped.
+    """
+    # The legacy (compat32) policy parses headers lazily; the modern one costs
+    # several times more per message and we only read a handful of headers
+    message = BytesParser().parsebytes(raw)
+    part = body_part(message)
+    body = decode_part(part) if part is not None else ''
+
+    sender = parseaddr(decode_header_value(message.get('From')))[1].lower()
+    if not sender and not body.strip():
+        return None
+    timestamp = parse_timestamp(message.get('Date'))
+    row = {
+        'sender': sender or 'unknown',
+        'subject': ' '.join(decode_header_value(message.get('Subject')).split()) or '(no subject)',
+        'body': body,
+        'body_clean': clean_body(body),
+        'timestamp': timestamp or datetime.utcnow().isoformat(timespec='seconds'),
+        'message_id': str(message.get('Message-ID') or '').strip() or None,
+        'in_reply_to': str(message.get('In-Reply-To') or '').strip() or None,
+        'reference_ids': ' '.join(str(message.get('References') or '').split()) or None,
+    }
+    # Only what the message itself says: an import-time timestamp would give each re-import a new hash
+    row['content_hash'] = content_hash(dict(row, timestamp=timestamp))
+
+    row['attachments'] = []
+    row['raw_blob'] = row['raw_size'] = None
+    if blob_store is not None:
+        for attachment in attachment_parts(message, part):
+            payload = attachment.get_payload(decode=True) or b''
+            row['attachments'].append({
+                'filename': decode_header_value(attachment.get_filename()) or None,
+                'content_type': attachment.get_content_type(),
+                'size': len(payload),
+                'blob_hash': blob_store.put(payload),
+            })
+        if len(raw) >= RAW_BLOB_MIN_BYTES:
+            row['raw_blob'] = blob_store.put(raw)
+            row['raw_size'] = len(raw)
+    return row
+
+
+def content_hash(email):
+    """Stable identity of an email's content, for sources without Message-IDs."""
+    key = '\0'.join(str(email.get(field) or '') for field in ('sender', 'subject', 'timestamp', 'body'))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def parse_batch(raws, blob_root=None):
+    """Worker-process entry point: parse a batch, returning (rows, failures).
+
+    Blobs are written from the worker so their bytes never travel back
+    through the pool; only hashes do.
+    """
+    blob_store = BlobStore(blob_root) if blob_root else None
+    rows, failures = [], 0
+    for raw in raws:
+        try:
+            row = parse_message(raw, blob_store)
+        except Exception:
+            row = None
+        if row is None:
+            failures += 1
+        else:
+            rows.append(row)
+    return rows, failures
+
+
+class MailImporter:
+    """Streams mbox, Maildir or .eml archives into the ``emails`` table.
+
+    The archive is read sequentially in the calling process and cut into
+    batches of raw messages; a process pool parses the MIME structure,
+    decodes charsets and cleans bodies, which is where the CPU time goes.
+    Parsed batches come back in order and are inserted one transaction per
+    batch, skipping messages already stored: by Message-ID, or by content
+    hash for messages without one. At most two batches per worker are in
+    flight, so memory stays flat however large the archive is.
+    """
+
+    def __init__(self, database, thread_service=None, vector_index=None, workers=None,
+                 batch_size=DEFAULT_BATCH_SIZE, progress_interval=5.0, blob_store=None):
+        self.db = database
+        self.thread_service = thread_service
+        self.vector_index = vector_index
+        self.blob_store = blob_store
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+
+    def import_path(self, path, fmt=None, progress=None):
+        """Import every message under ``path``; returns the run's statistics.
+
+        ``progress`` is called with the statistics every ``progress_interval``
+        seconds (default: print a progress line).
+        """
+        fmt = fmt or detect_format(path)
+        if fmt not in READERS:
+            raise ValueError(f"Unknown mailbox format: {fmt}")
+        return self.import_messages(READERS[fmt](path), source=fmt, progress=progress)
+
+    def import_messages(self, raws, source='stream', progress=None, on_stored=None):
+        """Import raw RFC 822 messages from any iterable; returns the run's statistics.
+
+        ``on_stored(count)`` is called after each batch is committed with the
+        number of raw messages it held. Batches are committed in input order,
+        so a caller can checkpoint how far into its source it has got.
+        """
+        progress = progress or self._print_progress
+        stats = {'source': source, 'read': 0, 'bytes': 0, 'imported': 0, 'duplicates': 0, 'failed': 0,
+                 'elapsed_seconds': 0.0, 'messages_per_second': 0.0, 'mb_per_second': 0.0}
+        blob_root = self.blob_store.root if self.blob_store is not None else None
+        start = last_report = time.perf_counter()
+
+        def store(future, count):
+            rows, failures = future.result()
+            stats['failed'] += failures
+            self._store(rows, stats, source)
+            if on_stored is not None:
+                on_stored(count)
+
+        # Spawned, not forked: the app imports from request threads, and a forked child
+        # would inherit whatever locks (sqlite, logging, the write queue) other threads hold
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = deque()
+            for batch in self._batches(raws):
+                stats['read'] += len(batch)
+                stats['bytes'] += sum(len(raw) for raw in batch)
+                pending.append((pool.submit(parse_batch, batch, blob_root), len(batch)))
+                if len(pending) >= self.workers * 2:
+                    store(*pending.popleft())
+
+                if time.perf_counter() - last_report >= self.progress_interval:
+                    self._update_rates(stats, start)
+                    progress(dict(stats))
+                    last_report = time.perf_counter()
+            while pending:
+                store(*pending.popleft())
+
+        self._update_rates(stats, start)
+        return stats
+
+    def _batches(self, raws):
+        batch = []
+        for raw in raws:
+            batch.append(raw)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _store(self, rows, stats, source):
+        message_ids = [row['message_id'] for row in rows if row['message_id']]
+        hashes = [row['content_hash'] for row in rows if not row['message_id']]
+        existing = set()
+        if message_ids or hashes:
+            # Earlier batches are committed already, so the table covers the whole run
+            found = self.db.execute_query(
+                f'''SELECT message_id, content_hash FROM emails
+                    WHERE message_id IN ({', '.join('?' * len(message_ids))})
+                       OR content_hash IN ({', '.join('?' * len(hashes))})''',
+                message_ids + hashes
+            )
+            existing = {r['message_id'] for r in found} | {r['content_hash'] for r in found}
+
+        fresh = []
+        for row in rows:
+            key = row['message_id'] or row['content_hash']
+            if key in existing:
+                stats['duplicates'] += 1
+                continue
+            existing.add(key)
+            fresh.append(row)
+
+        if not fresh:
+            return
+        stored = []
+        with self.db.transaction() as conn:
+            for row in fresh:
+                # A concurrent import or sync may have stored the message since the lookup above
+                inserted = conn.execute(
+                    '''INSERT INTO emails (sender, subject, body, body_clean, body_clean_version, timestamp, message_id,
+                                           in_reply_to, reference_ids, content_hash, source, raw_blob, raw_size)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT DO NOTHING RETURNING id''',
+                    (row['sender'], row['subject'], row['body'], row['body_clean'], CLEANER_VERSION, row['timestamp'],
+                     row['message_id'], row['in_reply_to'], row['reference_ids'], row['content_hash'], source,
+                     row['raw_blob'], row['raw_size'])
+                ).fetchone()
+                if inserted is None:
+                    stats['duplicates'] += 1
+                    continue
+                row['id'] = inserted[0]
+                stored.append(row)
+                conn.executemany(
+                    '''INSERT INTO attachments (email_id, filename, content_type, size, blob_hash)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    [(row['id'], a['filename'], a['content_type'], a['size'], a['blob_hash'])
+                     for a in row['attachments']]
+                )
+        stats['imported'] += len(stored)
+
+        if not stored:
+            return
+        if self.thread_service is not None:
+            self.thread_service.assign(stored)
+        if self.vector_index is not None:
+            self.vector_index.add_emails(stored)
+
+    def _update_rates(self, stats, start):
+        elapsed = time.perf_counter() - start
+        stats['elapsed_seconds'] = round(elapsed, 2)
+        if elapsed > 0:
+            stats['messages_per_second'] = round(stats['read'] / elapsed, 1)
+            stats['mb_per_second'] = round(stats['bytes'] / elapsed / 1e6, 2)
+
+    def _print_progress(self, stats):
+        print(f"Read {stats['read']} messages ({stats['bytes'] / 1e6:.0f} MB): {stats['imported']} imported, "
+              f"{stats['duplicates']} duplicate(s), {stats['failed']} failed; "
+              f"{stats['messages_per_second']:.0f} msg/s, {stats['mb_per_second']:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from models.database import Database
+    from services.thread_service import ThreadService
+    from services.vector_index import VectorIndex
+
+    parser = argparse.ArgumentParser(description="Import an mbox file, Maildir or .eml files into the email database")
+    parser.add_argument('path', help="mbox file, Maildir directory, .eml file or directory of .eml files")
+    parser.add_argument('--format', choices=sorted(READERS), help="Archive format (default: detected from the path)")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Messages per parse task and insert")
+    parser.add_argument('--index', action='store_true',
+                        help="Also update the retrieval index; only while app.py is stopped, since it holds the "
+                             "index in memory (by default it indexes the new emails on startup or its next sync)")
+    args = parser.parse_args()
+
+    db = Database()
+    db.initialize()
+    importer = MailImporter(
+        db, ThreadService(db), VectorIndex() if args.index else None,
+        workers=args.workers, batch_size=args.batch_size, blob_store=BlobStore()
+    )
+    result = importer.import_path(args.path, fmt=args.format)
+    print(f"Done: {result['imported']} imported, {result['duplicates']} duplicate(s), {result['failed']} failed "
+          f"of {result['read']} messages in {result['elapsed_seconds']:.1f}s "
+          f"({result['messages_per_second']:.0f} msg/s, {result['mb_per_second']:.1f} MB/s)")
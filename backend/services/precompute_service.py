@@ -0,0 +1,129 @@
+import queue
+import hashlib
+import threading
+
+from services.llm_service import llm_priority
+from services.email_preprocessor import llm_body
+
+
+PRECOMPUTE_CATEGORIES = ('Important', 'To-Do')
+
+
+class PrecomputeService:
+    """Speculatively generates summaries and reply drafts for high-priority emails.
+
+    After processing, Important and To-Do emails are queued for a single
+    background worker. Its LLM calls run at background priority, so they only
+    start while no interactive call is in flight. Results are keyed by a hash of
+    the text the prompts are built from - sender, subject and cleaned body -
+    and, for drafts, the auto-reply prompt. Editing the email, a new body
+    cleaner or a prompt change makes the old result unreachable instead of
+    serving it stale.
+    """
+
+    def __init__(self, database, llm_service, prompt_service, write_queue=None):
+        self.db = database
+        self.write_queue = write_queue
+        self.llm = llm_service
+        self.prompt_service = prompt_service
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    # Cache keys
+
+    def content_hash(self, email):
+        # Exactly what summarize_email and generate_reply put in front of the LLM
+        content = f"{email['sender']}\n{email['subject']}\n{llm_body(email)}"
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _key(self, email, kind, prompt_text=''):
+        prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:16] if prompt_text else ''
+        return f"{kind}:{self.content_hash(email)}:{prompt_hash}"
+
+    # Lookups
+
+    def get_summary(self, email):
+        return self._get(self._key(email, 'summary'))
+
+    def get_draft(self, email, auto_reply_prompt):
+        return self._get(self._key(email, 'draft', auto_reply_prompt))
+
+    def _get(self, cache_key):
+        rows = self.db.execute_query(
+            'SELECT result FROM precomputed_results WHERE cache_key = ?',
+            (cache_key,)
+        )
+        return rows[0]['result'] if rows else None
+
+    def _put(self, email, kind, cache_key, result):
+        def store(conn):
+            # Drop results computed from older content or prompts for this email
+            conn.execute(
+                'DELETE FROM precomputed_results WHERE email_id = ? AND kind = ?',
+                (email['id'], kind)
+            )
+            conn.execute(
+                '''INSERT OR REPLACE INTO precomputed_results (cache_key, email_id, kind, result)
+                   VALUES (?, ?, ?, ?)''',
+                (cache_key, email['id'], kind, result)
+            )
+
+        if self.write_queue is not None:
+            # Nothing waits on a speculative result; the writer folds it into its next group
+            self.write_queue.submit(store)
+            return
+        with self.db.transaction() as conn:
+            store(conn)
+
+    # Background work
+
+    def enqueue(self, emails):
+        """Queue high-priority emails for precomputation; returns how many were queued."""
+        count = 0
+        with self._lock:
+            for email in emails:
+                if email.get('category') not in PRECOMPUTE_CATEGORIES or email['id'] in self._queued:
+                    continue
+                self._queued.add(email['id'])
+                self._queue.put(email)
+                count += 1
+
+            if count and self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+        return count
+
+    def _run(self):
+        llm_priority.set('background')
+
+        while True:
+            try:
+                email = self._queue.get(timeout=5)
+            except queue.Empty:
+                # Exit when idle; checked under the lock so enqueue() starts a new worker
+                with self._lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+
+            try:
+                self.precompute(email)
+            except Exception as e:
+                print(f"Error precomputing results for email {email['id']}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(email['id'])
+
+    def precompute(self, email):
+        summary_key = self._key(email, 'summary')
+        if self._get(summary_key) is None:
+            self._put(email, 'summary', summary_key, self.llm.summarize_email(email).strip())
+
+        auto_reply_prompt = self.prompt_service.get_prompt('auto_reply') or ''
+        draft_key = self._key(email, 'draft', auto_reply_prompt)
+        if self._get(draft_key) is None:
+            self._put(email, 'draft', draft_key, self.llm.generate_reply(llm_body(email), auto_reply_prompt, email=email))
@@ -1,44 +1,143 @@
+import json
+import time
+import threading
+
+
 class PromptService:
-    def __init__(self, database):
+    """Prompt storage with an in-process cache and a version history.
+
+    Every change to the prompt set is written in one transaction together with
+    a snapshot row in ``prompt_versions``, whose id is the new version number.
+    Reads are served from memory; the cache is refreshed when a local write
+    bumps the version, or when another process has written a newer version
+    (checked at most every ``version_check_interval`` seconds).
+    """
+
+    def __init__(self, database, version_check_interval=1.0):
         self.db = database
-    
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._cache = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _latest_version(self):
+        rows = self.db.execute_query('SELECT MAX(version) AS version FROM prompt_versions')
+        return rows[0]['version'] if rows and rows[0]['version'] is not None else 0
+
+    def _load(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._cache is not None and now - self._checked_at < self.version_check_interval:
+                return self._cache, self._version
+
+            version = self._latest_version()
+            if self._cache is None or version != self._version:
+                # One statement reads one snapshot, so the version always matches the texts
+                rows = self.db.execute_query(
+                    '''SELECT prompt_type, prompt_text, COALESCE((SELECT MAX(version) FROM prompt_versions), 0) AS version
+                       FROM prompts'''
+                )
+                self._cache = {row['prompt_type']: row['prompt_text'] for row in rows}
+                self._version = rows[0]['version'] if rows else version
+
+            self._checked_at = now
+            return self._cache, self._version
+
+    def _invalidate(self):
+        with self._lock:
+            self._cache = None
+            self._version = None
+
     def get_all_prompts(self):
-        rows = self.db.execute_query('SELECT * FROM prompts')
-        prompts = {}
-        for row in rows:
-            row_dict = self.db.row_to_dict(row)
-            prompts[row_dict['prompt_type']] = row_dict['prompt_text']
-        return prompts
-    
+        prompts, _ = self._load()
+        return dict(prompts)
+
+    def get_prompts_with_version(self):
+        prompts, version = self._load()
+        return dict(prompts), version
+
+    def get_current_version(self):
+        _, version = self._load()
+        return version
+
     def get_prompt(self, prompt_type):
-        rows = self.db.execute_query(
-            'SELECT prompt_text FROM prompts WHERE prompt_type = ?',
-            (prompt_type,)
-        )
-        if rows:
-            return rows[0]['prompt_text']
-        return None
-    
-    def update_prompts(self, prompts_dict):
-        for prompt_type, prompt_text in prompts_dict.items():
-            self.db.execute_query(
-                '''UPDATE prompts 
-                   SET prompt_text = ?, updated_at = CURRENT_TIMESTAMP
-                   WHERE prompt_type = ?''',
-                (prompt_text, prompt_type)
-            )
-    
+        prompts, _ = self._load()
+        return prompts.get(prompt_type)
+
+    def update_prompts(self, prompts_dict, note=None):
+        """Apply several prompt changes atomically and return the new version number."""
+        with self.db.transaction() as conn:
+            for prompt_type, prompt_text in prompts_dict.items():
+                conn.execute(
+                    '''UPDATE prompts
+                       SET prompt_text = ?, updated_at = CURRENT_TIMESTAMP
+                       WHERE prompt_type = ?''',
+                    (prompt_text, prompt_type)
+                )
+            version = self._snapshot(conn, note or 'update')
+
+        self._invalidate()
+        print(f"Prompts updated to version {version}")
+        return version
+
     def update_prompt(self, prompt_type, prompt_text):
-        self.db.execute_query(
-            '''UPDATE prompts 
-               SET prompt_text = ?, updated_at = CURRENT_TIMESTAMP
-               WHERE prompt_type = ?''',
-            (prompt_text, prompt_type)
-        )
-    
+        return self.update_prompts({prompt_type: prompt_text})
+
     def create_prompt(self, prompt_type, prompt_text):
-        self.db.execute_insert(
-            '''INSERT INTO prompts (prompt_type, prompt_text)
-               VALUES (?, ?)''',
-            (prompt_type, prompt_text)
-        )
\ No newline at end of file
+        with self.db.transaction() as conn:
+            conn.execute(
+                '''INSERT INTO prompts (prompt_type, prompt_text)
+                   VALUES (?, ?)''',
+                (prompt_type, prompt_text)
+            )
+            version = self._snapshot(conn, f'create {prompt_type}')
+
+        self._invalidate()
+        return version
+
+    def _snapshot(self, conn, note):
+        rows = conn.execute('SELECT prompt_type, prompt_text FROM prompts').fetchall()
+        prompts = {row['prompt_type']: row['prompt_text'] for row in rows}
+        cursor = conn.execute(
+            'INSERT INTO prompt_versions (prompts, note) VALUES (?, ?)',
+            (json.dumps(prompts), note)
+        )
+        return cursor.lastrowid
+
+    # History
+
+    def get_versions(self):
+        rows = self.db.execute_query(
+            'SELECT version, note, created_at FROM prompt_versions ORDER BY version DESC'
+        )
+        return [self.db.row_to_dict(row) for row in rows]
+
+    def get_version(self, version):
+        rows = self.db.execute_query('SELECT * FROM prompt_versions WHERE version = ?', (version,))
+        if not rows:
+            return None
+
+        snapshot = self.db.row_to_dict(rows[0])
+        snapshot['prompts'] = json.loads(snapshot['prompts'])
+        return snapshot
+
+    def rollback(self, version):
+        """Restore the prompt set from ``version``; the restore itself becomes a new version."""
+        snapshot = self.get_version(version)
+        if snapshot is None:
+            raise ValueError(f"Prompt version {version} not found")
+
+        with self.db.transaction() as conn:
+            for prompt_type, prompt_text in snapshot['prompts'].items():
+                conn.execute(
+                    '''INSERT INTO prompts (prompt_type, prompt_text) VALUES (?, ?)
+                       ON CONFLICT(prompt_type) DO UPDATE
+                       SET prompt_text = excluded.prompt_text, updated_at = CURRENT_TIMESTAMP''',
+                    (prompt_type, prompt_text)
+                )
+            new_version = self._snapshot(conn, f'rollback to {version}')
+
+        self._invalidate()
+        print(f"Rolled prompts back to version {version} (now version {new_version})")
+        return new_version
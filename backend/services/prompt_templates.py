@@ -0,0 +1,230 @@
+import os
+import re
+import threading
+from datetime import date
+
+
+# Only {identifier} is a placeholder, so JSON examples like {"task": ...} in a
+# prompt stay literal text; {{name}} escapes a placeholder.
+PLACEHOLDER_PATTERN = re.compile(r'\{\{|\}\}|\{([a-z_][a-z0-9_]*)\}')
+
+TRUNCATION_MARKER = "\n[...truncated...]"
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4) if text else 0
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Variable:
+    def __init__(self, name, type_, description, user_facing=True):
+        self.name = name
+        self.type = type_
+        self.description = description
+        self.user_facing = user_facing
+
+    def format(self, value):
+        if value is None:
+            return ''
+        if self.type is date:
+            return value.strftime('%A, %B %d, %Y')
+        if not isinstance(value, self.type):
+            raise TemplateError(f"Variable {{{self.name}}} expects {self.type.__name__}, got {type(value).__name__}")
+        return value
+
+
+VARIABLES = {v.name: v for v in [
+    Variable('sender', str, "Sender address"),
+    Variable('subject', str, "Email subject"),
+    Variable('timestamp', str, "When the email was received (ISO 8601)"),
+    Variable('category', str, "Category assigned during processing"),
+    Variable('body_truncated', str, "Email body, truncated to fit the token budget"),
+    Variable('today', date, "Today's date"),
+    # Filled in by LLMService when it wraps a user prompt; not for user prompts
+    Variable('instructions', str, "The user-editable prompt", user_facing=False),
+    Variable('additional_instructions', str, "Extra instructions for a draft", user_facing=False),
+]}
+
+
+class PromptTemplate:
+    """A prompt parsed once into literal and placeholder segments.
+
+    Rendering is a single join over the segments, with no re-parsing, and the
+    token cost of the literal text is known up front.
+    """
+
+    def __init__(self, text, strict=False):
+        self.text = text
+        self.segments = []
+        self.variables = set()
+
+        literal = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+
+            token = match.group(0)
+            if token in ('{{', '}}'):
+                literal.append(token[0])
+                continue
+
+            name = match.group(1)
+            if name not in VARIABLES:
+                if strict:
+                    raise TemplateError(
+                        f"Unknown variable {{{name}}}. Available: "
+                        + ", ".join(f"{{{v}}}" for v, spec in VARIABLES.items() if spec.user_facing)
+                    )
+                # Unknown placeholders in prompts saved before templating are kept verbatim
+                literal.append(token)
+                continue
+
+            self.segments.append(''.join(literal))
+            literal = []
+            self.segments.append(VARIABLES[name])
+            self.variables.add(name)
+
+        literal.append(text[position:])
+        self.segments.append(''.join(literal))
+
+        self.static_tokens = estimate_tokens(''.join(s for s in self.segments if isinstance(s, str)))
+
+    def count(self, name):
+        return sum(1 for s in self.segments if isinstance(s, Variable) and s.name == name)
+
+    def render(self, values):
+        return ''.join(
+            segment if isinstance(segment, str) else segment.format(values.get(segment.name))
+            for segment in self.segments
+        )
+
+
+class TemplateEngine:
+    """Compiles prompt templates once and renders them within a token budget.
+
+    ``token_budget`` is the number of input tokens a rendered prompt may use
+    (env ``PROMPT_TOKEN_BUDGET``). The email body is the only variable that is
+    shrunk to fit; if the fixed parts alone are over budget the template is
+    rejected.
+    """
+
+    def __init__(self, token_budget=None, cache_size=256):
+        self.token_budget = token_budget or int(os.getenv('PROMPT_TOKEN_BUDGET', '8000'))
+        self.cache_size = cache_size
+        self._cache = {}
+        # Renders run on the _map worker threads, so evictions must not interleave
+        self._lock = threading.Lock()
+
+    def compile(self, text, strict=False):
+        key = (text, strict)
+        with self._lock:
+            template = self._cache.get(key)
+        if template is None:
+            # Compiled outside the lock; a race only compiles the same text twice
+            template = PromptTemplate(text, strict=strict)
+            with self._lock:
+                if key not in self._cache and len(self._cache) >= self.cache_size:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = template
+        return template
+
+    def validate(self, text, wrapper=None):
+        """Check a user-editable prompt: known variables only, and fits the budget."""
+        template = self.compile(text, strict=True)
+        for name in template.variables:
+            if not VARIABLES[name].user_facing:
+                raise TemplateError(f"Variable {{{name}}} cannot be used in a prompt")
+
+        fixed = template.static_tokens + (self.compile(wrapper).static_tokens if wrapper else 0)
+        if fixed > self.token_budget:
+            raise TemplateError(
+                f"Prompt uses about {fixed} tokens before any email content; the budget is {self.token_budget}"
+            )
+        return template
+
+    def email_variables(self, email=None, body=''):
+        email = email or {}
+        return {
+            'sender': email.get('sender'),
+            'subject': email.get('subject'),
+            'timestamp': email.get('timestamp'),
+            'category': email.get('category'),
+            'body_truncated': body if body is not None else email.get('body', ''),
+            'today': date.today(),
+        }
+
+    def render(self, wrapper_text, instructions_text, values):
+        """Render a user prompt inside a built-in wrapper, truncating the body to fit.
+
+        Returns (prompt, estimated_tokens, truncated).
+        """
+        wrapper = self.compile(wrapper_text)
+        instructions = self.compile(instructions_text)
+
+        values = dict(values)
+        body = values.get('body_truncated') or ''
+        values['body_truncated'] = ''
+
+        # Everything except the body is fixed; the body gets what remains
+        values['instructions'] = instructions.render(values)
+        fixed_tokens = estimate_tokens(wrapper.render(values))
+        body_slots = wrapper.count('body_truncated') + instructions.count('body_truncated') * wrapper.count('instructions')
+        remaining = self.token_budget - fixed_tokens
+        if remaining < 0:
+            raise TemplateError(f"Prompt needs about {fixed_tokens} tokens before the email body; the budget is {self.token_budget}")
+
+        truncated = False
+        if body_slots and estimate_tokens(body) * body_slots > remaining:
+            body = self.truncate(body, remaining // body_slots)
+            truncated = True
+
+        values['body_truncated'] = body
+        values['instructions'] = instructions.render(values)
+        prompt = wrapper.render(values)
+        return prompt, estimate_tokens(prompt), truncated
+
+    def truncate(self, text, max_tokens):
+        max_chars = max(0, max_tokens * 4 - len(TRUNCATION_MARKER))
+        if len(text) <= max_chars:
+            return text
+        cut = text[:max_chars]
+        # Prefer ending on a word boundary
+        if ' ' in cut[-40:]:
+            cut = cut.rsplit(' ', 1)[0]
+        return cut + TRUNCATION_MARKER
+
+
+if __name__ == '__main__':
+    import time
+
+    engine = TemplateEngine()
+    user_prompt = ("Categorize emails from {sender} about \"{subject}\" into: Important, Newsletter, "
+                   "Spam, To-Do. Today is {today}. Example output: {\"category\": \"To-Do\"}")
+    wrapper = "{instructions}\n\nEmail content:\n{body_truncated}\n\nRespond with only the category name."
+    values = engine.email_variables(
+        {'sender': 'john.doe@company.com', 'subject': 'Q4 Project Meeting - Urgent'},
+        body="Hi team, we need to schedule our Q4 planning meeting ASAP. " * 20
+    )
+
+    prompt, tokens, truncated = engine.render(wrapper, user_prompt, values)
+    print(prompt[:300])
+    print(f"\nEstimated tokens: {tokens}, truncated: {truncated}")
+
+    n = 20000
+    start = time.perf_counter()
+    for _ in range(n):
+        engine.render(wrapper, user_prompt, values)
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n):
+        PromptTemplate(wrapper).render(dict(values, instructions=PromptTemplate(user_prompt).render(values)))
+    uncached = time.perf_counter() - start
+
+    print(f"Render throughput (compiled, cached):  {n / compiled:,.0f} prompts/s")
+    print(f"Render throughput (re-parsed per call): {n / uncached:,.0f} prompts/s")
@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+
+
+# Bucket row holding the time until which every request waits (set after a 429)
+PAUSE_ROW = 'paused_until'
+
+
+class RateLimiter:
+    """Client-side token buckets for requests, input tokens and output tokens per minute.
+
+    Each bucket holds up to one minute's allowance and refills continuously.
+    ``acquire`` blocks until a request's estimated usage fits in every
+    bucket, and ``settle`` corrects the buckets once the real usage is known.
+    With a ``database`` the buckets live in the ``rate_limit_buckets`` table
+    and every process using that file shares them; otherwise they are
+    process-wide. Limits of 0 are not enforced, but a ``pause`` after a 429
+    holds requests back even when no limit is set.
+    """
+
+    def __init__(self, rpm=0, input_tpm=0, output_tpm=0, database=None):
+        limits = {'requests': rpm, 'input_tokens': input_tpm, 'output_tokens': output_tpm}
+        self.limits = {name: float(limit) for name, limit in limits.items() if limit}
+        self.database = database
+        self._lock = threading.Lock()
+        self._state = {}
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, database=None):
+        shared = os.getenv('LLM_RATE_LIMIT_SHARED', '0') == '1'
+        return cls(
+            rpm=int(os.getenv('LLM_RPM_LIMIT', '0')),
+            input_tpm=int(os.getenv('LLM_INPUT_TPM_LIMIT', '0')),
+            output_tpm=int(os.getenv('LLM_OUTPUT_TPM_LIMIT', '0')),
+            database=database if shared else None,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.limits)
+
+    def acquire(self, input_tokens, output_tokens):
+        """Wait until the request fits within every limit and any pause is over; returns what was taken."""
+        # A request larger than a whole minute's allowance would never fit otherwise
+        wanted = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        taken = {name: min(wanted[name], limit) for name, limit in self.limits.items()}
+
+        waited = 0.0
+        while True:
+            wait = self._update(lambda state, now: self._take(state, now, taken))
+            if wait <= 0:
+                break
+            pause = min(wait, 1.0)
+            time.sleep(pause)
+            waited += pause
+
+        if waited:
+            with self._lock:
+                self.throttled += 1
+                self.throttled_seconds += waited
+        return taken
+
+    def settle(self, taken, input_tokens, output_tokens):
+        """Charge (or refund) the difference between the estimate and the real usage."""
+        if not taken:
+            return
+        actual = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        difference = {name: taken[name] - actual[name] for name in taken if actual[name] is not None}
+
+        def apply(state, now):
+            for name, amount in difference.items():
+                tokens, updated_at = self._refilled(state, name, now)
+                # May go negative: an underestimate is paid back before the next request
+                state[name] = (min(self.limits[name], tokens + amount), updated_at)
+            return 0.0
+
+        self._update(apply)
+
+    def pause(self, seconds):
+        """Hold every request for ``seconds``, e.g. after the provider answers 429."""
+        def apply(state, now):
+            until = max(state.get(PAUSE_ROW, (0.0, 0.0))[1], now + seconds)
+            state[PAUSE_ROW] = (0.0, until)
+            return 0.0
+
+        self._update(apply)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limits_per_minute': dict(self.limits),
+                'shared': self.database is not None,
+                'throttled_requests': self.throttled,
+                'throttled_seconds': round(self.throttled_seconds, 2),
+            }
+
+    # Bucket arithmetic
+
+    def _refilled(self, state, name, now):
+        limit = self.limits[name]
+        tokens, updated_at = state.get(name, (limit, now))
+        return min(limit, tokens + (now - updated_at) * limit / 60.0), now
+
+    def _take(self, state, now, taken):
+        paused_until = state.get(PAUSE_ROW, (0.0, 0.0))[1]
+        if paused_until > now:
+            return paused_until - now
+
+        levels = {name: self._refilled(state, name, now) for name in self.limits}
+        wait = max(
+            ((taken[name] - tokens) * 60.0 / self.limits[name] for name, (tokens, _) in levels.items()),
+            default=0.0
+        )
+        if wait > 0:
+            return wait
+
+        for name, (tokens, updated_at) in levels.items():
+            state[name] = (tokens - taken[name], updated_at)
+        return 0.0
+
+    # Storage
+
+    def _update(self, fn):
+        """Run ``fn(state, now)`` atomically against the buckets and return its result."""
+        now = time.time()
+        if self.database is None:
+            with self._lock:
+                return fn(self._state, now)
+
+        conn = self.database.get_connection()
+        try:
+            # Take the write lock up front so concurrent processes see each other's updates
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT name, tokens, updated_at FROM rate_limit_buckets').fetchall()
+            state = {row['name']: (row['tokens'], row['updated_at']) for row in rows}
+            result = fn(state, now)
+            conn.executemany(
+                '''INSERT INTO rate_limit_buckets (name, tokens, updated_at) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at''',
+                [(name, tokens, updated_at) for name, (tokens, updated_at) in state.items()]
+            )
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
@@ -0,0 +1,166 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('RECORD_CACHE_SIZE', '5000'))
+# How often lookups compare the table change counters; hits in between cost no query
+DEFAULT_CHECK_INTERVAL_MS = float(os.getenv('RECORD_CACHE_CHECK_MS', '250'))
+CACHED_TABLES = ('emails', 'drafts')
+
+
+class RecordCache:
+    """Bounded LRU cache of email and draft rows, read through by EmailService.
+
+    Entries are plain row dicts keyed by ``(table, id)``; callers build their
+    own parsed copies, so nothing handed out can alter a cached row. Writes
+    made in this process go through ``track``/``run_write``: they evict the
+    ids they change and record the range of the table's change counter they
+    produced. Every other write - worker processes, the importer's inserts -
+    is caught by the ``table_versions`` counters that triggers bump on each
+    change. At most every ``check_interval_ms`` a lookup compares them with
+    the versions its entries were read at. A counter that moved only through
+    this process's own writes is simply followed; any other movement drops
+    that table's entries. The check is one small query on a connection the
+    cache keeps open, so writes from elsewhere are seen within one interval.
+    """
+
+    def __init__(self, database, max_entries=None, check_interval_ms=None):
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self.check_interval = (DEFAULT_CHECK_INTERVAL_MS if check_interval_ms is None else check_interval_ms) / 1000
+        self._conn = sqlite3.connect(database.db_path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._checked_at = 0.0
+        # Counter ranges {before: after} of committed writes made by this process, per table
+        self._own_writes = {table: {} for table in CACHED_TABLES}
+        # Bumped whenever a table's entries may have gone stale, so a slow load can't store old rows
+        self._generations = {table: 0 for table in CACHED_TABLES}
+        self._stats = {table: {'hits': 0, 'misses': 0} for table in CACHED_TABLES}
+        self._evictions = 0
+        self._resets = 0
+
+    def read_through(self, table, ids, load):
+        """Rows of ``table`` for ``ids`` as {id: row}, calling ``load(missing_ids)`` once for any misses.
+
+        ``load`` returns {id: row dict}; ids it doesn't return are not cached.
+        """
+        found, missing = {}, []
+        with self._lock:
+            self._check_versions()
+            for record_id in dict.fromkeys(ids):
+                row = self._entries.get((table, record_id))
+                if row is None:
+                    missing.append(record_id)
+                else:
+                    self._entries.move_to_end((table, record_id))
+                    found[record_id] = row
+            self._stats[table]['hits'] += len(found)
+            self._stats[table]['misses'] += len(missing)
+            generation = self._generations[table]
+
+        if missing:
+            loaded = load(missing)
+            with self._lock:
+                # A write or version check since the lookup means these rows may predate it
+                if self._generations[table] == generation:
+                    for record_id, row in loaded.items():
+                        self._entries[(table, record_id)] = row
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+            found.update(loaded)
+        return found
+
+    def _check_versions(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        versions = dict(self._conn.execute('SELECT name, version FROM table_versions').fetchall())
+        for table in CACHED_TABLES:
+            own, current = self._own_writes[table], versions.get(table)
+            if table in self._versions:
+                # Our own writes already evicted what they changed; follow the counter through them
+                version = self._versions[table]
+                while version != current and version in own:
+                    version = own.pop(version)
+                if version != current:
+                    self._drop_table(table)
+                    self._resets += 1
+            # Anything left was committed before the counters we just read
+            own.clear()
+        self._versions = versions
+
+    def _drop_table(self, table):
+        for key in [key for key in self._entries if key[0] == table]:
+            del self._entries[key]
+        self._generations[table] += 1
+
+    def track(self, table, ids, operation):
+        """Wrap a write of rows ``ids`` of ``table`` so it doesn't look like a write from elsewhere.
+
+        Returns ``(wrapped, committed)``. Run ``wrapped(conn)`` inside the
+        write's transaction: it takes the write lock with a no-op update, so
+        the counter readings around ``operation`` cover only this write. Call
+        ``committed()`` once the transaction has committed.
+        """
+        span = {}
+
+        def wrapped(conn):
+            conn.execute('UPDATE table_versions SET version = version WHERE name = ?', (table,))
+            span['before'] = self._read_version(conn, table)
+            result = operation(conn)
+            span['after'] = self._read_version(conn, table)
+            return result
+
+        def committed():
+            with self._lock:
+                for record_id in ids:
+                    self._entries.pop((table, record_id), None)
+                self._generations[table] += 1
+                if span.get('after') not in (None, span.get('before')):
+                    self._own_writes[table][span['before']] = span['after']
+
+        return wrapped, committed
+
+    def run_write(self, database, table, ids, operation):
+        """Run ``operation(conn)`` as a tracked write in a transaction of its own; returns its result."""
+        wrapped, committed = self.track(table, ids, operation)
+        with database.transaction() as conn:
+            result = wrapped(conn)
+        committed()
+        return result
+
+    def _read_version(self, conn, table):
+        row = conn.execute('SELECT version FROM table_versions WHERE name = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    def invalidate(self, table, record_id):
+        with self._lock:
+            self._entries.pop((table, record_id), None)
+            self._generations[table] += 1
+
+    def clear(self, table=None):
+        with self._lock:
+            for name in ([table] if table else CACHED_TABLES):
+                self._drop_table(name)
+
+    def stats(self):
+        with self._lock:
+            tables = {}
+            for table, counts in self._stats.items():
+                lookups = counts['hits'] + counts['misses']
+                tables[table] = dict(counts, hit_rate=round(counts['hits'] / lookups, 4) if lookups else 0.0)
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'check_interval_ms': round(self.check_interval * 1000, 2),
+                'evictions': self._evictions,
+                'resets': self._resets,
+                'tables': tables,
+            }
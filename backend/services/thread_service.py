@@ -0,0 +1,176 @@
+import os
+import re
+import json
+from datetime import datetime, timedelta
+
+
+# Reply/forward prefixes and list tags that don't change what a thread is about
+SUBJECT_PREFIX_PATTERN = re.compile(r'^\s*(?:(?:re|fw|fwd|aw|sv|tr)\s*(?:\[\d+\])?\s*:|\[[^\]]{1,40}\])\s*', re.IGNORECASE)
+REPLY_PREFIX_PATTERN = re.compile(r'^\s*(?:re|fw|fwd|aw|sv|tr)\s*(?:\[\d+\])?\s*:', re.IGNORECASE)
+MESSAGE_ID_PATTERN = re.compile(r'<[^<>\s]+>')
+
+# Without headers, a message joins a thread with the same subject only within this window
+SUBJECT_MATCH_WINDOW = timedelta(days=int(os.getenv('THREAD_SUBJECT_WINDOW_DAYS', '14')))
+# Normalized subjects shorter than this ("hi", "fyi") are too generic to group on
+MIN_SUBJECT_LENGTH = 4
+
+
+def normalize_subject(subject):
+    """Subject without reply/forward prefixes or list tags, lowercased and single-spaced."""
+    subject = subject or ''
+    while True:
+        stripped = SUBJECT_PREFIX_PATTERN.sub('', subject, count=1)
+        if stripped == subject:
+            break
+        subject = stripped
+    return ' '.join(subject.split()).lower()
+
+
+def parse_message_ids(value):
+    """Message-IDs in a header value; bare ids without angle brackets are accepted too."""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        value = ' '.join(value)
+    ids = MESSAGE_ID_PATTERN.findall(value)
+    return ids or [part for part in value.split() if part]
+
+
+class ThreadService:
+    """Groups emails into conversation threads at ingest.
+
+    A message joins the thread of the message its ``In-Reply-To`` or
+    ``References`` header points at. Without a known parent it falls back to
+    the most recent thread with the same normalized subject, within
+    ``SUBJECT_MATCH_WINDOW``, provided the subject carries a reply/forward
+    prefix or the sender already took part in that thread. Each thread keeps
+    a running summary so later processing only has to read new messages.
+    """
+
+    def __init__(self, database, cache=None):
+        self.db = database
+        # With a RecordCache, thread assignment evicts only the emails it updates
+        self.cache = cache
+
+    def assign(self, emails):
+        """Attach each of ``emails`` (dicts with an ``id``) to a thread; returns {email_id: thread_id}.
+
+        Emails that already belong to a thread, e.g. ones whose content changed
+        on a reload, leave it first and are matched again from their new headers.
+        """
+        def run(conn):
+            assigned = {}
+            for email in sorted(emails, key=lambda e: (e.get('timestamp') or '', e['id'])):
+                self._detach(conn, email['id'])
+                thread_id = self._find_by_headers(conn, email) or self._find_by_subject(conn, email)
+                if thread_id is None:
+                    thread_id = conn.execute(
+                        '''INSERT INTO threads (subject, participants, first_timestamp, last_timestamp)
+                           VALUES (?, '[]', ?, ?)''',
+                        (normalize_subject(email['subject']), email.get('timestamp'), email.get('timestamp'))
+                    ).lastrowid
+                self._add_message(conn, thread_id, email)
+                assigned[email['id']] = thread_id
+            return assigned
+
+        # One transaction for the whole batch: later emails see the threads earlier ones created
+        if self.cache is not None:
+            return self.cache.run_write(self.db, 'emails', [email['id'] for email in emails], run)
+        with self.db.transaction() as conn:
+            return run(conn)
+
+    def assign_missing(self):
+        """Thread emails stored without one, e.g. before threading existed; returns how many."""
+        rows = self.db.execute_query(
+            '''SELECT id, sender, subject, timestamp, message_id, in_reply_to, reference_ids
+               FROM emails WHERE thread_id IS NULL'''
+        )
+        return len(self.assign([self.db.row_to_dict(row) for row in rows]))
+
+    def _find_by_headers(self, conn, email):
+        # Closest ancestor first: In-Reply-To, then References from the end
+        parents = parse_message_ids(email.get('in_reply_to')) + parse_message_ids(email.get('reference_ids'))[::-1]
+        for message_id in parents:
+            row = conn.execute(
+                'SELECT thread_id FROM emails WHERE message_id = ? AND thread_id IS NOT NULL LIMIT 1',
+                (message_id,)
+            ).fetchone()
+            if row:
+                return row['thread_id']
+        return None
+
+    def _find_by_subject(self, conn, email):
+        subject = normalize_subject(email['subject'])
+        if len(subject) < MIN_SUBJECT_LENGTH:
+            return None
+
+        timestamp = self._parse_timestamp(email.get('timestamp'))
+        rows = conn.execute(
+            'SELECT id, participants, last_timestamp FROM threads WHERE subject = ? ORDER BY last_timestamp DESC LIMIT 5',
+            (subject,)
+        ).fetchall()
+        is_reply = bool(REPLY_PREFIX_PATTERN.match(email['subject'] or ''))
+        sender = (email.get('sender') or '').lower()
+        for row in rows:
+            last = self._parse_timestamp(row['last_timestamp'])
+            if timestamp and last and abs(timestamp - last) > SUBJECT_MATCH_WINDOW:
+                continue
+            if is_reply or sender in json.loads(row['participants']):
+                return row['id']
+        return None
+
+    def _detach(self, conn, email_id):
+        row = conn.execute('SELECT thread_id FROM emails WHERE id = ?', (email_id,)).fetchone()
+        if row is None or row['thread_id'] is None:
+            return
+        conn.execute('UPDATE threads SET message_count = message_count - 1 WHERE id = ?', (row['thread_id'],))
+        conn.execute('UPDATE emails SET thread_id = NULL WHERE id = ?', (email_id,))
+
+    def _add_message(self, conn, thread_id, email):
+        row = conn.execute('SELECT participants FROM threads WHERE id = ?', (thread_id,)).fetchone()
+        participants = json.loads(row['participants'])
+        sender = (email.get('sender') or '').lower()
+        if sender and sender not in participants:
+            participants.append(sender)
+
+        conn.execute('UPDATE emails SET thread_id = ? WHERE id = ?', (thread_id, email['id']))
+        conn.execute(
+            '''UPDATE threads SET participants = ?, message_count = message_count + 1,
+               first_timestamp = MIN(COALESCE(first_timestamp, ?), ?),
+               last_timestamp = MAX(COALESCE(last_timestamp, ?), ?),
+               updated_at = CURRENT_TIMESTAMP
+               WHERE id = ?''',
+            (json.dumps(participants), email.get('timestamp'), email.get('timestamp'),
+             email.get('timestamp'), email.get('timestamp'), thread_id)
+        )
+
+    def _parse_timestamp(self, value):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+        except (AttributeError, ValueError):
+            return None
+
+    # Reads and results
+
+    def get_thread(self, thread_id):
+        rows = self.db.execute_query('SELECT * FROM threads WHERE id = ?', (thread_id,))
+        if not rows:
+            return None
+        thread = self.db.row_to_dict(rows[0])
+        thread['participants'] = json.loads(thread['participants'])
+        return thread
+
+    def get_threads(self, limit=50):
+        rows = self.db.execute_query('SELECT id FROM threads ORDER BY last_timestamp DESC LIMIT ?', (limit,))
+        return [self.get_thread(row['id']) for row in rows]
+
+    def save_summary(self, thread_id, summary, summary_through, category, prompt_version):
+        """Record the thread's running summary, covering messages up to ``summary_through``."""
+        self.db.execute_query(
+            '''UPDATE threads SET summary = ?, summary_through = ?, category = ?, prompt_version = ?,
+               updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
+            (summary, summary_through, category, prompt_version, thread_id)
+        )
+
+    def clear(self):
+        self.db.execute_query('DELETE FROM threads')
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import random
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Spans recorded for the request currently being handled (None outside a request)
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans = defaultdict(lambda: {'dur': 0.0, 'count': 0})
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def add(self, name, duration_ms):
+        # Spans can be recorded from worker threads running in a copied context
+        with self._lock:
+            span = self.spans[name]
+            span['dur'] += duration_ms
+            span['count'] += 1
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def breakdown(self):
+        total = self.elapsed_ms()
+        spans = {name: dict(span) for name, span in self.spans.items()}
+        accounted = sum(span['dur'] for span in spans.values())
+        # Whatever is not covered by a span is plain Python / Flask overhead
+        spans['app'] = {'dur': max(total - accounted, 0.0), 'count': 1}
+        return total, spans
+
+
+@contextmanager
+def trace_span(name):
+    """Time a block of work against the current request's trace, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, (time.perf_counter() - start) * 1000)
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into folded stacks.
+
+    The output is the "folded" format understood by flamegraph.pl and
+    speedscope: one line per unique stack, frames joined by ';', followed
+    by the number of samples.
+    """
+
+    def __init__(self, thread_id, interval_ms=5):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items()))
+
+
+class TracingService:
+    """Request-scoped span timing, slow-request logging and sampled profiling.
+
+    Configured through environment variables:
+        SLOW_REQUEST_MS      log requests slower than this (default 1000)
+        PROFILE_SAMPLE_RATE  fraction of requests to profile, 0-1 (default 0)
+        PROFILE_INTERVAL_MS  stack sampling interval (default 5)
+        PROFILE_DIR          where folded stacks are written (default data/profiles)
+        TRACE_PROFILE_HEADER set to 1 to let a request ask for profiling with an
+                             ``X-Profile: 1`` header (default off)
+    """
+
+    def __init__(self, app=None):
+        self.slow_request_ms = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+        self.profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.profile_interval_ms = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+        self.profile_dir = os.getenv('PROFILE_DIR', os.path.join('data', 'profiles'))
+        self.profile_header = os.getenv('TRACE_PROFILE_HEADER', '0') == '1'
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from flask import request, g
+
+        @app.before_request
+        def _start_trace():
+            trace = RequestTrace(request.method, request.path)
+            g.trace_token = _current_trace.set(trace)
+            g.trace = trace
+
+            if self._should_profile(request):
+                trace.profiler = StackSampler(threading.get_ident(), self.profile_interval_ms)
+                trace.profiler.start()
+
+        @app.after_request
+        def _finish_trace(response):
+            trace = g.pop('trace', None)
+            if trace is None:
+                return response
+
+            total, spans = trace.breakdown()
+            response.headers['Server-Timing'] = self._server_timing(total, spans)
+
+            if trace.profiler:
+                trace.profiler.stop()
+                self._write_profile(trace)
+
+            if total >= self.slow_request_ms:
+                self._log_slow_request(trace, total, spans)
+
+            return response
+
+        @app.teardown_request
+        def _reset_trace(exc):
+            token = g.pop('trace_token', None)
+            if token is not None:
+                _current_trace.reset(token)
+
+            # after_request is skipped on unhandled errors, so stop the sampler here too
+            trace = g.pop('trace', None)
+            if trace and trace.profiler:
+                trace.profiler.stop()
+
+    def _should_profile(self, request):
+        if self.profile_header and request.headers.get('X-Profile') == '1':
+            return True
+        return self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+
+    def _server_timing(self, total, spans):
+        entries = [
+            f'{name};dur={span["dur"]:.1f};desc="{span["count"]} call(s)"'
+            for name, span in spans.items()
+        ]
+        entries.append(f'total;dur={total:.1f}')
+        return ', '.join(entries)
+
+    def _log_slow_request(self, trace, total, spans):
+        parts = ", ".join(
+            f"{name}={span['dur']:.1f}ms/{span['count']}"
+            for name, span in sorted(spans.items(), key=lambda item: -item[1]['dur'])
+        )
+        print(f"SLOW REQUEST {trace.method} {trace.path} took {total:.1f}ms ({parts})")
+
+    def _write_profile(self, trace):
+        if not trace.profiler.samples:
+            return
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        endpoint = trace.path.strip('/').replace('/', '_') or 'root'
+        filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{trace.method}_{endpoint}.folded"
+        path = os.path.join(self.profile_dir, filename)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(trace.profiler.folded() + "\n")
+
+        print(f"Wrote profile for {trace.method} {trace.path} to {path}")
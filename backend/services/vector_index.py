@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import math
+import zlib
+import threading
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9'@.\-]*[a-z0-9]|[a-z0-9]")
+
+STOPWORDS = {
+    'the', 'a', 'an', 'and', 'or', 'to', 'of', 'in', 'on', 'for', 'is', 'are', 'be',
+    'it', 'this', 'that', 'with', 'as', 'at', 'by', 'from', 'we', 'you', 'your', 'our',
+    'i', 'me', 'my', 'will', 'can', 'please', 'have', 'has', 'was', 'do', 'what', 'any',
+}
+
+
+class VectorIndex:
+    """Model-free semantic index over emails using hashed TF-IDF vectors.
+
+    Each email is tokenised and hashed into a fixed number of signed buckets
+    (the "hashing trick"), so no vocabulary has to be stored or rebuilt. Raw
+    log-TF vectors live in a float32 memory-mapped matrix on disk; IDF weights
+    are applied at query time from per-bucket document frequencies, so adding
+    an email never requires re-encoding the others.
+
+    Files in ``index_dir``:
+        vectors.f32   (capacity x dim) float32 term-frequency matrix
+        ids.i64       (capacity,) email id for each row, -1 for a free row
+        df.npy        document frequency per bucket
+        meta.json     dim, capacity and row count
+    """
+
+    def __init__(self, index_dir=None, dim=1024, initial_capacity=1024):
+        self.index_dir = index_dir or os.path.join('data', 'vector_index')
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self._lock = threading.Lock()
+        self._norms = None
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._load()
+
+    # Storage
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        meta_path = self._path('meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('dim') == self.dim:
+                self.capacity = meta['capacity']
+                self.count = meta['count']
+                self.vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r+',
+                                         shape=(self.capacity, self.dim))
+                self.ids = np.memmap(self._path('ids.i64'), dtype=np.int64, mode='r+',
+                                     shape=(self.capacity,))
+                self.df = np.load(self._path('df.npy'))
+                self.row_for_id = {int(eid): row for row, eid in enumerate(self.ids[:self.count]) if eid >= 0}
+                return
+            print(f"Vector index dimension changed ({meta.get('dim')} -> {self.dim}), rebuilding")
+
+        self._create(self.initial_capacity)
+
+    def _create(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='w+',
+                                 shape=(capacity, self.dim))
+        self.ids = np.memmap(self._path('ids.i64'), dtype=np.int64, mode='w+', shape=(capacity,))
+        self.ids[:] = -1
+        self.df = np.zeros(self.dim, dtype=np.float32)
+        self.row_for_id = {}
+        self._norms = None
+        self._save_meta()
+
+    def _grow(self, needed):
+        new_capacity = self.capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        vectors = np.array(self.vectors[:self.count])
+        ids = np.array(self.ids[:self.count])
+        del self.vectors, self.ids
+
+        self.vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='w+',
+                                 shape=(new_capacity, self.dim))
+        self.ids = np.memmap(self._path('ids.i64'), dtype=np.int64, mode='w+', shape=(new_capacity,))
+        self.vectors[:self.count] = vectors
+        self.ids[:] = -1
+        self.ids[:self.count] = ids
+        self.capacity = new_capacity
+
+    def _save_meta(self):
+        self.vectors.flush()
+        self.ids.flush()
+        np.save(self._path('df.npy'), self.df)
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'capacity': self.capacity, 'count': self.count}, f)
+
+    # Encoding
+
+    def tokenize(self, text):
+        return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        counts = {}
+        for token in self.tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+
+        for token, count in counts.items():
+            h = zlib.crc32(token.encode('utf-8'))
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            vector[h % self.dim] += sign * (1.0 + math.log(count))
+
+        return vector
+
+    def email_text(self, email):
+        # Subject is repeated so it outweighs an equally long stretch of body
+        return f"{email['sender']} {email['subject']} {email['subject']} {email['body']}"
+
+    def _idf(self):
+        return np.log((1.0 + self.count) / (1.0 + self.df)).astype(np.float32) + 1.0
+
+    # Updates
+
+    def add(self, email_id, text):
+        self.add_many([(email_id, text)])
+
+    def add_many(self, items):
+        if not items:
+            return
+
+        with self._lock:
+            for email_id, text in items:
+                vector = self.embed(text)
+                row = self.row_for_id.get(email_id)
+
+                if row is None:
+                    if self.count >= self.capacity:
+                        self._grow(self.count + 1)
+                    row = self.count
+                    self.count += 1
+                    self.row_for_id[email_id] = row
+                else:
+                    self.df -= (self.vectors[row] != 0)
+
+                self.vectors[row] = vector
+                self.ids[row] = email_id
+                self.df += (vector != 0)
+
+            self._norms = None
+            self._save_meta()
+
+    def add_emails(self, emails):
+        self.add_many([(email['id'], self.email_text(email)) for email in emails])
+
+    def remove(self, email_id):
+        with self._lock:
+            row = self.row_for_id.pop(email_id, None)
+            if row is None:
+                return
+            self.df -= (self.vectors[row] != 0)
+            self.vectors[row] = 0
+            self.ids[row] = -1
+            self._norms = None
+            self._save_meta()
+
+    def clear(self):
+        with self._lock:
+            del self.vectors, self.ids
+            self._create(self.initial_capacity)
+
+    def sync(self, emails):
+        """Index any emails that are not in the index yet; returns how many were added."""
+        missing = [email for email in emails if email['id'] not in self.row_for_id]
+        self.add_emails(missing)
+        return len(missing)
+
+    def __contains__(self, email_id):
+        return email_id in self.row_for_id
+
+    def __len__(self):
+        return len(self.row_for_id)
+
+    # Search
+
+    def search(self, query, k=10):
+        """Return [(email_id, score)] for the k emails most similar to ``query``."""
+        query_vector = self.embed(query)
+        if not self.count or not query_vector.any():
+            return []
+
+        with self._lock:
+            idf = self._idf()
+            matrix = self.vectors[:self.count]
+
+            if self._norms is None:
+                # ||D * idf|| per row without materialising the weighted matrix
+                self._norms = np.sqrt(np.einsum('ij,ij,j->i', matrix, matrix, idf * idf))
+
+            weighted_query = query_vector * idf
+            scores = matrix @ (weighted_query * idf)
+            scores /= (self._norms * np.linalg.norm(weighted_query)) + 1e-9
+            scores[np.asarray(self.ids[:self.count]) < 0] = -1.0
+
+            k = min(k, self.count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [(int(self.ids[row]), float(scores[row])) for row in top if scores[row] > 0]
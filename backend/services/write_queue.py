@@ -0,0 +1,152 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from concurrent.futures import Future
+
+
+# Writes per transaction, and how long the writer waits for more after the first one
+DEFAULT_MAX_BATCH = int(os.getenv('DB_WRITE_BATCH', '200'))
+DEFAULT_MAX_DELAY_MS = float(os.getenv('DB_WRITE_DELAY_MS', '2'))
+
+# When set to a list, every ticket submitted in this context is appended to it,
+# so a caller can wait until all the writes of a unit of work are durable
+write_tickets = contextvars.ContextVar('write_tickets', default=None)
+
+
+class WriteQueue:
+    """Group-commits writes from many threads on a single writer thread.
+
+    Producers hand in ``operation(conn)`` callables and get a ticket (a
+    Future) back immediately. The writer takes every waiting write, up to
+    ``max_batch``; if the previous group held more than one write, so other
+    producers are active, it also waits up to ``max_delay_ms`` for more to
+    arrive. A lone producer is never delayed. The group is applied in one
+    ``BEGIN IMMEDIATE`` transaction: one lock acquisition and one fsync however many workers
+    produced the writes. Each write runs in its own savepoint, so a failing
+    one is rolled back and reported on its ticket without taking the rest of
+    the group with it. Tickets resolve only after the commit, which makes
+    ``ticket.result()`` a durability acknowledgement. Writes are applied in
+    submission order. ``close()`` commits everything still queued.
+    """
+
+    def __init__(self, database, max_batch=None, max_delay_ms=None):
+        self.db = database
+        self.max_batch = max_batch or DEFAULT_MAX_BATCH
+        self.max_delay = (DEFAULT_MAX_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._closed = False
+        self._stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'transactions': 0,
+                       'grouped': 0, 'max_group': 0, 'commit_ms_total': 0.0}
+
+    def submit(self, operation):
+        """Queue ``operation(conn)``; returns a Future resolved with its result once committed."""
+        ticket = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write queue is closed")
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, daemon=True, name='db-writer')
+                self._writer.start()
+            self._stats['submitted'] += 1
+            self._queue.put((operation, ticket))
+        tickets = write_tickets.get()
+        if tickets is not None:
+            tickets.append(ticket)
+        return ticket
+
+    def flush(self, timeout=None):
+        """Block until every write submitted so far is committed."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=None):
+        """Commit the writes still queued and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            writer = self._writer
+        if writer is not None:
+            self._queue.put(None)
+            writer.join(timeout)
+
+    def _run(self):
+        previous_group = 1
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            group = [item]
+            deadline = time.monotonic() + (self.max_delay if previous_group > 1 else 0.0)
+            closing = False
+            while len(group) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                group.append(item)
+            self._commit(group)
+            previous_group = len(group)
+            if closing:
+                return
+
+    def _commit(self, group):
+        start = time.perf_counter()
+        outcomes = []
+        try:
+            with self.db.transaction() as conn:
+                # Take the write lock up front; upgrading a read transaction can fail without waiting
+                conn.execute('BEGIN IMMEDIATE')
+                for operation, ticket in group:
+                    conn.execute('SAVEPOINT queued_write')
+                    try:
+                        outcomes.append((ticket, operation(conn), None))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO queued_write')
+                        outcomes.append((ticket, None, e))
+                    conn.execute('RELEASE queued_write')
+        except Exception as e:
+            print(f"Group commit of {len(group)} write(s) failed: {e}")
+            for _, ticket in group:
+                ticket.set_exception(e)
+            with self._lock:
+                self._stats['failed'] += len(group)
+            return
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        failed = 0
+        for ticket, result, error in outcomes:
+            if error is None:
+                ticket.set_result(result)
+            else:
+                failed += 1
+                ticket.set_exception(error)
+        with self._lock:
+            self._stats['committed'] += len(group) - failed
+            self._stats['failed'] += failed
+            self._stats['transactions'] += 1
+            self._stats['grouped'] += len(group)
+            self._stats['max_group'] = max(self._stats['max_group'], len(group))
+            self._stats['commit_ms_total'] += elapsed_ms
+
+    def stats(self):
+        with self._lock:
+            transactions = self._stats['transactions']
+            return {
+                'max_batch': self.max_batch,
+                'max_delay_ms': round(self.max_delay * 1000, 2),
+                'pending': self._queue.qsize(),
+                'submitted': self._stats['submitted'],
+                'committed': self._stats['committed'],
+                'failed': self._stats['failed'],
+                'transactions': transactions,
+                'avg_group': round(self._stats['grouped'] / transactions, 2) if transactions else 0.0,
+                'max_group': self._stats['max_group'],
+                'avg_commit_ms': round(self._stats['commit_ms_total'] / transactions, 2) if transactions else 0.0,
+            }
@@ -0,0 +1,71 @@
+import gzip
+import importlib
+import json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # app.py opens data/ relative to the working directory; keep the tests off the real database
+    workdir = tmp_path_factory.mktemp('backend')
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(workdir)
+        patch.delenv('ANTHROPIC_API_KEY', raising=False)
+        patch.delenv('ANTHROPIC_BASE_URL', raising=False)
+        patch.delenv('IMAP_HOST', raising=False)
+        app_module = importlib.import_module('app')
+        app_module.db.initialize()
+        app_module.app.testing = True
+        client = app_module.app.test_client()
+        assert client.post('/api/emails/load').status_code == 200
+        yield client
+        app_module.write_queue.close()
+
+
+def revalidate(client, path):
+    first = client.get(path)
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    second = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    return first, second
+
+
+@pytest.mark.parametrize('path', ['/api/emails', '/api/drafts', '/api/prompts'])
+def test_unchanged_lists_answer_304(client, path):
+    first, second = revalidate(client, path)
+    assert second.status_code == 304
+    assert second.data == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_email_change_moves_the_etag(client):
+    first = client.get('/api/emails')
+    email_id = first.get_json()['emails'][0]['id']
+    client.post('/api/drafts', json={'email_id': email_id, 'subject': 'Re', 'body': 'Thanks'})
+    # Drafts changed, emails did not
+    assert client.get('/api/emails', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    drafts = client.get('/api/drafts')
+    client.post('/api/drafts', json={'email_id': email_id, 'subject': 'Re', 'body': 'Thanks again'})
+    after = client.get('/api/drafts', headers={'If-None-Match': drafts.headers['ETag']})
+    assert after.status_code == 200
+    assert len(after.get_json()['drafts']) == len(drafts.get_json()['drafts']) + 1
+
+
+def test_prompt_update_moves_the_etag(client):
+    first = client.get('/api/prompts')
+    prompts = first.get_json()
+    response = client.put('/api/prompts', json={'auto_reply': prompts['auto_reply'] + ' Sign off warmly.'})
+    assert response.status_code == 200
+    after = client.get('/api/prompts', headers={'If-None-Match': first.headers['ETag']})
+    assert after.status_code == 200
+    assert after.get_json()['auto_reply'].endswith('Sign off warmly.')
+
+
+def test_large_lists_are_compressed(client):
+    plain = client.get('/api/emails')
+    compressed = client.get('/api/emails', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert compressed.headers['ETag'] == plain.headers['ETag']
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
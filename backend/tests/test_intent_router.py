@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from services.intent_router import IntentRouter
+
+
+NOW = datetime(2024, 5, 15, 12, 0, 0)
+
+
+@pytest.fixture
+def router():
+    return IntentRouter()
+
+
+@pytest.mark.parametrize('query', [
+    "Any emails about the budget?",
+    "Which emails mention the offsite?",
+    "Find emails about the project launch",
+    "Show me messages about the Q3 report",
+    "What did the email from my boss say about the deadline?",
+    "How many emails regarding the merger?",
+])
+def test_topic_questions_go_to_the_llm(router, query):
+    intent = router.route(query, now=NOW)
+    assert intent.name == 'open_ended'
+    assert intent.slots.get('topic')
+
+
+def test_topic_keeps_other_slots(router):
+    intent = router.route("Any emails from alice about the budget?", now=NOW)
+    assert intent.name == 'open_ended'
+    assert intent.slots == {'sender': 'alice', 'topic': 'budget'}
+
+
+@pytest.mark.parametrize('query, name, slots', [
+    ("What are my urgent emails?", 'list_emails', {'category': 'Important'}),
+    ("Show emails from sarah", 'list_emails', {'sender': 'sarah'}),
+    ("List all my tasks", 'list_tasks', {}),
+    ("How many newsletters did I get this week?", 'count_emails',
+     {'category': 'Newsletter', 'since': '2024-05-13T00:00:00'}),
+    ("Any spam from the last 3 days?", 'list_emails', {'category': 'Spam', 'since': '2024-05-12T12:00:00'}),
+    ("What should I focus on first?", 'open_ended', {}),
+    ("What's in my inbox?", 'open_ended', {}),
+])
+def test_structured_queries(router, query, name, slots):
+    intent = router.route(query, now=NOW)
+    assert (intent.name, intent.slots) == (name, slots)
+
+
+def test_email_intents_need_a_selected_email(router):
+    assert router.route("Summarize this email", has_email=True).name == 'summarize_email'
+    assert router.route("Draft a reply about the meeting time", has_email=True).name == 'draft_reply'
+    assert router.route("Summarize this email", has_email=False).name != 'summarize_email'
+
+
+def test_what_is_this_about_has_no_topic(router):
+    assert 'topic' not in router.extract_slots("What is this email about?")
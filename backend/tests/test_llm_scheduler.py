@@ -0,0 +1,93 @@
+import threading
+import time
+
+from services.llm_scheduler import LLMScheduler
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def queue_waiters(scheduler, classes, order):
+    """Start one thread per class that records its grant and releases straight away."""
+    def call(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    threads = []
+    for priority in classes:
+        thread = threading.Thread(target=call, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        # Queue them in a known order
+        wait_until(lambda: sum(c['waiting'] for c in scheduler.stats()['classes'].values()) == len(threads))
+    return threads
+
+
+def test_reserved_slot_keeps_chat_responsive():
+    scheduler = LLMScheduler(max_in_flight=2, reserved_interactive=1)
+    bulk = scheduler.acquire('bulk')
+    order = []
+    threads = queue_waiters(scheduler, ['bulk'], order)
+    # The second bulk call may not take the reserved slot...
+    assert scheduler.stats()['classes']['bulk']['waiting'] == 1
+    # ...which an interactive call gets at once
+    interactive = scheduler.acquire('interactive')
+    scheduler.release(interactive)
+    scheduler.release(bulk)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['bulk']
+
+
+def test_background_waits_for_interactive():
+    scheduler = LLMScheduler(max_in_flight=4, reserved_interactive=0)
+    interactive = scheduler.acquire('interactive')
+    order = []
+    threads = queue_waiters(scheduler, ['background'], order)
+    time.sleep(0.05)
+    assert order == []
+    scheduler.release(interactive)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['background']
+
+
+def test_busy_classes_share_by_weight():
+    scheduler = LLMScheduler(max_in_flight=1, reserved_interactive=0)
+    holder = scheduler.acquire('bulk')
+    order = []
+    threads = queue_waiters(scheduler, ['bulk'] * 4 + ['priority'] * 4, order)
+    scheduler.release(holder)
+    for thread in threads:
+        thread.join(5)
+    # Weights 4:2, so priority calls get two of every three grants while both are waiting
+    assert order[:6].count('priority') == 4
+    assert sorted(order) == ['bulk'] * 4 + ['priority'] * 4
+
+
+def test_in_flight_never_exceeds_the_budget():
+    scheduler = LLMScheduler(max_in_flight=3, reserved_interactive=1)
+    lock = threading.Lock()
+    current = {'now': 0, 'peak': 0}
+
+    def call(priority):
+        with scheduler.slot(priority):
+            with lock:
+                current['now'] += 1
+                current['peak'] = max(current['peak'], current['now'])
+            time.sleep(0.002)
+            with lock:
+                current['now'] -= 1
+
+    threads = [threading.Thread(target=call, args=(priority,))
+               for priority in ['interactive', 'priority', 'bulk', 'background'] * 10]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert current['peak'] <= 3
+    assert sum(c['granted'] for c in scheduler.stats()['classes'].values()) == 40
@@ -0,0 +1,88 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from models.database import Database
+from services import mail_importer
+from services.mail_importer import MailImporter, parse_message
+
+
+def make_message(subject, body='Hello there', sender='alice@example.com', message_id=None, date=None):
+    headers = [f'From: {sender}', 'To: bob@example.com', f'Subject: {subject}']
+    if message_id:
+        headers.append(f'Message-ID: {message_id}')
+    if date:
+        headers.append(f'Date: {date}')
+    return ('\r\n'.join(headers) + '\r\n\r\n' + body + '\r\n').encode('utf-8')
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'email_agent.db'))
+    database.initialize()
+    return database
+
+
+def import_all(db, raws):
+    return MailImporter(db, workers=1, batch_size=2).import_messages(raws, progress=lambda stats: None)
+
+
+def email_count(db):
+    return db.execute_query('SELECT COUNT(*) AS n FROM emails WHERE deleted_at IS NULL')[0]['n']
+
+
+def test_reimport_skips_messages_already_stored(db):
+    raws = [make_message(f'Report {i}', message_id=f'<m{i}@example.com>', date='Mon, 6 May 2024 09:00:00 +0000')
+            for i in range(5)]
+    first = import_all(db, raws)
+    second = import_all(db, raws)
+    assert (first['imported'], first['duplicates']) == (5, 0)
+    assert (second['imported'], second['duplicates']) == (0, 5)
+    assert email_count(db) == 5
+
+
+def test_same_message_id_is_stored_once_within_a_run(db):
+    raws = [make_message('Original', message_id='<dup@example.com>'),
+            make_message('Resent copy', message_id='<dup@example.com>')]
+    stats = import_all(db, raws)
+    assert (stats['imported'], stats['duplicates']) == (1, 1)
+
+
+def test_messages_without_date_or_message_id_dedupe_across_runs(db):
+    raws = [make_message('No headers', body='Same body both times')]
+    import_all(db, raws)
+    stats = import_all(db, raws)
+    assert stats['duplicates'] == 1
+    assert email_count(db) == 1
+
+
+class TickingClock(datetime):
+    """utcnow() a minute later on every call, so each parse sees a different import time."""
+    calls = 0
+
+    @classmethod
+    def utcnow(cls):
+        cls.calls += 1
+        return datetime(2024, 5, 6, 9, cls.calls % 60)
+
+
+def test_content_hash_ignores_the_synthesized_timestamp(monkeypatch):
+    monkeypatch.setattr(mail_importer, 'datetime', TickingClock)
+    raw = make_message('No date')
+    first, second = parse_message(raw), parse_message(raw)
+    assert first['timestamp'] != second['timestamp']
+    assert first['content_hash'] == second['content_hash']
+    dated = parse_message(make_message('No date', date='Mon, 6 May 2024 09:00:00 +0000'))
+    assert dated['content_hash'] != first['content_hash']
+
+
+def test_concurrent_imports_store_each_message_once(db):
+    raws = [make_message(f'Note {i}', message_id=f'<n{i}@example.com>') for i in range(20)]
+    raws += [make_message(f'Undated {i}', body=f'body {i}') for i in range(10)]
+    threads = [threading.Thread(target=import_all, args=(db, raws)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert email_count(db) == 30
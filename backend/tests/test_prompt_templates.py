@@ -0,0 +1,34 @@
+import json
+
+from models.database import Database
+from services.prompt_service import PromptService
+from services.prompt_templates import PromptTemplate
+
+
+LEGACY_TEXT = 'Return JSON like {"items": [{"task": "x"}]}}. Write {{literal}} braces for {sender}.'
+
+
+def test_escapes_render_single_braces():
+    template = PromptTemplate('{{sender}} is {sender}; {"json": true}')
+    assert template.render({'sender': 'a@b.c'}) == '{sender} is a@b.c; {"json": true}'
+
+
+def test_prompts_saved_before_templating_render_unchanged(tmp_path):
+    db = Database(str(tmp_path / 'email_agent.db'))
+    db.initialize()
+    # A database from before templating: literal braces and no template_syntax column
+    with db.transaction() as conn:
+        conn.execute("UPDATE prompts SET prompt_text = ? WHERE prompt_type = 'action_item'", (LEGACY_TEXT,))
+        conn.execute('INSERT INTO prompt_versions (prompts, note) VALUES (?, ?)',
+                     (json.dumps({'action_item': LEGACY_TEXT}), 'legacy'))
+        conn.execute('ALTER TABLE prompts DROP COLUMN template_syntax')
+
+    db.initialize()
+    db.initialize()  # a second start must not escape again
+
+    prompts = PromptService(db)
+    expected = LEGACY_TEXT.replace('{sender}', 'a@b.c')
+    assert PromptTemplate(prompts.get_prompt('action_item')).render({'sender': 'a@b.c'}) == expected
+    legacy_version = prompts.get_versions()[0]['version']
+    snapshot = prompts.get_version(legacy_version)['prompts']['action_item']
+    assert PromptTemplate(snapshot).render({'sender': 'a@b.c'}) == expected
@@ -0,0 +1,92 @@
+import pytest
+
+from models.database import Database
+from services import rate_limiter as rate_limiter_module
+from services.llm_service import LLMService
+from services.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter_module, 'time', fake)
+    return fake
+
+
+def test_no_limits_never_waits(clock):
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(10_000, 1_000)
+    assert clock.slept == 0
+
+
+def test_pause_is_honoured_without_limits(clock):
+    limiter = RateLimiter()
+    limiter.pause(5)
+    limiter.acquire(10, 10)
+    assert clock.slept == pytest.approx(5)
+
+
+def test_requests_per_minute(clock):
+    limiter = RateLimiter(rpm=2)
+    limiter.acquire(0, 0)
+    limiter.acquire(0, 0)
+    assert clock.slept == 0
+    limiter.acquire(0, 0)
+    assert clock.slept == pytest.approx(30, abs=1)
+
+
+def test_settle_refunds_an_overestimate(clock):
+    limiter = RateLimiter(input_tpm=1000)
+    taken = limiter.acquire(800, 0)
+    limiter.settle(taken, 100, 0)
+    limiter.acquire(800, 0)
+    assert clock.slept == 0
+
+
+def test_shared_buckets(tmp_path, clock):
+    db = Database(str(tmp_path / 'email_agent.db'))
+    db.initialize()
+    first, second = RateLimiter(rpm=1, database=db), RateLimiter(rpm=1, database=db)
+    first.acquire(0, 0)
+    second.acquire(0, 0)
+    assert clock.slept == pytest.approx(60, abs=1)
+
+
+class RateLimitedError(Exception):
+    status_code = 429
+    response = None
+
+
+class FailingClient:
+    class messages:
+        @staticmethod
+        def create(**kwargs):
+            raise RateLimitedError("rate limited")
+
+
+def test_failed_call_pauses_and_gives_tokens_back(clock):
+    limiter = RateLimiter(input_tpm=1000)
+    llm = LLMService(client=FailingClient(), rate_limiter=limiter)
+    llm.fallback_to_mock = False
+    with pytest.raises(RateLimitedError):
+        llm._send('x' * 3000)
+
+    # The 429 holds the next request back for the default five seconds...
+    limiter.acquire(900, 0)
+    assert clock.slept == pytest.approx(5)
+    # ...and the failed call's ~750 input tokens were refunded, so this one fits straight away
+    assert limiter._state['input_tokens'][0] == pytest.approx(100, abs=1)
@@ -0,0 +1,121 @@
+import sqlite3
+
+import pytest
+
+from models.database import Database
+from services.email_service import EmailService
+from services.record_cache import RecordCache
+from services.thread_service import ThreadService
+from services.write_queue import WriteQueue
+
+
+EMAILS = [
+    {'sender': f'sender{i}@example.com', 'subject': f'Subject {i}', 'body': f'Body {i}',
+     'timestamp': f'2024-05-0{i + 1}T09:00:00'}
+    for i in range(3)
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'email_agent.db'))
+    database.initialize()
+    return database
+
+
+@pytest.fixture(params=['transaction', 'write_queue'])
+def service(request, db):
+    cache = RecordCache(db, check_interval_ms=0)
+    write_queue = WriteQueue(db) if request.param == 'write_queue' else None
+    service = EmailService(db, thread_service=ThreadService(db, cache=cache), write_queue=write_queue, cache=cache)
+    service.sync_emails(EMAILS, source='test')
+    yield service
+    if write_queue is not None:
+        write_queue.close()
+
+
+def email_ids(db):
+    return [row['id'] for row in db.execute_query('SELECT id FROM emails ORDER BY id')]
+
+
+def external_write(db, sql, params):
+    conn = sqlite3.connect(db.db_path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_repeated_lookups_are_hits(service, db):
+    ids = email_ids(db)
+    service.get_emails_by_ids(ids)
+    service.get_emails_by_ids(ids)
+    stats = service.cache.stats()['tables']['emails']
+    assert (stats['misses'], stats['hits']) == (3, 3)
+
+
+def test_own_write_evicts_only_its_row(service, db):
+    first, second, third = email_ids(db)
+    service.get_emails_by_ids([first, second, third])
+
+    ticket = service.update_email(first, category='Important')
+    if service.write_queue is not None:
+        ticket.result()
+
+    assert service.get_email_by_id(first)['category'] == 'Important'
+    service.get_emails_by_ids([second, third])
+    stats = service.cache.stats()
+    assert stats['resets'] == 0
+    assert stats['tables']['emails']['hits'] == 2
+
+
+def test_thread_assignment_is_an_own_write(service, db):
+    ids = email_ids(db)
+    service.get_emails_by_ids(ids)
+    service.thread_service.assign([service.get_email_by_id(ids[0])])
+    service.get_emails_by_ids(ids)
+    assert service.cache.stats()['resets'] == 0
+
+
+def test_external_write_resets_the_table(service, db):
+    first = email_ids(db)[0]
+    assert service.get_email_by_id(first)['category'] is None
+
+    external_write(db, 'UPDATE emails SET category = ? WHERE id = ?', ('Spam', first))
+
+    assert service.get_email_by_id(first)['category'] == 'Spam'
+    assert service.cache.stats()['resets'] == 1
+
+
+def test_version_check_is_throttled(db):
+    cache = RecordCache(db, check_interval_ms=60_000)
+    service = EmailService(db, cache=cache)
+    service.sync_emails(EMAILS, source='test')
+    first = email_ids(db)[0]
+    service.get_email_by_id(first)
+
+    external_write(db, 'UPDATE emails SET category = ? WHERE id = ?', ('Spam', first))
+    # Within the interval a hit runs no query, so the outside write isn't seen yet
+    assert service.get_email_by_id(first)['category'] is None
+
+    cache.check_interval = 0
+    assert service.get_email_by_id(first)['category'] == 'Spam'
+
+
+def test_draft_edits_and_deletes_invalidate(service, db):
+    email_id = email_ids(db)[0]
+    draft_id = service.create_draft(email_id, 'Re: hello', 'First version')
+    assert service.get_draft_by_id(draft_id)['body'] == 'First version'
+
+    service.update_draft(draft_id, body='Second version')
+    assert service.get_draft_by_id(draft_id)['body'] == 'Second version'
+
+    service.delete_draft(draft_id)
+    assert service.get_draft_by_id(draft_id) is None
+    assert service.cache.stats()['resets'] == 0
+
+
+def test_soft_deleted_emails_are_hidden(service, db):
+    first = email_ids(db)[0]
+    service.get_email_by_id(first)
+    service.sync_emails(EMAILS[1:], source='test')
+    assert service.get_email_by_id(first) is None
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from models.database import Database
+from services.write_queue import WriteQueue
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'email_agent.db'))
+    database.initialize()
+    with database.transaction() as conn:
+        conn.execute('CREATE TABLE items (value INTEGER NOT NULL)')
+    return database
+
+
+def insert(value):
+    return lambda conn: conn.execute('INSERT INTO items (value) VALUES (?)', (value,)).lastrowid
+
+
+def values(db):
+    return sorted(row['value'] for row in db.execute_query('SELECT value FROM items'))
+
+
+def test_ticket_resolves_after_commit(db):
+    write_queue = WriteQueue(db)
+    row_id = write_queue.submit(insert(1)).result(timeout=5)
+    # Visible from another connection as soon as the ticket resolves
+    assert db.execute_query('SELECT value FROM items WHERE rowid = ?', (row_id,))[0]['value'] == 1
+    write_queue.close()
+
+
+def test_failing_write_is_isolated(db):
+    write_queue = WriteQueue(db, max_delay_ms=50)
+    tickets = [write_queue.submit(insert(1)), write_queue.submit(insert(None)), write_queue.submit(insert(3))]
+    write_queue.close()
+    assert tickets[0].result() and tickets[2].result()
+    with pytest.raises(Exception):
+        tickets[1].result()
+    assert values(db) == [1, 3]
+
+
+def test_concurrent_writers_share_transactions(db):
+    write_queue = WriteQueue(db, max_delay_ms=5)
+
+    def produce(start):
+        for value in range(start, start + 50):
+            write_queue.submit(insert(value))
+
+    threads = [threading.Thread(target=produce, args=(i * 50,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_queue.flush(timeout=10)
+
+    stats = write_queue.stats()
+    assert values(db) == list(range(400))
+    assert stats['committed'] == 401  # the flush marker included
+    assert stats['transactions'] < stats['committed']
+    write_queue.close()
+
+
+def test_close_commits_pending_writes_and_rejects_new_ones(db):
+    write_queue = WriteQueue(db)
+    for value in range(20):
+        write_queue.submit(insert(value))
+    write_queue.close()
+    assert values(db) == list(range(20))
+    with pytest.raises(RuntimeError):
+        write_queue.submit(insert(99))
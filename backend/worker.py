@@ -0,0 +1,64 @@
+import os
+import time
+import signal
+import argparse
+from dotenv import load_dotenv
+
+from services.email_service import EmailService
+from services.llm_service import LLMService
+from services.rate_limiter import RateLimiter
+from services.prompt_service import PromptService
+from services.job_service import JobService
+from services.thread_service import ThreadService
+from services.write_queue import WriteQueue
+from models.database import Database
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process queued email jobs. Run several of these to scale out; "
+                    "they coordinate through leases in the SQLite database."
+    )
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="Emails processed at once by this worker (default: LLM_MAX_CONCURRENCY)")
+    parser.add_argument('--lease-seconds', type=float, default=None,
+                        help="How long a claimed email stays reserved without a heartbeat (default: JOB_LEASE_SECONDS or 60)")
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help="Exit once no claimable work is left instead of waiting for new jobs")
+    args = parser.parse_args()
+
+    db = Database()
+    db.initialize()
+    llm_service = LLMService(rate_limiter=RateLimiter.from_env(db))
+    thread_service = ThreadService(db)
+    # Results from all of this worker's threads share commits instead of one transaction each
+    write_queue = WriteQueue(db)
+    jobs = JobService(
+        db, llm_service, EmailService(db, thread_service=thread_service, write_queue=write_queue), PromptService(db),
+        max_workers=args.concurrency, lease_seconds=args.lease_seconds, thread_service=thread_service,
+        write_queue=write_queue
+    )
+
+    # Finish the emails in flight on Ctrl+C / SIGTERM; anything not started stays queued
+    def handle_signal(signum, frame):
+        print(f"Worker {jobs.worker_id} stopping after emails in flight...")
+        jobs.request_stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    print(f"Worker {jobs.worker_id} started (pid {os.getpid()}, concurrency {jobs.max_workers}, "
+          f"lease {jobs.lease_seconds:.0f}s)")
+    start = time.perf_counter()
+    processed = jobs.run(stop_when_idle=args.exit_when_idle)
+    write_queue.close()
+    elapsed = time.perf_counter() - start
+
+    rate = processed / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"Worker {jobs.worker_id} processed {processed} email(s) in {elapsed:.1f}s ({rate:.1f}/min)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+import time
 from datetime import datetime
 
 # Configure page
@@ -20,6 +21,27 @@ if 'chat_messages' not in st.session_state:
     st.session_state.chat_messages = []
 if 'last_selected_email_id' not in st.session_state:
     st.session_state.last_selected_email_id = None
+if 'chat_session_id' not in st.session_state:
+    st.session_state.chat_session_id = None
+if 'http_cache' not in st.session_state:
+    st.session_state.http_cache = {}
+
+def get_cached_json(path):
+    """GET a list endpoint, revalidating the copy from the last rerun with its ETag.
+    
+    An unchanged list comes back as an empty 304, so reruns skip the download and parsing.
+    """
+    cached = st.session_state.http_cache.get(path)
+    headers = {'If-None-Match': cached['etag']} if cached else {}
+    response = requests.get(f"{API_URL}{path}", headers=headers)
+    if response.status_code == 304 and cached:
+        return cached['data']
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    if response.headers.get('ETag'):
+        st.session_state.http_cache[path] = {'etag': response.headers['ETag'], 'data': data}
+    return data
 
 def load_inbox():
     try:
@@ -27,7 +49,7 @@ def load_inbox():
         if response.status_code == 200:
             st.success(f"{response.json()['message']}")
             # Clear chat when loading new inbox
-            st.session_state.chat_messages = []
+            clear_chat()
             st.session_state.selected_email = None
             st.session_state.last_selected_email_id = None
             st.rerun()
@@ -38,32 +60,46 @@ def load_inbox():
 
 def get_emails():
     try:
-        response = requests.get(f"{API_URL}/emails")
-        if response.status_code == 200:
-            return response.json()['emails']
-        return []
+        data = get_cached_json("/emails")
+        return data['emails'] if data else []
     except Exception as e:
         st.error(f"Error fetching emails: {str(e)}")
         return []
 
 def process_emails():
     try:
-        with st.spinner("Processing emails with AI..."):
-            response = requests.post(f"{API_URL}/emails/process")
-            if response.status_code == 200:
-                st.success("Emails processed successfully!")
-                st.rerun()
-            else:
-                st.error(f"Error processing emails: {response.json().get('error', 'Unknown error')}")
+        response = requests.post(f"{API_URL}/emails/process")
+        if response.status_code != 202:
+            st.error(f"Error processing emails: {response.json().get('error', 'Unknown error')}")
+            return
+        
+        # Processing runs as a background job; poll it for progress
+        job_id = response.json()['job_id']
+        progress = st.progress(0.0, text="Processing emails with AI...")
+        while True:
+            job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+            eta = f", about {job['eta_seconds']:.0f}s left" if job.get('eta_seconds') else ""
+            progress.progress(job['progress'], text=f"Processed {job['completed'] + job['failed']} of {job['total']} emails{eta}")
+            if job['status'] not in ('queued', 'running'):
+                break
+            time.sleep(1)
+        
+        if job['status'] == 'completed' and not job['failed']:
+            st.success("Emails processed successfully!")
+            st.rerun()
+        elif job['status'] == 'completed':
+            st.warning(f"Processed {job['completed']} emails; {job['failed']} failed")
+        elif job['status'] == 'paused':
+            st.warning(f"Processing paused after {job['completed']} emails: {job['error']}. "
+                       f"Resume with POST /api/jobs/{job_id}/resume and a higher budget.")
+        else:
+            st.error(f"Processing {job['status']}: {job.get('error') or 'see backend logs'}")
     except Exception as e:
         st.error(f"Error: {str(e)}")
 
 def get_prompts():
     try:
-        response = requests.get(f"{API_URL}/prompts")
-        if response.status_code == 200:
-            return response.json()
-        return {}
+        return get_cached_json("/prompts") or {}
     except Exception as e:
         st.error(f"Error fetching prompts: {str(e)}")
         return {}
@@ -82,20 +118,33 @@ def send_chat_message(query, email_id=None):
     try:
         response = requests.post(
             f"{API_URL}/agent/chat",
-            json={"query": query, "email_id": email_id}
+            json={
+                "query": query,
+                "email_id": email_id,
+                "session_id": st.session_state.chat_session_id
+            }
         )
         if response.status_code == 200:
+            # The backend keeps the conversation history for follow-up questions
+            st.session_state.chat_session_id = response.json().get('session_id')
             return response.json()['response']
         return "Error processing your request"
     except Exception as e:
         return f"Error: {str(e)}"
 
+def clear_chat():
+    if st.session_state.chat_session_id:
+        try:
+            requests.delete(f"{API_URL}/agent/sessions/{st.session_state.chat_session_id}")
+        except Exception:
+            pass
+    st.session_state.chat_messages = []
+    st.session_state.chat_session_id = None
+
 def get_drafts():
     try:
-        response = requests.get(f"{API_URL}/drafts")
-        if response.status_code == 200:
-            return response.json()['drafts']
-        return []
+        data = get_cached_json("/drafts")
+        return data['drafts'] if data else []
     except Exception as e:
         st.error(f"Error fetching drafts: {str(e)}")
         return []
@@ -197,7 +246,7 @@ with tab1:
                         st.session_state.selected_email = email
                         # Clear chat when selecting new email
                         if st.session_state.last_selected_email_id != email['id']:
-                            st.session_state.chat_messages = []
+                            clear_chat()
                             st.session_state.last_selected_email_id = email['id']
                         st.rerun()
                     
@@ -255,7 +304,7 @@ with tab2:
     col1, col2 = st.columns([1, 5])
     with col1:
         if st.button("Clear Chat", use_container_width=True):
-            st.session_state.chat_messages = []
+            clear_chat()
             st.rerun()
     
     # Chat history
@@ -376,6 +425,7 @@ with tab3:
 with tab4:
     st.subheader("Prompt Configuration")
     st.markdown("Configure how the AI processes your emails")
+    st.caption("Prompts can reference {sender}, {subject}, {timestamp}, {category}, {body_truncated} and {today}.")
     
     prompts = get_prompts()
     